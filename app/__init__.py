@@ -1,9 +1,19 @@
 from flask import Flask
 from flask_migrate import Migrate
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 from app.api import api
 from app.bcrypt import bcrypt
+from app.cache import response_cache
+from app.commands import bcrypt_cli, history_cli, keys_cli, sessions_cli, users_cli
 from app.db import db
+from app.instrumentation import query_instrumentation
+from app.keys import key_ring
+from app.metrics import metrics
+from app.ratelimit import limiter
+from app.redis import redis_client
+from app.services.permissions import role_claims_cache
+from app.services.users import username_filter
 from app.settings import config
 
 migrate = Migrate()
@@ -18,13 +28,29 @@ def create_app(test_config=None):
         else f"app.settings.{config('FLASK_ENV').title()}Config"
     )
     app.config.from_object(app_settings)
+    if app.config['PROXY_COUNT']:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_COUNT'])
 
     db.init_app(app)
+    query_instrumentation.init_app(app)
+    metrics.init_app(app)
     migrate.init_app(app, db)
     bcrypt.init_app(app)
+    key_ring.init_app(app)
+    redis_client.init_app(app)
+    response_cache.init_app(app)
+    role_claims_cache.init_app(app)
+    limiter.init_app(app)
+    username_filter.init_app(app)
 
     api.init_app(app)
 
+    app.cli.add_command(bcrypt_cli)
+    app.cli.add_command(users_cli)
+    app.cli.add_command(history_cli)
+    app.cli.add_command(sessions_cli)
+    app.cli.add_command(keys_cli)
+
     @app.shell_context_processor
     def ctx():
         return {"app": app, "db": db}
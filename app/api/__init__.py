@@ -2,13 +2,21 @@ from flask_restx import Api
 
 from app.api.v1 import (
     auth_namespace,
+    jwks_namespace,
     permissions_namespace,
     ping_namespace,
     users_namespace,
 )
+from app.api.validation import compile_validators
+from app.representations import output_json
+
 api = Api(version='1.0', title='Auth API')
+api.representation('application/json')(output_json)
 
 api.add_namespace(ping_namespace, path='/ping')
 api.add_namespace(users_namespace, path='/users')
 api.add_namespace(auth_namespace, path='/auth')
 api.add_namespace(permissions_namespace, path='/permissions')
+api.add_namespace(jwks_namespace, path='/.well-known')
+
+compile_validators(api)
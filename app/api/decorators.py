@@ -1,15 +1,30 @@
 from functools import wraps
 
 import jwt
-from flask import request
+from flask import g, request
 from flask_restx import namespace
 
 from app.services import UserService, RoleService, JWTService
+from app.services.revocation import revocation_service
 
 user_service = UserService()
 role_service = RoleService()
 
 
+def get_token_claims() -> dict:
+    """
+    Возвращает данные access_token из заголовка Authorization.
+    Токен декодируется один раз за запрос, результат хранится в flask.g вместе с самим токеном:
+    контекст приложения может пережить запрос, и тогда в g остаются claims чужого токена.
+    :return:
+    """
+    token = request.headers.get('Authorization')
+    if g.get('token') != token or 'token_claims' not in g:
+        g.token_claims = JWTService.decode_token_cached(token)
+        g.token = token
+    return g.token_claims
+
+
 def login_required(method):
     """
     Проверяем валидность access_token
@@ -18,15 +33,16 @@ def login_required(method):
     """
     @wraps(method)
     def wrapper(*args, **kwargs):
-        access_token = request.headers.get('Authorization')
         try:
-            JWTService.decode_token(access_token)
-        except jwt.exceptions.DecodeError:
-            return namespace.abort(401, 'Неверный формат токена.')
-        except jwt.exceptions.ExpiredSignatureErro:
+            claims = get_token_claims()
+        except jwt.exceptions.ExpiredSignatureError:
             return namespace.abort(401, 'Срок действия токен истек.')
+        except jwt.exceptions.InvalidTokenError:
+            return namespace.abort(401, 'Неверный формат токена.')
+        if revocation_service.is_revoked(claims):
+            return namespace.abort(401, 'Токен отозван.')
 
-        return method(args, **kwargs)
+        return method(*args, **kwargs)
     return wrapper
 
 
@@ -40,11 +56,9 @@ def does_user_have_role(role_name):
     def decorator(method):
         @wraps(method)
         def wrapper(*args, **kwargs):
-            access_token = request.headers.get('Authorization')
-            decode_token = JWTService.decode_token(access_token)
-            if role_name not in decode_token['roles']:
+            if role_name not in get_token_claims()['roles']:
                 return namespace.abort(403, f'Пользователю не назначена роль {role_name}')
 
-            return method(args, **kwargs)
+            return method(*args, **kwargs)
         return wrapper
     return decorator
@@ -0,0 +1,39 @@
+import orjson
+from flask import Response, request, stream_with_context
+from flask_restx import abort, inputs, reqparse
+
+from app.api.serializers import get_serializer, model_columns
+from app.services.base import AbstractService, InvalidCursor, decode_cursor
+
+NDJSON = 'application/x-ndjson'
+
+pagination_parser = reqparse.RequestParser()
+pagination_parser.add_argument('limit', type=inputs.int_range(1, 1000), default=100, location='args',
+                               help='Размер страницы.')
+pagination_parser.add_argument('cursor', location='args',
+                               help='Курсор следующей страницы из заголовка X-Next-Cursor.')
+
+
+def paginate(service: AbstractService, model, query=None, descending: bool = False):
+    """
+    Отдаёт страницу объектов, курсор следующей страницы передаётся в заголовке X-Next-Cursor.
+    Если клиент принимает application/x-ndjson, отдаёт все объекты начиная с курсора потоком,
+    по одному объекту на строку. Если все поля модели ответа — колонки, строки выбираются кортежами.
+    """
+    args = pagination_parser.parse_args()
+    try:
+        if args['cursor']:
+            decode_cursor(args['cursor'])
+    except InvalidCursor as e:
+        abort(400, str(e))
+
+    serializer = get_serializer(model)
+    columns = model_columns(service.model, model)
+    if request.accept_mimetypes.best_match(['application/json', NDJSON]) == NDJSON:
+        rows = service.iter_all(query, args['cursor'], descending, columns=columns)
+        lines = (orjson.dumps(serializer(row), option=orjson.OPT_APPEND_NEWLINE) for row in rows)
+        return Response(stream_with_context(lines), mimetype=NDJSON)
+
+    items, next_cursor = service.get_page(query, args['limit'], args['cursor'], descending, columns)
+    headers = {'X-Next-Cursor': next_cursor} if next_cursor else {}
+    return [serializer(item) for item in items], 200, headers
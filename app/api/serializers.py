@@ -0,0 +1,173 @@
+from datetime import date, datetime
+from functools import wraps
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from flask import current_app, has_request_context, request
+from flask_restx import fields, marshal
+from flask_restx.inputs import boolean
+from flask_restx.utils import merge, unpack
+
+Serializer = Callable[[object], dict]
+
+# Выражение для непустого значения v простого поля.
+FORMATS = {
+    fields.Raw: 'v',
+    fields.String: '(v if v.__class__ is str else str(v))',
+    fields.Integer: 'int(v)',
+    fields.Float: 'float(v)',
+    fields.Boolean: '(v if v.__class__ is bool else boolean(v))',
+    fields.DateTime: '(v.isoformat() if v.__class__ is datetime else format_datetime(v))',
+}
+SIMPLE_FIELDS = tuple(FORMATS)
+
+
+def format_datetime(value) -> str:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day).isoformat()
+    raise ValueError('Неподдерживаемый формат даты.')
+
+
+def _is_simple(field) -> bool:
+    return (type(field) in FORMATS and field.default is None
+            and (type(field) is not fields.DateTime or field.dt_format == 'iso8601'))
+
+
+def _is_nested(field) -> bool:
+    return type(field) is fields.Nested and not (field.skip_none or field.as_list)
+
+
+def _field_code(index: int, key: str, field, namespace: dict) -> Tuple[Optional[str], str]:
+    """
+    Атрибут объекта и выражение для значения поля, где {value} — обращение к атрибуту.
+    Для поля без быстрого пути атрибут None, а выражение — вызов field.output.
+    """
+    attribute = field.attribute if field.attribute is not None else key
+    fallback = f'output_{index}(obj)'
+    namespace[f'output_{index}'] = lambda obj: field.output(key, obj)
+    if not isinstance(attribute, str) or '.' in attribute or field.mask:
+        return None, fallback
+
+    if _is_simple(field):
+        return attribute, f'(None if (v := {{value}}) is None else {FORMATS[type(field)]})'
+
+    if _is_nested(field):
+        namespace[f'nested_{index}'] = compile_model(field.nested)
+        return attribute, f'({fallback} if (v := {{value}}) is None else nested_{index}(v))'
+
+    container = getattr(field, 'container', None)
+    if type(field) is fields.List and _is_nested(container) and not (
+            container.attribute or container.allow_null or container.default is not None):
+        namespace[f'nested_{index}'] = compile_model(container.nested)
+        return attribute, (f'({fallback} if (v := {{value}}) is None or v.__class__ in (dict, str) '
+                           f'else [nested_{index}(item) for item in v])')
+    return None, fallback
+
+
+def compile_model(model) -> Serializer:
+    """
+    Строит из модели flask-restx функцию сериализации одного объекта.
+    Результат совпадает с marshal(obj, model), но код функции генерируется один раз по полям модели,
+    а объект может быть ORM-моделью, строкой выборки по колонкам или словарём.
+    Поля, для которых быстрого пути нет, и значения, которые не удалось отформатировать,
+    сериализуются самим flask-restx.
+    """
+    if getattr(model, '__mask__', None):
+        return lambda obj: marshal(obj, model)
+    namespace = {
+        'boolean': boolean,
+        'datetime': datetime,
+        'format_datetime': format_datetime,
+        'marshal': marshal,
+        'model': model,
+    }
+    items = [
+        (key, *_field_code(index, key, field() if isinstance(field, type) else field, namespace))
+        for index, (key, field) in enumerate(getattr(model, 'resolved', model).items())
+    ]
+
+    def render(access: str) -> str:
+        return ', '.join(
+            f'{key!r}: {code.format(value=access.format(attribute)) if attribute else code}'
+            for key, attribute, code in items
+        )
+
+    source = (
+        'def serialize(obj):\n'
+        '    try:\n'
+        '        if obj.__class__ is dict:\n'
+        f'            return {{{render("obj.get({!r})")}}}\n'
+        '        if obj is None:\n'
+        '            return marshal(obj, model)\n'
+        f'        return {{{render("getattr(obj, {!r}, None)")}}}\n'
+        '    except (TypeError, ValueError):\n'
+        '        return marshal(obj, model)\n'
+    )
+    exec(compile(source, f'<serializer {model.name}>', 'exec'), namespace)
+    return namespace['serialize']
+
+
+_serializers = {}
+
+
+def get_serializer(model) -> Serializer:
+    serializer = _serializers.get(model.name)
+    if serializer is None:
+        serializer = _serializers[model.name] = compile_model(model)
+    return serializer
+
+
+def serialize(data, model):
+    """marshal(data, model) через скомпилированный сериализатор."""
+    serializer = get_serializer(model)
+    if isinstance(data, list):
+        return [serializer(item) for item in data]
+    return serializer(data)
+
+
+def serialize_with(model, as_list: bool = False, code: int = 200, description: Optional[str] = None):
+    """
+    Замена namespace.marshal_with: та же документация swagger, сериализация — скомпилированной функцией.
+    Как и marshal_with, ставится над методом ресурса, а метод возвращает объекты или (объекты, код, заголовки).
+    С заголовком маски полей (X-Fields) ответ строит обычный marshal flask-restx.
+    """
+    def decorator(method):
+        doc = {
+            'responses': {str(code): (description, [model] if as_list else model, {})},
+            '__mask__': True,
+        }
+        method.__apidoc__ = merge(getattr(method, '__apidoc__', {}), doc)
+
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            response = method(*args, **kwargs)
+            mask = request.headers.get(current_app.config['RESTX_MASK_HEADER']) if has_request_context() else None
+            convert = (lambda data: marshal(data, model, mask=mask)) if mask else (lambda data: serialize(data, model))
+            if isinstance(response, tuple):
+                data, status, headers = unpack(response)
+                return convert(data), status, headers
+            return convert(response)
+        return wrapper
+    return decorator
+
+
+def model_columns(orm_model, model, exclude: Iterable[str] = ()) -> Optional[List]:
+    """
+    Колонки orm_model для полей модели ответа, кроме exclude, плюс id и created для пагинации.
+    None, если какое-то поле не простая колонка: такую модель нужно сериализовать из объектов ORM.
+    """
+    columns = orm_model.__table__.columns
+    names = []
+    for key, field in getattr(model, 'resolved', model).items():
+        field = field() if isinstance(field, type) else field
+        name = field.attribute or key
+        if key in exclude:
+            continue
+        if type(field) not in SIMPLE_FIELDS or not isinstance(name, str) or name not in columns:
+            return None
+        names.append(name)
+    for name in ('id', 'created'):
+        if name not in names and name in columns:
+            names.append(name)
+    return [getattr(orm_model, name) for name in names]
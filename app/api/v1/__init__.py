@@ -1,4 +1,5 @@
 from app.api.v1.auth import auth_namespace
+from app.api.v1.jwks import jwks_namespace
 from app.api.v1.permissions import permissions_namespace
 from app.api.v1.ping import ping_namespace
 from app.api.v1.users import users_namespace
@@ -1,13 +1,19 @@
-from flask_restx import Namespace, Resource, fields
+import jwt
+from flask import current_app, request
+from flask_restx import Namespace, fields
 
-from app.services import SessionService, UserService, AuthService
+from app.api.decorators import does_user_have_role, get_token_claims, login_required
+from app.api.serializers import serialize_with
+from app.api.validation import BaseResource
+from app.ratelimit import limiter
+from app.services import SessionService, UserService, AuthService, JWTService
+from app.services.revocation import revocation_service
 
 
 auth_namespace = Namespace('auth')
 
 user_service = UserService()
 session_service = SessionService()
-auth_service = AuthService()
 
 
 user = auth_namespace.model(
@@ -31,6 +37,14 @@ refresh_token = auth_namespace.model(
     'Refresh token', {'refresh_token': fields.String(required=True)}
 )
 
+logout = auth_namespace.model(
+    'Logout',
+    {
+        'refresh_token': fields.String(),
+        'all_devices': fields.Boolean(default=False),
+    }
+)
+
 tokens = auth_namespace.model(
     'Tokens',
     {
@@ -39,40 +53,130 @@ tokens = auth_namespace.model(
     }
 )
 
+introspect = auth_namespace.model(
+    'Introspect',
+    {'tokens': fields.List(fields.String, required=True, min_items=1)},
+)
+
+token_status = auth_namespace.model(
+    'Token status',
+    {
+        'active': fields.Boolean(description='Подпись верна, срок не истёк, токен не отозван.'),
+        'revoked': fields.Boolean,
+        'claims': fields.Raw,
+        'expires_in': fields.Integer(description='Секунд до истечения токена.'),
+        'error': fields.String(description='expired, invalid или revoked для неактивного токена.'),
+    }
+)
 
-class Register(Resource):
-    @auth_namespace.marshal_with(tokens)
+introspection = auth_namespace.model(
+    'Introspection',
+    {'tokens': fields.List(fields.Nested(token_status))},
+)
+
+
+class Register(BaseResource):
+    @serialize_with(tokens)
     @auth_namespace.expect(user, validate=True)
     @auth_namespace.response(201, 'Успех.')
     @auth_namespace.response(400, 'Не переданы обязательные заголовки.')
     @auth_namespace.response(400, 'Пользователь уже зарегистрирован.')
+    @auth_namespace.response(429, 'Слишком много попыток, повторите позже.')
+    @limiter.limit('register')
     def post(self):
         """Регистрация нового пользователя."""
-        return auth_service.register()
+        return AuthService().register()
 
 
-class Auth(Resource):
-    @auth_namespace.marshal_with(tokens)
+class Auth(BaseResource):
+    @serialize_with(tokens)
     @auth_namespace.expect(login, validate=True)
     @auth_namespace.response(200, 'Успех.')
     @auth_namespace.response(400, 'Не переданы обязательные заголовки.')
     @auth_namespace.response(404, 'Неверный пароль.')
+    @auth_namespace.response(429, 'Слишком много попыток, повторите позже.')
+    @limiter.limit('login')
     def post(self):
         """Аутентификация пользователя."""
-        return auth_service.auth()
+        return AuthService().auth()
 
 
-class Refresh(Resource):
-    @auth_namespace.marshal_with(tokens)
+class Refresh(BaseResource):
+    @serialize_with(tokens)
     @auth_namespace.expect(refresh_token, validate=True)
     @auth_namespace.response(201, 'Успех')
     @auth_namespace.response(400, 'Не переданы обязательные заголовки.')
     @auth_namespace.response(400, 'Refresh-токен истек, либо не существует')
+    @auth_namespace.response(429, 'Слишком много попыток, повторите позже.')
+    @limiter.limit('refresh')
     def post(self):
         """Генерация новых access и refresh токенов в обмен на корректный refresh-токен"""
-        return auth_service.refresh()
+        return AuthService().refresh()
+
+
+class Logout(BaseResource):
+    @auth_namespace.expect(logout, validate=True)
+    @auth_namespace.response(200, 'Выход выполнен.')
+    @auth_namespace.response(401, 'Токен отозван.')
+    @auth_namespace.response(403, 'Refresh-токен выдан другому пользователю.')
+    @login_required
+    def post(self):
+        """Отзыв access-токена и refresh-токена; с all_devices — всех токенов пользователя."""
+        post_data = request.get_json(silent=True) or {}
+        claims = get_token_claims()
+        refresh_token = post_data.get('refresh_token')
+        refresh_claims = None
+        if refresh_token:
+            # Недействительный refresh-токен обменять уже нельзя, его сессию отзывать не нужно.
+            try:
+                refresh_claims = JWTService.decode_token(refresh_token)
+            except jwt.exceptions.InvalidTokenError:
+                pass
+        if refresh_claims and refresh_claims.get('user_id') != claims.get('user_id'):
+            return auth_namespace.abort(403, 'Refresh-токен выдан другому пользователю.')
+        revocation_service.revoke(claims)
+        if refresh_claims:
+            revocation_service.revoke(refresh_claims)
+            session_service.revoke(refresh_token)
+        if post_data.get('all_devices'):
+            revocation_service.revoke_user(claims['user_id'])
+        return {'message': 'Выход выполнен.'}, 200
+
+
+class Introspect(BaseResource):
+
+    @property
+    def payload_limit(self) -> int:
+        """Пачка из INTROSPECTION_MAX_BATCH токенов по INTROSPECTION_MAX_TOKEN_SIZE байт."""
+        config = current_app.config
+        return config['INTROSPECTION_MAX_BATCH'] * config['INTROSPECTION_MAX_TOKEN_SIZE'] + config['MAX_PAYLOAD_SIZE']
+
+    @serialize_with(introspection)
+    @auth_namespace.expect(introspect, validate=True)
+    @auth_namespace.response(200, 'Успех.')
+    @auth_namespace.response(400, 'Слишком много токенов в запросе.')
+    @auth_namespace.response(401, 'Токен отозван.')
+    @auth_namespace.response(403, 'Пользователю не назначена роль service.')
+    @auth_namespace.response(413, 'Тело запроса больше допустимого.')
+    @login_required
+    @does_user_have_role('service')
+    def post(self):
+        """
+        Проверка пачки токенов для API gateway: статус каждого токена в порядке запроса.
+        Cache-Control разрешает кешировать ответ, пока не истечёт первый из активных токенов.
+        """
+        tokens = request.get_json()['tokens']
+        max_batch = current_app.config['INTROSPECTION_MAX_BATCH']
+        if len(tokens) > max_batch:
+            return auth_namespace.abort(400, f'Можно проверить не больше {max_batch} токенов за запрос.')
+        results = JWTService.introspect(tokens)
+        ttls = [result['expires_in'] for result in results if result['active']]
+        cache_control = f'private, max-age={min(ttls)}' if ttls else 'no-store'
+        return {'tokens': results}, 200, {'Cache-Control': cache_control}
 
 
 auth_namespace.add_resource(Register, '/register')
 auth_namespace.add_resource(Auth, '/login')
 auth_namespace.add_resource(Refresh, '/refresh')
+auth_namespace.add_resource(Logout, '/logout')
+auth_namespace.add_resource(Introspect, '/introspect')
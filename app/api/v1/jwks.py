@@ -0,0 +1,17 @@
+from flask import current_app
+from flask_restx import Namespace
+
+from app.api.validation import BaseResource
+from app.keys import key_ring
+
+jwks_namespace = Namespace('well-known')
+
+
+class JWKS(BaseResource):
+    @jwks_namespace.response(200, 'Открытые ключи для проверки токенов.')
+    def get(self):
+        """Открытые ключи подписи токенов в формате JWKS."""
+        return key_ring.jwks, 200, {'Cache-Control': f'public, max-age={current_app.config["JWKS_MAX_AGE"]}'}
+
+
+jwks_namespace.add_resource(JWKS, '/jwks.json')
@@ -1,7 +1,11 @@
 from flask import request
-from flask_restx import Namespace, Resource, fields
+from flask_restx import Namespace, fields
 
 from app.api.decorators import login_required, does_user_have_role
+from app.api.serializers import model_columns, serialize_with
+from app.api.validation import BaseResource
+from app.cache import response_cache
+from app.models import Role, User
 from app.services import RoleService, UserService
 from app.api.v1.users import user
 
@@ -30,14 +34,19 @@ updated_users = permissions_namespace.model(
     }
 )
 
+role_columns = model_columns(Role, role, exclude=('users',))
+user_columns = model_columns(User, user)
 
-class RoleList(Resource):
-    @permissions_namespace.marshal_with(role, as_list=True)
+
+class RoleList(BaseResource):
     @login_required
     @does_user_have_role('admin')
+    @response_cache.cached(Role, depends_on=[User])
+    @serialize_with(role, as_list=True)
+    @permissions_namespace.response(304, 'Не изменился с версии из If-None-Match.')
     def get(self):
         """Список всех ролей."""
-        return role_service.get_all(), 200
+        return role_service.get_rows_with_users(role_columns, user_columns), 200
 
     @permissions_namespace.expect(role, validate=True)
     @permissions_namespace.response(201, 'Добавлена новая роль <role_name>.')
@@ -59,15 +68,17 @@ class RoleList(Resource):
         return response, 201
 
 
-class RoleDetail(Resource):
-    @permissions_namespace.marshal_with(role)
-    @permissions_namespace.response(200, 'Успех.')
-    @permissions_namespace.response(404, 'Роли <role_id> не существует.')
+class RoleDetail(BaseResource):
     @login_required
     @does_user_have_role('admin')
+    @response_cache.cached(Role, entity='role_id', depends_on=[User])
+    @serialize_with(role)
+    @permissions_namespace.response(200, 'Успех.')
+    @permissions_namespace.response(304, 'Не изменился с версии из If-None-Match.')
+    @permissions_namespace.response(404, 'Роли <role_id> не существует.')
     def get(self, role_id):
         """Возвращает одну роль."""
-        role = role_service.get_by_pk(role_id)
+        role = role_service.get_by_pk(role_id, profile='with_users')
         if not role:
             permissions_namespace.abort(404, f'Роли {role_id} не существует.')
         return role, 200
@@ -84,7 +95,7 @@ class RoleDetail(Resource):
         name = post_data.get('name')
         response_object = {}
 
-        role = role_service.get_by_pk(role_id)
+        role = role_service.get_by_pk(role_id, profile='with_users')
         if not role:
             permissions_namespace.abort(404, f'Роли {role_id} не существует.')
 
@@ -98,8 +109,8 @@ class RoleDetail(Resource):
         return response_object, 200
 
 
-class RoleUsers(Resource):
-    @permissions_namespace.marshal_with(role)
+class RoleUsers(BaseResource):
+    @serialize_with(role)
     @permissions_namespace.expect(updated_users, validate=True)
     @permissions_namespace.response(201, 'Пользователи обновлены.')
     @permissions_namespace.response(404, 'Роли <role_id> не существует.')
@@ -107,17 +118,16 @@ class RoleUsers(Resource):
     @does_user_have_role('admin')
     def patch(self, role_id):
         """Добавляет/удаляет пользователей к роли."""
-        role = role_service.get_by_pk(role_id)
+        role = role_service.get_by_pk(role_id, profile='with_users')
         if not role:
             permissions_namespace.abort(404, f'Роли {role_id} не существует.')
         data = request.get_json()
-        actual_usernames = {user.username for user in role.users}
-        updated_usernames = (
-            actual_usernames.union(set(data.get('added_users', [])))
-                            .difference(set(data.get('deleted_users', [])))
-        )
-        users = user_service.get_by_usernames(updated_usernames)
-        role_service.update(role, users=list(users))
+        deleted_usernames = set(data.get('deleted_users', []))
+        users = [user for user in role.users if user.username not in deleted_usernames]
+        added_usernames = set(data.get('added_users', [])) - deleted_usernames - {user.username for user in users}
+        if added_usernames:
+            users.extend(user_service.get_by_usernames(added_usernames))
+        role_service.update(role, users=users)
         return role, 201
 
 
@@ -1,13 +1,14 @@
 import datetime
 
-from flask_restx import Namespace, Resource
+from flask_restx import Namespace
 
+from app.api.validation import BaseResource
 from app.settings import config
 
 ping_namespace = Namespace("ping")
 
 
-class Ping(Resource):
+class Ping(BaseResource):
     def get(self):
         return {
             'env': config('FLASK_ENV'),
@@ -1,10 +1,19 @@
-from flask import request
-from flask_restx import Namespace, Resource, fields
+from io import TextIOWrapper
 
-from app.api.decorators import login_required
-from app.services import UserService
+from flask import current_app, request
+from flask_restx import Namespace, fields
+
+from app.api.decorators import does_user_have_role, login_required
+from app.api.pagination import NDJSON, paginate, pagination_parser
+from app.api.serializers import serialize_with
+from app.api.validation import BaseResource
+from app.cache import response_cache
+from app.models import User
+from app.services import HistoryService, UserImportService, UserService
+from app.services.imports import readers
 
 user_service = UserService()
+history_service = HistoryService()
 users_namespace = Namespace('users')
 
 
@@ -44,13 +53,33 @@ history = users_namespace.model(
     }
 )
 
+import_failure = users_namespace.model(
+    'Import failure',
+    {
+        'line': fields.Integer(),
+        'username': fields.String(),
+        'error': fields.String(),
+    }
+)
+
+import_report = users_namespace.model(
+    'Import report',
+    {
+        'created': fields.Integer(),
+        'failed': fields.List(fields.Nested(import_failure)),
+    }
+)
+
 
-class UserList(Resource):
+class UserList(BaseResource):
 
-    @users_namespace.marshal_with(user, as_list=True)
+    @users_namespace.expect(pagination_parser)
+    @users_namespace.produces(['application/json', NDJSON])
+    @users_namespace.response(200, 'Успех.', [user])
+    @users_namespace.response(400, 'Некорректный курсор.')
     def get(self):
-        """Возвращает список всех пользователей."""
-        return user_service.get_all(), 200
+        """Возвращает страницу списка пользователей."""
+        return paginate(user_service, user)
 
     @users_namespace.expect(user_post, validate=True)
     @users_namespace.response(201, 'Добавлен новый пользователь <user_username>.')
@@ -70,9 +99,33 @@ class UserList(Resource):
         return response_object, 201
 
 
-class UserDetail(Resource):
-    @users_namespace.marshal_with(user)
+class UserBulk(BaseResource):
+    # Файл импорта читается потоком и может быть сколь угодно большим.
+    max_payload = 0
+    formats = {
+        'application/x-ndjson': 'ndjson',
+        'text/csv': 'csv',
+    }
+
+    @users_namespace.response(200, 'Отчёт об импорте.', import_report)
+    @users_namespace.response(415, 'Поддерживаются только application/x-ndjson и text/csv.')
+    @login_required
+    @does_user_have_role('admin')
+    def post(self):
+        """Массовый импорт пользователей из потока NDJSON или CSV."""
+        fmt = self.formats.get(request.mimetype)
+        if not fmt:
+            users_namespace.abort(415, 'Поддерживаются только application/x-ndjson и text/csv.')
+        stream = TextIOWrapper(request.stream, encoding='utf-8', newline='')
+        import_service = UserImportService(current_app.config['USERS_IMPORT_CHUNK_SIZE'])
+        return import_service.import_users(readers[fmt](stream)), 200
+
+
+class UserDetail(BaseResource):
+    @response_cache.cached(User, entity='user_id')
+    @serialize_with(user)
     @users_namespace.response(200, 'Успех.')
+    @users_namespace.response(304, 'Не изменился с версии из If-None-Match.')
     @users_namespace.response(404, 'Пользователя <user_id> не существует.')
     def get(self, user_id):
         """Возвращает одного пользователя."""
@@ -82,8 +135,8 @@ class UserDetail(Resource):
         return user, 200
 
 
-class UserChangePassword(Resource):
-    @users_namespace.marshal_with(user)
+class UserChangePassword(BaseResource):
+    @serialize_with(user)
     @users_namespace.expect(passwords, validate=True)
     @users_namespace.response(201, 'Успех.')
     @users_namespace.response(404, 'Пользователя <user_id> не существует.')
@@ -104,19 +157,22 @@ class UserChangePassword(Resource):
         return user, 201
 
 
-class UserHistory(Resource):
-    @users_namespace.marshal_with(history, as_list=True)
-    @users_namespace.response(200, 'Успех.')
+class UserHistory(BaseResource):
+    @users_namespace.expect(pagination_parser)
+    @users_namespace.produces(['application/json', NDJSON])
+    @users_namespace.response(200, 'Успех.', [history])
+    @users_namespace.response(400, 'Некорректный курсор.')
     @users_namespace.response(404, 'Пользователя <user_id> не существует.')
     def get(self, user_id):
-        """Возвращает историю логинов пользователя."""
+        """Возвращает историю логинов пользователя, начиная с последних."""
         user = user_service.get_by_pk(user_id)
         if not user:
             users_namespace.abort(404, f'Пользователя {user_id} не существует.')
-        return user.history, 200
+        return paginate(history_service, history, history_service.get_by_user(user), descending=True)
 
 
 users_namespace.add_resource(UserList, '')
+users_namespace.add_resource(UserBulk, '/bulk')
 users_namespace.add_resource(UserDetail, '/<user_id>')
 users_namespace.add_resource(UserChangePassword, '/<user_id>/change_password')
 users_namespace.add_resource(UserHistory, '/<user_id>/history')
@@ -0,0 +1,84 @@
+from typing import Callable, Dict
+
+import fastjsonschema
+from flask import current_app, request
+from flask_restx import Resource, abort
+from flask_restx.model import ModelBase
+
+Validator = Callable[[object], object]
+
+DRAFT4 = 'http://json-schema.org/draft-04/schema#'
+
+_validators: Dict[str, Validator] = {}
+
+
+def compile_validator(model, api) -> Validator:
+    """
+    Генерирует функцию проверки JSON Schema модели (draft 4, как у flask-restx).
+    Вложенные модели подставляются из определений api.
+    """
+    definitions = {name: definition.__schema__ for name, definition in api.models.items()}
+    schema = {'$schema': DRAFT4, **model.__schema__, 'definitions': definitions}
+    return fastjsonschema.compile(schema, use_default=False)
+
+
+def compile_validators(api) -> None:
+    """Компилирует проверки всех моделей api, чтобы первый запрос не платил за генерацию кода."""
+    for name, model in api.models.items():
+        _validators[name] = compile_validator(model, api)
+
+
+def validate(model, data, api) -> None:
+    """
+    Проверяет data скомпилированной функцией. Если данные не прошли, проверку повторяет
+    flask-restx: он формирует ответ 400 с теми же сообщениями об ошибках, что и раньше.
+    """
+    validator = _validators.get(model.name)
+    if validator is None:
+        validator = _validators[model.name] = compile_validator(model, api)
+    try:
+        validator(data)
+    except fastjsonschema.JsonSchemaException:
+        model.validate(data, api.refresolver, api.format_checker)
+
+
+class BaseResource(Resource):
+    """
+    Ресурс с проверкой тела запроса скомпилированными валидаторами вместо jsonschema на каждый запрос
+    и ограничением размера тела: слишком большое тело отклоняется с 413 по Content-Length, до разбора JSON.
+    max_payload — предел в байтах, None — MAX_PAYLOAD_SIZE из настроек, 0 — без ограничения;
+    предел, зависящий от других настроек, ресурс задаёт, переопределив payload_limit.
+    """
+    max_payload = None
+
+    def dispatch_request(self, *args, **kwargs):
+        self.check_payload_size()
+        return super().dispatch_request(*args, **kwargs)
+
+    @property
+    def payload_limit(self) -> int:
+        return self.max_payload if self.max_payload is not None else current_app.config['MAX_PAYLOAD_SIZE']
+
+    def check_payload_size(self) -> None:
+        limit = self.payload_limit
+        if not limit:
+            return
+        if request.content_length is None and request.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            abort(411, 'Нужен заголовок Content-Length.')
+        if request.content_length and request.content_length > limit:
+            abort(413, f'Тело запроса больше {limit} байт.')
+
+    def validate_payload(self, func):
+        doc = getattr(func, '__apidoc__', None)
+        if not doc:
+            return
+        enabled = doc.get('validate')
+        if not (enabled if enabled is not None else self.api._validate):
+            return
+        for expect in doc.get('expect', []):
+            if isinstance(expect, list) and len(expect) == 1 and isinstance(expect[0], ModelBase):
+                data = request.get_json()
+                for item in data if isinstance(data, list) else [data]:
+                    validate(expect[0], item, self.api)
+            if isinstance(expect, ModelBase):
+                validate(expect, request.get_json(), self.api)
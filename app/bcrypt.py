@@ -1,3 +1,129 @@
-from flask_bcrypt import Bcrypt
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from secrets import token_urlsafe
+from threading import Lock
+from typing import Iterable, List
+
+from flask_bcrypt import Bcrypt as BaseBcrypt
+from gevent.monkey import is_module_patched
+from gevent.threadpool import ThreadPool
+from werkzeug.exceptions import ServiceUnavailable
+
+from app.metrics import password_hashing_queue_depth, password_hashing_rejected, password_hashing_seconds
+
+
+class HashingPoolSaturated(ServiceUnavailable):
+    description = 'Сервис перегружен, повторите запрос позже.'
+
+
+class HashingExecutor:
+    """
+    Ограниченный пул нативных потоков для bcrypt.
+    bcrypt отпускает GIL, поэтому хеширование не блокирует остальные гринлеты воркера.
+    Если пул и очередь заполнены, операция сразу отклоняется с 503 и Retry-After.
+    Размеры пула и очереди берутся из настроек <setting>_POOL_SIZE и <setting>_MAX_QUEUE.
+    """
+
+    def __init__(self, setting: str = 'PASSWORD_HASHING', size: int = 2):
+        self.setting = setting
+        self.size = size
+        self.max_queue = 32
+        self.retry_after = 1
+        self._pool = None
+        self._pending = 0
+        self._lock = Lock()
+
+    def init_app(self, app):
+        self.size = app.config.get(f'{self.setting}_POOL_SIZE', self.size)
+        self.max_queue = app.config.get(f'{self.setting}_MAX_QUEUE', self.max_queue)
+        self.retry_after = app.config.get('PASSWORD_HASHING_RETRY_AFTER', self.retry_after)
+        self._pool = None
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    @property
+    def pool(self):
+        # Пул создаётся при первом обращении, то есть уже в процессе воркера после fork.
+        if self._pool is None:
+            if is_module_patched('threading'):
+                self._pool = ThreadPool(self.size)
+            else:
+                self._pool = ThreadPoolExecutor(self.size, thread_name_prefix='bcrypt')
+        return self._pool
+
+    def run(self, func, *args):
+        with self._lock:
+            if self._pending >= self.size + self.max_queue:
+                password_hashing_rejected.inc()
+                raise HashingPoolSaturated(retry_after=self.retry_after)
+            self._pending += 1
+        password_hashing_queue_depth.inc()
+        try:
+            if isinstance(self.pool, ThreadPool):
+                return self.pool.apply(func, args)
+            return self.pool.submit(func, *args).result()
+        finally:
+            with self._lock:
+                self._pending -= 1
+            password_hashing_queue_depth.dec()
+
+    def map(self, func, iterable) -> list:
+        """
+        Выполняет func для каждого элемента параллельно во всех потоках пула.
+        Не ограничено очередью, поэтому годится только для пула, отдельного от пула запросов.
+        """
+        return list(self.pool.map(func, iterable))
+
+
+class Bcrypt(BaseBcrypt):
+
+    def __init__(self, app=None):
+        self.executor = HashingExecutor()
+        # Массовый импорт хеширует в своём пуле: пачка из тысяч паролей не занимает потоки
+        # и очередь, которые ждут логины и регистрации.
+        self.import_executor = HashingExecutor(setting='PASSWORD_IMPORT_HASHING', size=1)
+        self._dummy_hash = None
+        super().__init__(app)
+
+    def init_app(self, app):
+        super().init_app(app)
+        self.executor.init_app(app)
+        self.import_executor.init_app(app)
+        self._dummy_hash = None
+
+    def generate_password_hash(self, password, rounds=None):
+        with password_hashing_seconds.labels(operation='hash').time():
+            return self.executor.run(super().generate_password_hash, password, rounds)
+
+    def check_password_hash(self, pw_hash, password):
+        with password_hashing_seconds.labels(operation='check').time():
+            return self.executor.run(super().check_password_hash, pw_hash, password)
+
+    def check_dummy_password(self, password: str) -> bool:
+        """
+        Проверяет пароль по хешу случайного пароля той же стоимости и всегда возвращает False.
+        Ответ для несуществующего пользователя занимает столько же времени, сколько для неверного пароля.
+        """
+        if self._dummy_hash is None:
+            self._dummy_hash = super().generate_password_hash(token_urlsafe()).decode('utf-8')
+        self.check_password_hash(self._dummy_hash, password or '')
+        return False
+
+    def generate_password_hashes(self, passwords: Iterable[str]) -> List[str]:
+        """Хеширует пачку паролей параллельно в пуле импорта."""
+        hashes = self.import_executor.map(partial(BaseBcrypt.generate_password_hash, self), passwords)
+        return [pw_hash.decode('utf-8') for pw_hash in hashes]
+
+    @staticmethod
+    def get_rounds(pw_hash: str) -> int:
+        """Возвращает стоимость (log rounds), с которой построен хеш."""
+        return int(pw_hash.split('$')[2])
+
+    def needs_rehash(self, pw_hash: str) -> bool:
+        """Проверяет, отличается ли стоимость хеша от BCRYPT_LOG_ROUNDS."""
+        return self.get_rounds(pw_hash) != self._log_rounds
+
 
 bcrypt = Bcrypt()
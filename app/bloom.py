@@ -0,0 +1,48 @@
+from hashlib import blake2b
+from math import ceil, exp, log
+from typing import Iterable
+
+
+class BloomFilter:
+    """
+    Фильтр Блума в памяти процесса.
+    Ложноположительные ответы возможны с вероятностью около error_rate, ложноотрицательных нет,
+    поэтому отрицательный ответ позволяет не ходить за проверкой во внешнее хранилище.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        capacity = max(capacity, 1)
+        self.size = ceil(-capacity * log(error_rate) / log(2) ** 2)
+        self.hash_count = max(1, round(self.size / capacity * log(2)))
+        self.bits = bytearray(ceil(self.size / 8))
+        self.count = 0
+
+    @classmethod
+    def from_items(cls, items: Iterable[str], capacity: int, error_rate: float = 0.001) -> 'BloomFilter':
+        bloom = cls(capacity, error_rate)
+        for item in items:
+            bloom.add(item)
+        return bloom
+
+    def _positions(self, item: str):
+        digest = blake2b(item.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return ((first + i * second) % self.size for i in range(self.hash_count))
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    @property
+    def memory(self) -> int:
+        """Размер битового массива в байтах."""
+        return len(self.bits)
+
+    @property
+    def false_positive_rate(self) -> float:
+        """Оценка вероятности ложноположительного ответа при текущем числе добавленных элементов."""
+        return (1 - exp(-self.hash_count * self.count / self.size)) ** self.hash_count
@@ -0,0 +1,171 @@
+from functools import wraps
+from hashlib import blake2b
+from time import sleep, time
+from typing import Iterable, List, Optional
+from uuid import UUID
+
+from flask import current_app, request
+from flask_restx.utils import unpack
+from redis.exceptions import RedisError
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.db import db
+from app.metrics import response_cache_requests
+from app.redis import redis_client
+from app.representations import output_json
+
+CHANGED = 'response_cache_changed'
+
+
+class ResponseCache:
+    """
+    Кеш ответов GET по версиям сущностей.
+    Для каждой модели в redis хранится версия коллекции, для каждого объекта — своя версия;
+    AbstractService.create/update/delete повышают их после коммита транзакции.
+    ETag ответа строится из пути и версий, поэтому If-None-Match отвечается 304 без обращения к базе.
+    Тело ответа хранится в redis под ETag; при промахе ответ строит один запрос,
+    остальные ждут его не дольше RESPONSE_CACHE_LOCK_TIMEOUT секунд.
+    Если redis недоступен, ответы строятся без кеша.
+    """
+    prefix = 'cache'
+
+    def __init__(self, app=None):
+        self.ttl = 3600
+        self.lock_timeout = 5
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ttl = app.config.get('RESPONSE_CACHE_TTL', self.ttl)
+        self.lock_timeout = app.config.get('RESPONSE_CACHE_LOCK_TIMEOUT', self.lock_timeout)
+        if not event.contains(Session, 'after_commit', self.after_commit):
+            event.listen(Session, 'after_commit', self.after_commit)
+            event.listen(Session, 'after_rollback', self.after_rollback)
+
+    def version_key(self, model, pk=None) -> str:
+        key = f'{self.prefix}:version:{model.__tablename__}'
+        if pk is None:
+            return key
+        try:
+            # Один объект — один ключ, как бы ни был записан UUID в URL.
+            pk = UUID(str(pk))
+        except ValueError:
+            pass
+        return f'{key}:{pk}'
+
+    @staticmethod
+    def mark_changed(model, pk=None) -> None:
+        """Запоминает изменение в текущей транзакции; версии повышаются после её коммита."""
+        db.session.info.setdefault(CHANGED, set()).add((model, pk))
+
+    def bump(self, changes: Iterable) -> None:
+        keys = set()
+        for model, pk in changes:
+            keys.add(self.version_key(model))
+            if pk is not None:
+                keys.add(self.version_key(model, pk))
+        if not keys:
+            return
+        pipe = redis_client.pipeline(transaction=False)
+        for key in keys:
+            pipe.incr(key)
+        pipe.execute()
+
+    def after_commit(self, session):
+        changes = session.info.pop(CHANGED, None)
+        if changes:
+            try:
+                self.bump(changes)
+            except RedisError:
+                current_app.logger.warning('Не удалось повысить версии кеша ответов, ответы могут устареть.')
+
+    @staticmethod
+    def after_rollback(session):
+        session.info.pop(CHANGED, None)
+
+    def get_versions(self, keys: List[str]) -> List[str]:
+        versions = redis_client.mget(keys)
+        missing = [key for key, version in zip(keys, versions) if version is None]
+        if missing:
+            # Версия, которой ещё нет, начинается с текущего времени, а не с нуля: если redis потерял
+            # версии, но не тела ответов, старые ответы не совпадут с новыми версиями.
+            now = int(time() * 1000)
+            pipe = redis_client.pipeline(transaction=False)
+            for key in missing:
+                pipe.set(key, now, nx=True)
+            pipe.execute()
+            versions = redis_client.mget(keys)
+        return versions
+
+    def get_etag(self, model, pk=None, depends_on: Iterable = ()) -> str:
+        keys = [self.version_key(model, pk)] + [self.version_key(dependency) for dependency in depends_on]
+        versions = self.get_versions(keys)
+        return blake2b(f'{request.full_path}|{"|".join(versions)}'.encode(), digest_size=16).hexdigest()
+
+    def get_or_build(self, etag: str, build) -> tuple:
+        """Возвращает тело ответа из кеша или строит его, пропуская в базу только один запрос."""
+        key = f'{self.prefix}:response:{etag}'
+        body = redis_client.get(key)
+        if body is not None:
+            response_cache_requests.labels(result='hit').inc()
+            return body, 200, {}
+        lock = f'{key}:lock'
+        if not redis_client.set(lock, 1, nx=True, ex=self.lock_timeout):
+            deadline = time() + self.lock_timeout
+            while time() < deadline:
+                sleep(0.05)
+                body = redis_client.get(key)
+                if body is not None:
+                    response_cache_requests.labels(result='wait').inc()
+                    return body, 200, {}
+            lock = None
+        response_cache_requests.labels(result='miss').inc()
+        try:
+            data, code, headers = unpack(build())
+            if code != 200:
+                return data, code, headers
+            body = output_json(data, code).get_data(as_text=True)
+            try:
+                redis_client.set(key, body, ex=self.ttl)
+            except RedisError:
+                pass
+            return body, code, headers
+        finally:
+            if lock:
+                try:
+                    redis_client.delete(lock)
+                except RedisError:
+                    pass
+
+    def cached(self, model, entity: Optional[str] = None, depends_on: Iterable = ()):
+        """
+        Декоратор GET-метода ресурса, ставится над marshal_with.
+        Ответ зависит от версии коллекции model или, если задан entity, от версии объекта
+        с первичным ключом из аргумента entity, а также от версий коллекций depends_on.
+        """
+        depends_on = tuple(depends_on)
+
+        def decorator(method):
+            @wraps(method)
+            def wrapper(*args, **kwargs):
+                try:
+                    etag = self.get_etag(model, kwargs[entity] if entity else None, depends_on)
+                    if etag in request.if_none_match:
+                        response_cache_requests.labels(result='not_modified').inc()
+                        response = current_app.response_class(status=304)
+                    else:
+                        body, code, headers = self.get_or_build(etag, lambda: method(*args, **kwargs))
+                        if code != 200:
+                            return body, code, headers
+                        response = current_app.response_class(body, mimetype='application/json', headers=headers)
+                except RedisError:
+                    return method(*args, **kwargs)
+                response.set_etag(etag)
+                response.headers['Cache-Control'] = 'private, no-cache'
+                return response
+            return wrapper
+        return decorator
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,164 @@
+import signal
+import socket
+from pathlib import Path
+from time import perf_counter
+
+import click
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+from flask import current_app
+from flask.cli import AppGroup
+
+from app.bcrypt import bcrypt
+from app.services import HistoryPartitionService, SessionService, UserImportService
+from app.services.history import history_writer
+from app.services.imports import readers
+
+bcrypt_cli = AppGroup('bcrypt', help='Настройка хеширования паролей.')
+users_cli = AppGroup('users', help='Управление пользователями.')
+history_cli = AppGroup('history', help='Обслуживание партиций истории логинов.')
+sessions_cli = AppGroup('sessions', help='Обслуживание refresh-сессий.')
+keys_cli = AppGroup('keys', help='Ключи подписи токенов.')
+
+
+@bcrypt_cli.command('calibrate')
+@click.option('--budget-ms', default=250, show_default=True, help='Допустимое время одного хеширования, мс.')
+@click.option('--min-rounds', default=10, show_default=True, help='Минимально допустимая стоимость.')
+def calibrate(budget_ms: int, min_rounds: int):
+    """Подбирает BCRYPT_LOG_ROUNDS под бюджет времени хеширования на этой машине."""
+    rounds = 4
+    recommended = min_rounds
+    while rounds <= 31:
+        start = perf_counter()
+        bcrypt.generate_password_hash('calibration', rounds)
+        elapsed = (perf_counter() - start) * 1000
+        click.echo(f'rounds={rounds}: {elapsed:.1f} мс')
+        if elapsed > budget_ms:
+            break
+        recommended = max(rounds, min_rounds)
+        rounds += 1
+    click.echo(f'BCRYPT_LOG_ROUNDS={recommended}')
+
+
+@users_cli.command('import')
+@click.argument('file', type=click.File('r', encoding='utf-8'))
+@click.option('--format', 'fmt', type=click.Choice(list(readers)), help='Формат файла, по умолчанию по расширению.')
+@click.option('--chunk-size', type=int, help='Записей в одной транзакции, по умолчанию USERS_IMPORT_CHUNK_SIZE.')
+@click.option('--workers', type=int, help='Потоков для хеширования паролей, по умолчанию PASSWORD_IMPORT_HASHING_POOL_SIZE.')
+def import_users(file, fmt: str, chunk_size: int, workers: int):
+    """Импортирует пользователей из NDJSON или CSV; вместо password можно передать готовый password_hash."""
+    fmt = fmt or ('csv' if file.name.endswith('.csv') else 'ndjson')
+    if workers:
+        # Пул импорта создаётся при первом хешировании, поэтому размер ещё можно поменять.
+        bcrypt.import_executor.size = workers
+    chunk_size = chunk_size or current_app.config['USERS_IMPORT_CHUNK_SIZE']
+    created = failed = 0
+    for chunk_created, chunk_failed in UserImportService(chunk_size).iter_chunks(readers[fmt](file)):
+        created += chunk_created
+        failed += len(chunk_failed)
+        for failure in chunk_failed:
+            click.echo(f'Строка {failure["line"]} ({failure["username"]}): {failure["error"]}', err=True)
+        click.echo(f'Создано: {created}, ошибок: {failed}.')
+
+
+@history_cli.command('partitions')
+@click.option('--ahead', type=int, help='На сколько месяцев вперёд создавать партиции.')
+def create_partitions(ahead: int):
+    """Создаёт партиции history на текущий и следующие месяцы."""
+    ahead = current_app.config['HISTORY_PARTITIONS_AHEAD'] if ahead is None else ahead
+    for partition in HistoryPartitionService().create_partitions(ahead):
+        click.echo(f'Создана партиция {partition.name}.')
+
+
+@history_cli.command('export')
+@click.option('--directory', type=click.Path(file_okay=False), help='Каталог архива.')
+@click.option('--retention', type=int, help='Срок хранения, месяцев.')
+def export_partitions(directory: str, retention: int):
+    """Выгружает партиции history старше срока хранения в сжатые CSV."""
+    service = HistoryPartitionService()
+    retention = current_app.config['HISTORY_RETENTION_MONTHS'] if retention is None else retention
+    directory = Path(directory or current_app.config['HISTORY_ARCHIVE_DIR'])
+    for partition in service.get_expired_partitions(retention):
+        click.echo(f'Партиция {partition.name} выгружена в {service.export_partition(partition, directory)}.')
+    default = service.get_default_partition()
+    if default and service.count_expired_default(default, retention):
+        path = service.export_expired_default(default, retention, directory)
+        click.echo(f'Устаревшие записи {default} выгружены в {path}.')
+
+
+@history_cli.command('retention')
+@click.option('--directory', type=click.Path(file_okay=False), help='Каталог архива.')
+@click.option('--retention', type=int, help='Срок хранения, месяцев.')
+@click.option('--export/--no-export', default=True, show_default=True, help='Выгружать ли партиции перед удалением.')
+def apply_retention(directory: str, retention: int, export: bool):
+    """Создаёт партиции наперёд и удаляет партиции history старше срока хранения."""
+    service = HistoryPartitionService()
+    retention = current_app.config['HISTORY_RETENTION_MONTHS'] if retention is None else retention
+    directory = Path(directory or current_app.config['HISTORY_ARCHIVE_DIR'])
+    service.create_partitions(current_app.config['HISTORY_PARTITIONS_AHEAD'])
+    for partition in service.get_expired_partitions(retention):
+        if export:
+            click.echo(f'Партиция {partition.name} выгружена в {service.export_partition(partition, directory)}.')
+        service.drop_partition(partition)
+        click.echo(f'Партиция {partition.name} удалена.')
+    default = service.get_default_partition()
+    if default and service.count_expired_default(default, retention):
+        if export:
+            path = service.export_expired_default(default, retention, directory)
+            click.echo(f'Устаревшие записи {default} выгружены в {path}.')
+        click.echo(f'Из {default} удалено устаревших записей: {service.prune_default(default, retention)}.')
+
+
+@history_cli.command('writer')
+@click.option('--consumer', default=socket.gethostname, show_default='имя хоста', help='Имя потребителя в группе.')
+@click.option('--batch-size', type=int, help='Записей в одном INSERT.')
+@click.option('--flush-interval', type=float, help='Максимальная задержка записи, секунд.')
+def run_writer(consumer: str, batch_size: int, flush_interval: float):
+    """Переносит историю логинов из redis stream в таблицу history. Останавливается по SIGTERM/SIGINT."""
+    stopping = []
+
+    def stop(signum, frame):
+        click.echo('Останавливаемся, дописываем накопленные записи...')
+        stopping.append(signum)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    written = history_writer.run(
+        consumer,
+        batch_size=batch_size or current_app.config['HISTORY_WRITER_BATCH_SIZE'],
+        flush_interval=flush_interval or current_app.config['HISTORY_WRITER_FLUSH_INTERVAL'],
+        should_stop=lambda: bool(stopping),
+    )
+    click.echo(f'Записано записей истории: {written}')
+
+
+@sessions_cli.command('sweep')
+def sweep():
+    """Удаляет истёкшие сессии из таблицы sessions. Запускается по расписанию."""
+    deleted = SessionService().purge_expired()
+    click.echo(f'Удалено сессий: {deleted}')
+
+
+@keys_cli.command('generate')
+@click.argument('kid')
+@click.option('--algorithm', type=click.Choice(['RS256', 'EdDSA']), default='RS256', show_default=True)
+@click.option('--directory', type=click.Path(file_okay=False), help='Каталог ключей, по умолчанию JWT_KEYS_DIR.')
+def generate_key(kid: str, algorithm: str, directory: str):
+    """
+    Создаёт закрытый ключ KID.pem. Для ротации ключ добавляют в каталог, перезапускают сервис,
+    затем переключают JWT_SIGNING_KEY_ID; прежний ключ удаляют после истечения его refresh-токенов.
+    """
+    directory = Path(directory or current_app.config['JWT_KEYS_DIR'])
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory.joinpath(f'{kid}.pem')
+    if path.exists():
+        raise click.ClickException(f'Ключ {path} уже существует.')
+    key = (rsa.generate_private_key(public_exponent=65537, key_size=2048)
+           if algorithm == 'RS256' else ed25519.Ed25519PrivateKey.generate())
+    path.write_bytes(key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption(),
+    ))
+    path.chmod(0o600)
+    click.echo(f'Ключ {kid} сохранён в {path}.')
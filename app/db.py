@@ -1,3 +1,31 @@
+from time import perf_counter
+
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+from app.metrics import db_pool_checkout_seconds, db_pool_connections_in_use
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool, замеряющий ожидание свободного соединения и число выданных соединений."""
+
+    def _do_get(self):
+        started = perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            db_pool_checkout_seconds.observe(perf_counter() - started)
+
+
+@event.listens_for(InstrumentedQueuePool, 'checkout')
+def on_checkout(dbapi_connection, connection_record, connection_proxy):
+    db_pool_connections_in_use.inc()
+
+
+@event.listens_for(InstrumentedQueuePool, 'checkin')
+def on_checkin(dbapi_connection, connection_record):
+    db_pool_connections_in_use.dec()
+
 
 db = SQLAlchemy()
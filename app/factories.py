@@ -9,6 +9,7 @@ import factory.random
 from app.db import db
 from app.models import History, Profile, Role, Session, User
 from app.services import JWTService
+from app.services.sessions import hash_token
 from app.settings import config
 
 factory.random.reseed_random(0)
@@ -37,6 +38,8 @@ class UserFactory(BaseFactory):
         model = User
         inline_args = ('password',)
         sqlalchemy_session = db.session
+        # Пользователь сразу вставляется в базу, чтобы его username попал в фильтр имён, как после регистрации.
+        sqlalchemy_session_persistence = 'flush'
 
     username = factory.Faker('user_name')
     active = True
@@ -60,6 +63,14 @@ class SessionFactory(BaseFactory):
 
     fingerprint = factory.fuzzy.FuzzyText(length=48, prefix='fingerprint_')
     user_agent = factory.Faker('user_agent')
+    refresh_token_hash = factory.LazyAttribute(lambda obj: hash_token(obj.refresh_token))
+    family = factory.LazyFunction(uuid4)
+    expired = factory.LazyFunction(
+        lambda: datetime.utcnow() + timedelta(seconds=config('REFRESH_TOKEN_EXPIRATION', cast=int))
+    )
+
+    class Params:
+        refresh_token = factory.fuzzy.FuzzyText(length=64)
 
 
 class AuthHeaders(NamedTuple):
@@ -0,0 +1,120 @@
+import heapq
+import logging
+import re
+from random import random
+from time import perf_counter
+from typing import List, Tuple
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.metrics import request_db_queries, request_db_seconds, slow_queries
+
+logger = logging.getLogger(__name__)
+
+PARAMETERS = re.compile(r"%\(\w+\)s|%s|'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+PARAMETER_LISTS = re.compile(r'\(\?(?:, \?)+\)')
+WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_sql(statement: str) -> str:
+    """Приводит SQL к шаблону: без параметров, литералов и переносов строк, списки IN схлопнуты."""
+    statement = PARAMETERS.sub('?', WHITESPACE.sub(' ', statement).strip())
+    return PARAMETER_LISTS.sub('(...)', statement)
+
+
+class QueryStats:
+    """SQL-запросы одного HTTP-запроса: число, суммарное время и самые медленные шаблоны."""
+
+    def __init__(self, keep: int):
+        self.keep = keep
+        self.count = 0
+        self.duration = 0.0
+        self._slowest: List[Tuple[float, int, str]] = []
+
+    def add(self, statement: str, duration: float) -> None:
+        self.count += 1
+        self.duration += duration
+        item = (duration, self.count, statement)
+        if len(self._slowest) < self.keep:
+            heapq.heappush(self._slowest, item)
+        elif duration > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, item)
+
+    @property
+    def slowest(self) -> List[Tuple[float, str]]:
+        return [(duration, normalize_sql(statement))
+                for duration, _, statement in sorted(self._slowest, reverse=True)]
+
+
+class QueryInstrumentation:
+    """
+    Учёт SQL-запросов по HTTP-запросам.
+    Для каждого запроса считает число SQL-запросов и время в базе: пишет их в гистограммы
+    с меткой endpoint, в режиме отладки отдаёт в заголовках X-DB-*.
+    Запросы, выполненные уже при отдаче потокового ответа, в счёт не попадают.
+    Запросы дольше SQL_SLOW_QUERY_MS попадают в лог с вероятностью SQL_SLOW_QUERY_SAMPLE_RATE.
+    """
+
+    def __init__(self, app=None):
+        self.slow_query_ms = 100
+        self.sample_rate = 1.0
+        self.keep = 3
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.slow_query_ms = app.config.get('SQL_SLOW_QUERY_MS', self.slow_query_ms)
+        self.sample_rate = app.config.get('SQL_SLOW_QUERY_SAMPLE_RATE', self.sample_rate)
+        self.keep = app.config.get('SQL_SLOWEST_STATEMENTS', self.keep)
+        if not event.contains(Engine, 'before_cursor_execute', self.before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', self.before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', self.after_cursor_execute)
+            event.listen(Engine, 'handle_error', self.handle_error)
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+
+    @staticmethod
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        duration = perf_counter() - conn.info['query_start'].pop()
+        in_request = has_request_context()
+        if in_request and 'query_stats' in g:
+            g.query_stats.add(statement, duration)
+        if duration * 1000 >= self.slow_query_ms:
+            endpoint = request.endpoint if in_request else None
+            slow_queries.labels(endpoint=endpoint or '').inc()
+            if random() < self.sample_rate:
+                logger.warning('Медленный SQL-запрос %.1f мс, endpoint %s: %s',
+                               duration * 1000, endpoint, normalize_sql(statement))
+
+    @staticmethod
+    def handle_error(context):
+        # after_cursor_execute для упавшего запроса не вызывается.
+        starts = context.connection.info.get('query_start') if context.connection else None
+        if starts and context.cursor is not None:
+            starts.pop()
+
+    def before_request(self):
+        g.query_stats = QueryStats(self.keep)
+
+    def after_request(self, response):
+        stats = g.pop('query_stats', None)
+        if stats is None:
+            return response
+        endpoint = request.endpoint or ''
+        request_db_queries.labels(endpoint=endpoint).observe(stats.count)
+        request_db_seconds.labels(endpoint=endpoint).observe(stats.duration)
+        if current_app.debug:
+            response.headers['X-DB-Query-Count'] = str(stats.count)
+            response.headers['X-DB-Time-Ms'] = f'{stats.duration * 1000:.1f}'
+            response.headers['X-DB-Slowest'] = ' | '.join(
+                f'{duration * 1000:.1f}ms {statement}' for duration, statement in stats.slowest
+            )
+        return response
+
+
+query_instrumentation = QueryInstrumentation()
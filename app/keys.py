@@ -0,0 +1,96 @@
+import json
+from pathlib import Path
+from typing import Dict, Optional, Union
+
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+from jwt.algorithms import OKPAlgorithm, RSAAlgorithm
+
+PrivateKey = Union[rsa.RSAPrivateKey, ed25519.Ed25519PrivateKey]
+PublicKey = Union[rsa.RSAPublicKey, ed25519.Ed25519PublicKey]
+
+SYMMETRIC_ALGORITHM = 'HS256'
+
+
+class KeyNotFound(jwt.InvalidTokenError):
+    pass
+
+
+def get_algorithm(key: Union[PrivateKey, PublicKey]) -> str:
+    if isinstance(key, (rsa.RSAPrivateKey, rsa.RSAPublicKey)):
+        return 'RS256'
+    if isinstance(key, (ed25519.Ed25519PrivateKey, ed25519.Ed25519PublicKey)):
+        return 'EdDSA'
+    raise ValueError(f'Неподдерживаемый тип ключа {type(key).__name__}.')
+
+
+def to_jwk(kid: str, key: PublicKey) -> dict:
+    algorithm = get_algorithm(key)
+    jwk = json.loads((RSAAlgorithm if algorithm == 'RS256' else OKPAlgorithm).to_jwk(key))
+    return {**jwk, 'kid': kid, 'alg': algorithm, 'use': 'sig'}
+
+
+def load_key(path: Path) -> Union[PrivateKey, PublicKey]:
+    data = path.read_bytes()
+    if b'PRIVATE KEY' in data:
+        return serialization.load_pem_private_key(data, password=None)
+    return serialization.load_pem_public_key(data)
+
+
+class KeyRing:
+    """
+    Ключи подписи JWT, загружаемые один раз при старте приложения.
+    В каталоге JWT_KEYS_DIR лежат PEM-файлы <kid>.pem: RSA или Ed25519, закрытые или только открытые.
+    Токены подписываются ключом JWT_SIGNING_KEY_ID, проверяются любым ключом каталога,
+    поэтому при ротации старые ключи остаются в каталоге, пока не истекут подписанные ими токены.
+    Без JWT_KEYS_DIR токены подписываются HS256 с SECRET_KEY, а JWKS пуст.
+    """
+
+    def __init__(self, app=None):
+        self.kid: Optional[str] = None
+        self.algorithm = SYMMETRIC_ALGORITHM
+        self.signing_key: Union[PrivateKey, str, None] = None
+        self.verification_keys: Dict[str, Union[PublicKey, str]] = {}
+        self.jwks: dict = {'keys': []}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        keys_dir = app.config.get('JWT_KEYS_DIR')
+        if not keys_dir:
+            self.kid = None
+            self.algorithm = SYMMETRIC_ALGORITHM
+            self.signing_key = app.config['SECRET_KEY']
+            self.verification_keys = {}
+            self.jwks = {'keys': []}
+            return
+
+        keys = {path.stem: load_key(path) for path in sorted(Path(keys_dir).glob('*.pem'))}
+        kid = app.config.get('JWT_SIGNING_KEY_ID')
+        if kid not in keys or not hasattr(keys[kid], 'public_key'):
+            raise RuntimeError(f'В {keys_dir} нет закрытого ключа {kid}.pem для подписи токенов.')
+        self.kid = kid
+        self.signing_key = keys[kid]
+        self.algorithm = get_algorithm(self.signing_key)
+        self.verification_keys = {
+            key_id: key.public_key() if hasattr(key, 'public_key') else key
+            for key_id, key in keys.items()
+        }
+        self.jwks = {'keys': [to_jwk(key_id, key) for key_id, key in self.verification_keys.items()]}
+
+    def encode(self, payload: dict) -> str:
+        headers = {'kid': self.kid} if self.kid else None
+        return jwt.encode(payload, self.signing_key, algorithm=self.algorithm, headers=headers)
+
+    def decode(self, token: str) -> dict:
+        if not self.kid:
+            return jwt.decode(token, self.signing_key, algorithms=[SYMMETRIC_ALGORITHM])
+        kid = jwt.get_unverified_header(token).get('kid')
+        key = self.verification_keys.get(kid)
+        if key is None:
+            raise KeyNotFound(f'Неизвестный ключ {kid}.')
+        return jwt.decode(token, key, algorithms=[get_algorithm(key)])
+
+
+key_ring = KeyRing()
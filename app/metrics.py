@@ -0,0 +1,160 @@
+import atexit
+import os
+from time import perf_counter
+
+from flask import Response, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+password_hashing_queue_depth = Gauge(
+    'password_hashing_queue_depth',
+    'Число операций bcrypt, выполняемых или ожидающих в пуле.',
+    multiprocess_mode='livesum',
+)
+password_hashing_rejected = Counter(
+    'password_hashing_rejected_total',
+    'Число операций bcrypt, отклонённых из-за переполнения пула.',
+)
+role_claims_cache_requests = Counter(
+    'role_claims_cache_requests_total',
+    'Обращения к кешу ролей для claims токена.',
+    ['result'],
+)
+token_revocation_checks = Counter(
+    'token_revocation_checks_total',
+    'Проверки отзыва токенов по результату: bloom_negative обошлась без redis.',
+    ['result'],
+)
+request_db_queries = Histogram(
+    'http_request_db_queries',
+    'Число SQL-запросов на HTTP-запрос.',
+    ['endpoint'],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89),
+)
+request_db_seconds = Histogram(
+    'http_request_db_seconds',
+    'Суммарное время SQL-запросов на HTTP-запрос.',
+    ['endpoint'],
+)
+slow_queries = Counter(
+    'sql_slow_queries_total',
+    'SQL-запросы дольше SQL_SLOW_QUERY_MS.',
+    ['endpoint'],
+)
+request_duration = Histogram(
+    'http_request_duration_seconds',
+    'Время обработки HTTP-запроса.',
+    ['namespace', 'resource', 'method', 'status'],
+)
+password_hashing_seconds = Histogram(
+    'password_hashing_seconds',
+    'Время операции bcrypt вместе с ожиданием в пуле.',
+    ['operation'],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+jwt_seconds = Histogram(
+    'jwt_operation_seconds',
+    'Время подписи и проверки JWT.',
+    ['operation'],
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05),
+)
+db_pool_checkout_seconds = Histogram(
+    'db_pool_checkout_seconds',
+    'Ожидание соединения из пула SQLAlchemy.',
+    buckets=(0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30),
+)
+db_pool_connections_in_use = Gauge(
+    'db_pool_connections_in_use',
+    'Соединения, выданные из пула SQLAlchemy.',
+    multiprocess_mode='livesum',
+)
+username_filter_checks = Counter(
+    'username_filter_checks_total',
+    'Проверки username фильтром: negative обошлась без базы, false_positive — пользователя в базе не нашлось.',
+    ['result'],
+)
+username_filter_bytes = Gauge(
+    'username_filter_bytes',
+    'Память фильтра username.',
+    multiprocess_mode='livesum',
+)
+username_filter_false_positive_rate = Gauge(
+    'username_filter_false_positive_rate',
+    'Оценка доли ложноположительных ответов фильтра username.',
+    multiprocess_mode='max',
+)
+response_cache_requests = Counter(
+    'response_cache_requests_total',
+    'Обращения к кешу ответов: not_modified — 304, wait — дождались ответа, построенного другим запросом.',
+    ['result'],
+)
+rate_limit_rejections = Counter(
+    'rate_limit_rejections_total',
+    'Запросы, отклонённые ограничением частоты.',
+    ['endpoint', 'scope'],
+)
+logins = Counter(
+    'auth_logins_total',
+    'Попытки входа по результату.',
+    ['result'],
+)
+
+
+def split_endpoint(endpoint: str):
+    """Эндпоинт flask-restx имеет вид <namespace>_<resource>."""
+    namespace, _, resource = endpoint.partition('_')
+    return namespace, resource
+
+
+class PrometheusMetrics:
+    """
+    Метрики HTTP-запросов и эндпоинт /metrics.
+    Под uwsgi каждый воркер пишет метрики в PROMETHEUS_MULTIPROC_DIR, а /metrics собирает их по всем воркерам.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.add_url_rule('/metrics', 'metrics', self.view)
+        if self.multiprocess:
+            atexit.register(multiprocess.mark_process_dead, os.getpid())
+
+    @property
+    def multiprocess(self) -> bool:
+        return bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR'))
+
+    @staticmethod
+    def before_request():
+        g.request_started = perf_counter()
+
+    @staticmethod
+    def after_request(response):
+        started = g.pop('request_started', None)
+        if started is not None and request.endpoint != 'metrics':
+            namespace, resource = split_endpoint(request.endpoint or '')
+            request_duration.labels(
+                namespace=namespace, resource=resource, method=request.method, status=response.status_code,
+            ).observe(perf_counter() - started)
+        return response
+
+    def view(self):
+        registry = REGISTRY
+        if self.multiprocess:
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        return Response(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
+
+
+metrics = PrometheusMetrics()
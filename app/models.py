@@ -6,13 +6,16 @@ from app.mixins import BaseModel
 
 users_roles_association = db.Table(
     "users_roles",
-    db.Column("user_id", UUID(as_uuid=True), db.ForeignKey("users.id")),
-    db.Column("role_id", UUID(as_uuid=True), db.ForeignKey("roles.id")),
+    db.Column("user_id", UUID(as_uuid=True), db.ForeignKey("users.id"), primary_key=True),
+    db.Column("role_id", UUID(as_uuid=True), db.ForeignKey("roles.id"), primary_key=True, index=True),
 )
 
 
 class User(BaseModel, db.Model):
     __tablename__ = 'users'
+    __table_args__ = (
+        db.Index('ix_users_created_id', 'created', 'id'),
+    )
 
     username = db.Column(db.String(128), nullable=False, unique=True)
     password = db.Column(db.String(255), nullable=False)
@@ -39,21 +42,33 @@ class User(BaseModel, db.Model):
         """Проверка пароля на равенство с хешом."""
         return bcrypt.check_password_hash(self.password, password)
 
+    def password_needs_rehash(self) -> bool:
+        """Проверка, построен ли хеш пароля с актуальной стоимостью."""
+        return bcrypt.needs_rehash(self.password)
+
 
 class Profile(BaseModel, db.Model):
     __tablename__ = 'profiles'
 
-    email = db.Column(db.String(128), nullable=False)
+    email = db.Column(db.String(128), nullable=False, index=True)
     user_id = db.Column(UUID(as_uuid=True), db.ForeignKey('users.id'), unique=True)
     user = db.relationship('User', back_populates='profile')
 
 
 class Session(BaseModel, db.Model):
     __tablename__ = 'sessions'
+    __table_args__ = (
+        db.Index('ix_sessions_user_id_fingerprint_user_agent', 'user_id', 'fingerprint', 'user_agent'),
+        db.Index('ix_sessions_expired', 'expired'),
+    )
 
     fingerprint = db.Column(db.String(255), nullable=False)
     user_agent = db.Column(db.String(255), nullable=False)
-    refresh_token = db.Column(db.String(255), nullable=False)
+    # sha256 refresh-токена: сам токен с подписью RS256 и kid длиннее 600 символов, а в базе он не нужен.
+    refresh_token_hash = db.Column(db.String(64), nullable=False, unique=True, index=True)
+    expired = db.Column(db.DateTime(), nullable=False)
+    # Семейство refresh-токенов одного логина, общее для всех ротаций.
+    family = db.Column(UUID(as_uuid=True), nullable=False, index=True)
     user_id = db.Column(UUID(as_uuid=True), db.ForeignKey("users.id"))
     user = db.relationship('User', uselist=False, back_populates='sessions')
 
@@ -68,7 +83,12 @@ class Role(BaseModel, db.Model):
 
 
 class History(BaseModel, db.Model):
+    # В базе таблица разбита на помесячные партиции по created, см. HistoryPartitionService.
     __tablename__ = 'history'
+    __table_args__ = (
+        db.Index('ix_history_user_id_created_id', 'user_id', 'created', 'id'),
+        db.Index('ix_history_created', 'created'),
+    )
 
     fingerprint = db.Column(db.String(255), nullable=False)
     user_agent = db.Column(db.String(255), nullable=False)
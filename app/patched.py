@@ -1,7 +1,14 @@
 from gevent import monkey
-from app import *
 
+# Патчить нужно до импорта приложения: иначе threading, socket и ssl
+# уже импортированы модулями приложения в непатченном виде.
 monkey.patch_all()
 
+from psycogreen.gevent import patch_psycopg  # noqa: E402
+
+# psycopg2 ждёт ответа базы через колбэк gevent, а не блокируя весь воркер.
+patch_psycopg()
+
+from app import create_app  # noqa: E402
 
 application = create_app()
@@ -0,0 +1,215 @@
+from functools import wraps
+from hashlib import sha256
+from math import ceil
+from threading import Lock
+from time import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from flask import request
+from redis.exceptions import RedisError
+from werkzeug.exceptions import TooManyRequests
+
+from app.metrics import rate_limit_rejections
+from app.redis import redis_client
+
+
+class TooManyAttempts(TooManyRequests):
+    description = 'Слишком много попыток, повторите позже.'
+
+
+class Limit(NamedTuple):
+    scope: str
+    count: int
+    window: int
+
+
+def parse_limits(value: str) -> List[Limit]:
+    """Разбирает строку вида 'ip:20/60,username:5/60': не больше 20 попыток с IP за 60 секунд и т.д."""
+    limits = []
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        scope, _, rule = item.partition(':')
+        count, _, window = rule.partition('/')
+        limits.append(Limit(scope=scope, count=int(count), window=int(window)))
+    return limits
+
+
+def get_scope_value(scope: str) -> Optional[str]:
+    """Значение, по которому считаются попытки: IP клиента, username из тела запроса или fingerprint."""
+    if scope == 'ip':
+        return request.remote_addr
+    if scope == 'fingerprint':
+        return request.headers.get('Fingerprint')
+    if scope == 'username':
+        username = (request.get_json(silent=True) or {}).get('username')
+        return username.strip().lower() if isinstance(username, str) else None
+    raise ValueError(f'Неизвестная область ограничения {scope}.')
+
+
+class WindowKeys(NamedTuple):
+    lock: str
+    strikes: str
+    current: str
+    previous: str
+
+
+class RedisBackend:
+
+    def check(self, keys: List[WindowKeys], windows: List[int]) -> List[Tuple[int, int, int]]:
+        """Засчитывает попытку и возвращает по каждому ключу оставшуюся блокировку и счётчики двух окон."""
+        pipe = redis_client.pipeline(transaction=False)
+        for key, window in zip(keys, windows):
+            pipe.ttl(key.lock)
+            pipe.incr(key.current)
+            pipe.expire(key.current, window * 2)
+            pipe.get(key.previous)
+        results = pipe.execute()
+        return [
+            (max(lock_ttl or 0, 0), int(current), int(previous or 0))
+            for lock_ttl, current, _, previous in zip(*[iter(results)] * 4)
+        ]
+
+    def lock(self, key: WindowKeys, lockout: int, max_lockout: int) -> int:
+        strikes = redis_client.incr(key.strikes)
+        duration = min(lockout * 2 ** (strikes - 1), max_lockout)
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.expire(key.strikes, max_lockout * 2)
+        pipe.set(key.lock, 1, ex=duration)
+        pipe.execute()
+        return duration
+
+    def reset(self, keys: List[WindowKeys]) -> None:
+        redis_client.delete(*[name for key in keys for name in (key.strikes, key.current, key.previous)])
+
+
+class MemoryBackend:
+    """Те же счётчики в памяти процесса, когда redis недоступен."""
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._data: Dict[str, Tuple[int, float]] = {}
+        self._lock = Lock()
+
+    def _get(self, name: str, now: float) -> int:
+        value, expires = self._data.get(name, (0, 0))
+        return value if expires > now else 0
+
+    def _set(self, name: str, value: int, ttl: int, now: float) -> None:
+        if len(self._data) >= self.max_keys:
+            self._data = {k: v for k, v in self._data.items() if v[1] > now}
+        self._data[name] = (value, now + ttl)
+
+    def check(self, keys: List[WindowKeys], windows: List[int]) -> List[Tuple[int, int, int]]:
+        now = time()
+        results = []
+        with self._lock:
+            for key, window in zip(keys, windows):
+                current = self._get(key.current, now) + 1
+                self._set(key.current, current, window * 2, now)
+                _, lock_expires = self._data.get(key.lock, (0, 0))
+                lock_ttl = ceil(lock_expires - now) if lock_expires > now else 0
+                results.append((lock_ttl, current, self._get(key.previous, now)))
+        return results
+
+    def lock(self, key: WindowKeys, lockout: int, max_lockout: int) -> int:
+        now = time()
+        with self._lock:
+            strikes = self._get(key.strikes, now) + 1
+            self._set(key.strikes, strikes, max_lockout * 2, now)
+            duration = min(lockout * 2 ** (strikes - 1), max_lockout)
+            self._set(key.lock, 1, duration, now)
+        return duration
+
+    def reset(self, keys: List[WindowKeys]) -> None:
+        with self._lock:
+            for key in keys:
+                for name in (key.strikes, key.current, key.previous):
+                    self._data.pop(name, None)
+
+
+class RateLimiter:
+    """
+    Ограничение частоты попыток по IP, username и fingerprint скользящим окном.
+    Счётчик окна — взвешенная сумма текущего и предыдущего фиксированных окон, всё за один запрос к redis.
+    Превышение лимита блокирует значение на RATE_LIMIT_LOCKOUT секунд, каждое следующее — вдвое дольше,
+    до RATE_LIMIT_MAX_LOCKOUT. Отклонённый запрос получает 429 с Retry-After, не доходя до базы и bcrypt.
+    Если redis недоступен, счётчики ведутся в памяти процесса.
+    """
+    prefix = 'ratelimit'
+
+    def __init__(self, app=None):
+        self.limits: Dict[str, List[Limit]] = {}
+        self.lockout = 60
+        self.max_lockout = 3600
+        self.redis = RedisBackend()
+        self.memory = MemoryBackend()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.limits = {endpoint: parse_limits(value) for endpoint, value in app.config.get('RATE_LIMITS', {}).items()}
+        self.lockout = app.config.get('RATE_LIMIT_LOCKOUT', self.lockout)
+        self.max_lockout = app.config.get('RATE_LIMIT_MAX_LOCKOUT', self.max_lockout)
+
+    def get_keys(self, name: str, limit: Limit, value: str, now: float) -> WindowKeys:
+        base = f'{self.prefix}:{name}:{limit.scope}:{sha256(value.encode()).hexdigest()[:32]}'
+        window = int(now // limit.window)
+        return WindowKeys(
+            lock=f'{base}:lock',
+            strikes=f'{base}:strikes',
+            current=f'{base}:{window}',
+            previous=f'{base}:{window - 1}',
+        )
+
+    def _call(self, method: str, *args):
+        try:
+            return getattr(self.redis, method)(*args)
+        except RedisError:
+            return getattr(self.memory, method)(*args)
+
+    def _applicable(self, name: str) -> List[Tuple[Limit, WindowKeys]]:
+        now = time()
+        applicable = []
+        for limit in self.limits.get(name, []):
+            value = get_scope_value(limit.scope)
+            if value:
+                applicable.append((limit, self.get_keys(name, limit, value, now)))
+        return applicable
+
+    def hit(self, name: str) -> None:
+        """Засчитывает попытку для эндпоинта name и выбрасывает TooManyAttempts, если лимит исчерпан."""
+        applicable = self._applicable(name)
+        if not applicable:
+            return
+        now = time()
+        results = self._call('check', [keys for _, keys in applicable], [limit.window for limit, _ in applicable])
+        retry_after = 0
+        for (limit, keys), (lock_ttl, current, previous) in zip(applicable, results):
+            if lock_ttl:
+                retry_after = max(retry_after, lock_ttl)
+                rate_limit_rejections.labels(endpoint=name, scope=limit.scope).inc()
+                continue
+            elapsed = now % limit.window
+            if previous * (limit.window - elapsed) / limit.window + current > limit.count:
+                retry_after = max(retry_after, self._call('lock', keys, self.lockout, self.max_lockout))
+                rate_limit_rejections.labels(endpoint=name, scope=limit.scope).inc()
+        if retry_after:
+            raise TooManyAttempts(retry_after=retry_after)
+
+    def reset(self, name: str, scopes=('username', 'fingerprint')) -> None:
+        """Сбрасывает счётчики и историю блокировок после успешной попытки."""
+        keys = [keys for limit, keys in self._applicable(name) if limit.scope in scopes]
+        if keys:
+            self._call('reset', keys)
+
+    def limit(self, name: str):
+        """Декоратор метода ресурса: ограничивает попытки по лимитам RATE_LIMITS[name]."""
+        def decorator(method):
+            @wraps(method)
+            def wrapper(*args, **kwargs):
+                self.hit(name)
+                return method(*args, **kwargs)
+            return wrapper
+        return decorator
+
+
+limiter = RateLimiter()
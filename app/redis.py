@@ -0,0 +1,3 @@
+from flask_redis import FlaskRedis
+
+redis_client = FlaskRedis(decode_responses=True)
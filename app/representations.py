@@ -0,0 +1,15 @@
+import orjson
+from flask import current_app, make_response
+
+
+def output_json(data, code, headers=None):
+    """
+    JSON-ответ через orjson вместо json.dumps: в разы быстрее на больших списках.
+    Как и в flask-restx, в режиме отладки JSON выводится с отступами и всегда заканчивается переводом строки.
+    """
+    option = orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE
+    if current_app.debug:
+        option |= orjson.OPT_INDENT_2
+    response = make_response(orjson.dumps(data, option=option), code)
+    response.headers.extend(headers or {})
+    return response
@@ -1,4 +1,7 @@
 from app.services.permissions import RoleService
+from app.services.revocation import TokenRevocationService
 from app.services.sessions import HistoryService, SessionService
+from app.services.history import HistoryPartitionService
 from app.services.users import ProfileService, UserService
 from app.services.auth import JWTService, AuthService
+from app.services.imports import UserImportService
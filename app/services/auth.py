@@ -1,36 +1,131 @@
-from random import randint
-from typing import Optional
+from collections import OrderedDict
+from threading import Lock
+from time import time
+from typing import List, Optional
 from datetime import datetime, timedelta
+from uuid import uuid4
 
 from flask_restx import namespace
 from flask import request
 import jwt
 
+from app.bcrypt import bcrypt
+from app.keys import key_ring
+from app.metrics import jwt_seconds, logins
+from app.ratelimit import limiter
 from app.settings import config
 from app.models import User
+from app.services.base import unit_of_work
+from app.services.permissions import role_claims_cache
+from app.services.revocation import revocation_service
 from app.services.sessions import SessionService
-from app.services.users import UserService
+from app.services.users import UserService, username_filter
 
 
 session_service = SessionService()
 user_service = UserService()
 
 
+class TokenClaimsCache:
+    """
+    Ограниченный LRU-кеш уже проверенных токенов в памяти процесса.
+    Запись живёт не дольше, чем exp самого токена.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, token: str) -> Optional[dict]:
+        with self._lock:
+            claims = self._data.get(token)
+            if claims is None:
+                return None
+            if claims.get('exp', 0) <= time():
+                del self._data[token]
+                return None
+            self._data.move_to_end(token)
+            return claims
+
+    def set(self, token: str, claims: dict) -> None:
+        if not self.maxsize:
+            return
+        with self._lock:
+            self._data[token] = claims
+            self._data.move_to_end(token)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+claims_cache = TokenClaimsCache(maxsize=config('TOKEN_CLAIMS_CACHE_SIZE', default=1024, cast=int))
+
+
 class JWTService:
 
     @staticmethod
     def decode_token(token: str) -> dict:
-        return jwt.decode(token, config("SECRET_KEY"), algorithms="HS256")
+        with jwt_seconds.labels(operation='decode').time():
+            return key_ring.decode(token)
+
+    @staticmethod
+    def decode_token_cached(token: str) -> dict:
+        """
+        Декодирует токен, пропуская проверку подписи для недавно проверенных токенов.
+        Возвращаемый словарь общий для всех запросов — его нельзя изменять.
+        """
+        claims = claims_cache.get(token) if token else None
+        if claims is None:
+            claims = JWTService.decode_token(token)
+            claims_cache.set(token, claims)
+        return claims
 
     @staticmethod
     def is_token_valid(token: str) -> bool:
         try:
-            JWTService.decode_token(token)
-        except jwt.exceptions.DecodeError:
+            claims = JWTService.decode_token(token)
+        except jwt.exceptions.InvalidTokenError:
             return False
-        except jwt.exceptions.ExpiredSignatureError:
-            return False
-        return True
+        return not revocation_service.is_revoked(claims)
+
+    @staticmethod
+    def introspect(tokens: List[str]) -> List[dict]:
+        """
+        Проверяет пачку токенов: подпись (повторяющиеся и недавно проверенные токены не проверяются заново),
+        затем отзыв всех валидных токенов одним обращением к redis.
+        Для каждого токена возвращает active, claims, revoked, expires_in и причину error для неактивных.
+        """
+        now = time()
+        decoded = {}
+        for token in set(tokens):
+            try:
+                decoded[token] = JWTService.decode_token_cached(token)
+            except jwt.exceptions.ExpiredSignatureError:
+                decoded[token] = 'expired'
+            except jwt.exceptions.InvalidTokenError:
+                decoded[token] = 'invalid'
+        valid = [token for token, claims in decoded.items() if isinstance(claims, dict)]
+        revoked = dict(zip(valid, revocation_service.are_revoked([decoded[token] for token in valid])))
+
+        results = []
+        for token in tokens:
+            claims = decoded[token]
+            if not isinstance(claims, dict):
+                results.append({'active': False, 'revoked': False, 'claims': None, 'expires_in': 0, 'error': claims})
+                continue
+            is_revoked = revoked[token]
+            results.append({
+                'active': not is_revoked,
+                'revoked': is_revoked,
+                'claims': claims,
+                'expires_in': max(int(claims.get('exp', 0) - now), 0),
+                'error': 'revoked' if is_revoked else None,
+            })
+        return results
 
     @staticmethod
     def encode_token(user: Optional[User] = None,
@@ -38,27 +133,28 @@ class JWTService:
                      **kwargs) -> str:
         data = {
             'user_id': str(user.id),
-            'roles': [role.name for role in user.roles],
+            'roles': role_claims_cache.get(user),
             'is_super': user.is_super,
         } if user else kwargs
 
         payload = {
             'exp': datetime.utcnow() + timedelta(seconds=expires),
             'iat': datetime.utcnow(),
-            'jti': randint(1, 99999999999),
+            'jti': uuid4().hex,
             **data,
         }
-        return jwt.encode(
-            payload, config('SECRET_KEY'), algorithm='HS256'
-        )
+        with jwt_seconds.labels(operation='encode').time():
+            return key_ring.encode(payload)
 
 
 def auth_decorator(method_to_decorate):
+    """Проверяет заголовки и выполняет сценарий вместе с выдачей токенов одной транзакцией."""
     def wrapper(self):
         self.get_headers()
         if not all((self.fingerprint, self.user_agent)):
             return namespace.abort(400, 'Не переданы обязательные заголовки.')
-        return method_to_decorate(self) or self.generate_tokens(), self.code
+        with unit_of_work():
+            return method_to_decorate(self) or self.generate_tokens(), self.code
     return wrapper
 
 
@@ -66,7 +162,6 @@ def refresh_decorator(method_to_decorate):
     def wrapper(self):
         post_data = request.get_json()
         refresh_token = post_data.get('refresh_token')
-        print(refresh_token)
         if refresh_token and not JWTService.is_token_valid(refresh_token):
             return namespace.abort(400, f'Refresh-токен истек. Нужно залогиниться')
         return method_to_decorate(self)
@@ -79,6 +174,7 @@ class AuthService:
         self.auth_header = None
         self.user = None
         self.user_agent = None
+        self.session = None
         self.code = 200
 
     def get_headers(self):
@@ -95,7 +191,11 @@ class AuthService:
             'fingerprint': self.fingerprint,
             'user_agent': self.user_agent,
         }
-        session_service.create(**session)
+        if self.session:
+            if not session_service.rotate(self.session, **session):
+                return namespace.abort(400, f'Refresh-токен уже использован. Нужно залогиниться')
+        else:
+            session_service.create(**session)
         return {'access_token': access_token, 'refresh_token': refresh_token}
 
     @auth_decorator
@@ -112,9 +212,18 @@ class AuthService:
         post_data = request.get_json()
         username = post_data.get('username')
         password = post_data.get('password')
-        self.user = user_service.get_user_by_username(username)
-        if not (self.user and self.user.check_password(password)):
+        if username_filter.might_exist(username):
+            self.user = user_service.get_user_by_username(username)
+            if self.user is None:
+                username_filter.false_positive()
+        # Для несуществующего пользователя тоже выполняется bcrypt, чтобы время ответа его не выдавало.
+        if not (self.user.check_password(password) if self.user else bcrypt.check_dummy_password(password)):
+            logins.labels(result='failure').inc()
             return namespace.abort(404, f'Неверный пароль.')
+        logins.labels(result='success').inc()
+        limiter.reset('login')
+        if self.user.password_needs_rehash():
+            user_service.rehash_password(self.user, password)
         self.code = 200
 
     @auth_decorator
@@ -122,10 +231,13 @@ class AuthService:
     def refresh(self):
         post_data = request.get_json()
         refresh_token = post_data.get('refresh_token')
-        session = session_service.get_by_refresh_token(refresh_token=refresh_token,
-                                                       fingerprint=self.fingerprint,
-                                                       user_agent=self.user_agent)
-        if not session:
+        self.session = session_service.get_by_refresh_token(refresh_token=refresh_token,
+                                                            fingerprint=self.fingerprint,
+                                                            user_agent=self.user_agent)
+        if not self.session:
+            # Предъявлен уже обменянный токен: семейство могло утечь, отзываем его целиком.
+            session_service.revoke_if_reused(refresh_token)
+        self.user = user_service.get_by_pk(self.session.user_id) if self.session else None
+        if not self.user:
             return namespace.abort(400, f'Refresh-токен истек, либо не существует. Нужно залогиниться')
-        self.user = session.user
         self.code = 201
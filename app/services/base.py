@@ -1,9 +1,78 @@
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
 from uuid import UUID
 
+from sqlalchemy import tuple_
+from werkzeug.exceptions import HTTPException
+
+from app.cache import response_cache
 from app.db import db
 
 
+UNIT_OF_WORK = 'unit_of_work'
+
+
+@contextmanager
+def unit_of_work():
+    """
+    Выполняет изменения всех сервисов внутри блока одной транзакцией с одним коммитом.
+    Коммиты сервисов внутри блока откладываются до его конца, вложенные блоки коммитит внешний.
+    Исключение откатывает транзакцию, кроме HTTP-ответов 4xx (abort): это штатный исход запроса,
+    и сделанные до него изменения, например отзыв сессий, должны сохраниться.
+    """
+    session = db.session()
+    depth = session.info.get(UNIT_OF_WORK, 0)
+    session.info[UNIT_OF_WORK] = depth + 1
+    try:
+        yield session
+    except HTTPException as e:
+        if depth == 0 and e.code and e.code < 500:
+            session.commit()
+        elif depth == 0:
+            session.rollback()
+        raise
+    except BaseException:
+        if depth == 0:
+            session.rollback()
+        raise
+    else:
+        if depth == 0:
+            session.commit()
+    finally:
+        session.info[UNIT_OF_WORK] = depth
+
+
+def save_changes(commit: bool = True) -> None:
+    """
+    Коммитит сессию, если commit и изменения не выполняются внутри unit_of_work.
+    Иначе только отправляет изменения в базу: id и ограничения проверяются сразу, коммит — один в конце.
+    """
+    if commit and not db.session.info.get(UNIT_OF_WORK):
+        db.session.commit()
+    else:
+        db.session.flush()
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(instance) -> str:
+    """Курсор keyset-пагинации: позиция (created, id) последнего объекта страницы."""
+    return urlsafe_b64encode(f'{instance.created.isoformat()}|{instance.id}'.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    try:
+        created, pk = urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(created), UUID(pk)
+    except ValueError:
+        raise InvalidCursor(f'Некорректный курсор {cursor}.')
+
+
 class AbstractService(ABC):
 
     @property
@@ -11,27 +80,75 @@ class AbstractService(ABC):
     def model(self) -> db.Model:
         pass
 
-    def get_all(self):
-        return self.model.query.all()
+    # Профили загрузки: имя профиля -> опции загрузки связей под конкретную модель ответа,
+    # чтобы маршалинг вложенных полей не порождал запрос на каждый объект.
+    load_profiles: Dict[str, tuple] = {}
+
+    def query(self, profile: Optional[str] = None):
+        query = self.model.query
+        if profile:
+            query = query.options(*self.load_profiles[profile])
+        return query
+
+    def get_all(self, profile: Optional[str] = None):
+        return self.query(profile).all()
 
-    def get_by_pk(self, pk: UUID):
-        return self.model.query.filter_by(id=pk).first()
+    def get_by_pk(self, pk: UUID, profile: Optional[str] = None):
+        return self.query(profile).filter_by(id=pk).first()
 
-    def create(self, **kwargs):
+    def get_page(self, query=None, limit: int = 100, cursor: Optional[str] = None,
+                 descending: bool = False, columns: Optional[list] = None) -> Tuple[List, Optional[str]]:
+        """
+        Keyset-пагинация по (created, id).
+        Возвращает страницу и курсор следующей страницы, либо None, если страница последняя.
+        С columns вместо объектов возвращаются строки только с этими колонками (среди них должны быть
+        created и id): без identity map и загрузки остальных атрибутов.
+        """
+        query = query if query is not None else self.model.query
+        if columns:
+            query = query.with_entities(*columns)
+        key = tuple_(self.model.created, self.model.id)
+        if cursor:
+            position = tuple_(*decode_cursor(cursor))
+            query = query.filter(key < position if descending else key > position)
+        if descending:
+            query = query.order_by(self.model.created.desc(), self.model.id.desc())
+        else:
+            query = query.order_by(self.model.created, self.model.id)
+        items = query.limit(limit + 1).all()
+        next_cursor = encode_cursor(items[limit - 1]) if len(items) > limit else None
+        return items[:limit], next_cursor
+
+    def iter_all(self, query=None, cursor: Optional[str] = None, descending: bool = False,
+                 batch_size: int = 1000, columns: Optional[list] = None) -> Iterator:
+        """Обходит все объекты страницами по batch_size, не загружая их в память разом."""
+        while True:
+            items, cursor = self.get_page(query, batch_size, cursor, descending, columns)
+            for item in items:
+                yield item
+                if not columns:
+                    db.session.expunge(item)
+            if not cursor:
+                return
+
+    def create(self, commit: bool = True, **kwargs):
         data = self.model.filter_kwargs(data=kwargs, exclude=['id', 'created', 'updated'])
         instance = self.model(**data)
         db.session.add(instance)
-        db.session.commit()
+        response_cache.mark_changed(self.model)
+        save_changes(commit)
         return instance
 
-    def update(self, instance, **kwargs):
+    def update(self, instance, commit: bool = True, **kwargs):
         data = self.model.filter_kwargs(data=kwargs, exclude=['id', 'created', 'updated'])
         for k, v in data.items():
             setattr(instance, k, v)
-        db.session.commit()
+        response_cache.mark_changed(self.model, instance.id)
+        save_changes(commit)
         return instance
 
-    def delete(self, instance):
+    def delete(self, instance, commit: bool = True):
         db.session.delete(instance)
-        db.session.commit()
+        response_cache.mark_changed(self.model, instance.id)
+        save_changes(commit)
         return instance
@@ -0,0 +1,297 @@
+import gzip
+import logging
+import re
+from datetime import date, datetime
+from pathlib import Path
+from time import monotonic
+from typing import Callable, List, NamedTuple, Optional, Tuple
+from uuid import uuid4
+
+from flask import current_app
+from redis.exceptions import ResponseError
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.dialects.postgresql import insert
+
+from app.db import db
+from app.models import History, User
+from app.redis import redis_client
+from app.services.base import save_changes
+
+logger = logging.getLogger(__name__)
+
+PARTITION_NAME = re.compile(r'^history_(\d{4})_(\d{2})$')
+
+
+def add_months(month: date, months: int) -> date:
+    """Первое число месяца, отстоящего от month на months месяцев."""
+    month_index = month.year * 12 + month.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+class Partition(NamedTuple):
+    name: str
+    start: date
+
+    @property
+    def end(self) -> date:
+        return add_months(self.start, 1)
+
+    @classmethod
+    def for_month(cls, month: date) -> 'Partition':
+        return cls(name=f'{History.__tablename__}_{month:%Y_%m}', start=month.replace(day=1))
+
+
+class HistoryPartitionService:
+    """
+    Обслуживание помесячных партиций таблицы history:
+    создание партиций наперёд, выгрузка в архив и удаление партиций старше срока хранения.
+    Записи, для месяца которых партиции ещё нет, попадают в партицию по умолчанию history_default;
+    при создании партиции месяца они переносятся в неё, а устаревшие записи удаляются из history_default
+    вместе с устаревшими партициями.
+    """
+    table = History.__tablename__
+
+    def get_children(self) -> List[Tuple[str, bool]]:
+        """Имена партиций history и признак партиции по умолчанию."""
+        return db.session.execute(
+            text("SELECT child.relname, pg_get_expr(child.relpartbound, child.oid) = 'DEFAULT' FROM pg_inherits "
+                 'JOIN pg_class parent ON pg_inherits.inhparent = parent.oid '
+                 'JOIN pg_class child ON pg_inherits.inhrelid = child.oid '
+                 'WHERE parent.relname = :table'),
+            {'table': self.table},
+        ).all()
+
+    def get_default_partition(self) -> Optional[str]:
+        return next((name for name, is_default in self.get_children() if is_default), None)
+
+    def get_partitions(self) -> List[Partition]:
+        """Возвращает помесячные партиции history, от старых к новым."""
+        partitions = []
+        for name, _ in self.get_children():
+            match = PARTITION_NAME.match(name)
+            if match:
+                partitions.append(Partition(name=name, start=date(int(match[1]), int(match[2]), 1)))
+        return sorted(partitions, key=lambda partition: partition.start)
+
+    def create_partitions(self, months_ahead: int) -> List[Partition]:
+        """Создаёт недостающие партиции с текущего месяца на months_ahead месяцев вперёд."""
+        existing = {partition.name for partition in self.get_partitions()}
+        default = self.get_default_partition()
+        current = date.today().replace(day=1)
+        created = []
+        for months in range(months_ahead + 1):
+            partition = Partition.for_month(add_months(current, months))
+            if partition.name in existing:
+                continue
+            self.create_partition(partition, default)
+            created.append(partition)
+        db.session.commit()
+        return created
+
+    def create_partition(self, partition: Partition, default: Optional[str] = None) -> None:
+        """
+        Создаёт партицию месяца. Postgres не создаёт партицию, пока в партиции по умолчанию есть записи
+        за её месяц, поэтому такие записи переносятся: партиция по умолчанию отсоединяется, записи
+        перекладываются в новую партицию, и она присоединяется обратно — всё в одной транзакции.
+        """
+        bounds = {'start': partition.start, 'end': partition.end}
+        moved = default and db.session.execute(
+            text(f'SELECT EXISTS (SELECT 1 FROM {default} WHERE created >= :start AND created < :end)'), bounds,
+        ).scalar()
+        if moved:
+            db.session.execute(text(f'ALTER TABLE {self.table} DETACH PARTITION {default}'))
+        db.session.execute(text(
+            f'CREATE TABLE {partition.name} PARTITION OF {self.table} '
+            f"FOR VALUES FROM ('{partition.start}') TO ('{partition.end}')"
+        ))
+        if moved:
+            db.session.execute(text(
+                f'WITH moved AS (DELETE FROM {default} WHERE created >= :start AND created < :end RETURNING *) '
+                f'INSERT INTO {partition.name} SELECT * FROM moved'
+            ), bounds)
+            db.session.execute(text(f'ALTER TABLE {self.table} ATTACH PARTITION {default} DEFAULT'))
+
+    @staticmethod
+    def get_retention_boundary(retention_months: int) -> date:
+        """Записи раньше этой даты старше срока хранения."""
+        return add_months(date.today().replace(day=1), -retention_months)
+
+    def get_expired_partitions(self, retention_months: int) -> List[Partition]:
+        """Партиции, все записи которых старше retention_months месяцев."""
+        boundary = self.get_retention_boundary(retention_months)
+        return [partition for partition in self.get_partitions() if partition.end <= boundary]
+
+    def export_partition(self, partition: Partition, directory: Path) -> Path:
+        """Выгружает партицию в сжатый CSV потоком, не загружая её в память."""
+        return self.export(partition.name, directory.joinpath(f'{partition.name}.csv.gz'))
+
+    @staticmethod
+    def export(source: str, path: Path) -> Path:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        connection = db.engine.raw_connection()
+        try:
+            with gzip.open(path, 'wb') as file, connection.cursor() as cursor:
+                cursor.copy_expert(f'COPY {source} TO STDOUT WITH CSV HEADER', file)
+        finally:
+            connection.close()
+        return path
+
+    def count_expired_default(self, default: str, retention_months: int) -> int:
+        """Число записей партиции по умолчанию старше срока хранения."""
+        return db.session.execute(
+            text(f'SELECT count(*) FROM {default} WHERE created < :boundary'),
+            {'boundary': self.get_retention_boundary(retention_months)},
+        ).scalar()
+
+    def export_expired_default(self, default: str, retention_months: int, directory: Path) -> Path:
+        """Выгружает записи партиции по умолчанию старше срока хранения в сжатый CSV."""
+        boundary = self.get_retention_boundary(retention_months)
+        return self.export(
+            f"(SELECT * FROM {default} WHERE created < '{boundary}' ORDER BY created)",
+            directory.joinpath(f'{default}_{date.today():%Y_%m_%d}.csv.gz'),
+        )
+
+    def prune_default(self, default: str, retention_months: int) -> int:
+        """Удаляет записи партиции по умолчанию старше срока хранения и возвращает их число."""
+        deleted = db.session.execute(
+            text(f'DELETE FROM {default} WHERE created < :boundary'),
+            {'boundary': self.get_retention_boundary(retention_months)},
+        ).rowcount
+        db.session.commit()
+        return deleted
+
+    def drop_partition(self, partition: Partition) -> None:
+        """Отсоединяет партицию от history и удаляет её."""
+        db.session.execute(text(f'ALTER TABLE {self.table} DETACH PARTITION {partition.name}'))
+        db.session.execute(text(f'DROP TABLE {partition.name}'))
+        db.session.commit()
+
+
+Entry = Tuple[str, dict]
+
+
+class HistoryWriter:
+    """
+    Запись истории логинов вне запроса.
+    В режиме HISTORY_WRITER=stream запрос только добавляет запись в redis stream, а процесс
+    `flask history writer` читает stream в группе потребителей и вставляет записи пачками
+    по HISTORY_WRITER_BATCH_SIZE или раз в HISTORY_WRITER_FLUSH_INTERVAL секунд.
+    Запись подтверждается в stream только после коммита, так что доставка — хотя бы один раз;
+    повторная вставка той же записи игнорируется по первичному ключу. Если пачка не вставляется,
+    записи вставляются по одной, а те, что не вставились и так, переносятся в stream history:dead.
+    В режиме sync запись вставляется в транзакции запроса, как раньше.
+    """
+    stream = 'history:stream'
+    dead_stream = 'history:dead'
+    group = 'history-writer'
+
+    @staticmethod
+    def fit(column: str, value: str) -> str:
+        """Обрезает строку до длины колонки history, иначе запись не вставится."""
+        return value[:History.__table__.c[column].type.length]
+
+    def write(self, user: User, fingerprint: str, user_agent: str, **kwargs) -> None:
+        pk, created = uuid4(), datetime.utcnow()
+        fingerprint, user_agent = self.fit('fingerprint', fingerprint), self.fit('user_agent', user_agent)
+        if current_app.config['HISTORY_WRITER'] == 'sync':
+            db.session.add(History(id=pk, created=created, user=user, fingerprint=fingerprint, user_agent=user_agent))
+            save_changes()
+            return
+        record = {
+            'id': str(pk),
+            'created': created.isoformat(),
+            'user_id': str(user.id),
+            'fingerprint': fingerprint,
+            'user_agent': user_agent,
+        }
+        # Без MAXLEN: обрезка stream удалила бы и ещё не записанные в базу записи.
+        redis_client.xadd(self.stream, record)
+
+    def create_group(self) -> None:
+        try:
+            redis_client.xgroup_create(self.stream, self.group, id='0', mkstream=True)
+        except ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    def read(self, consumer: str, count: int, block_ms: int, pending: bool = False) -> List[Entry]:
+        """Читает новые записи, либо с pending — уже выданные этому потребителю и не подтверждённые."""
+        response = redis_client.xreadgroup(
+            self.group, consumer, {self.stream: '0' if pending else '>'},
+            count=count, block=None if pending else max(block_ms, 1),
+        )
+        return [entry for _, entries in response or [] for entry in entries if entry[1]]
+
+    def claim_stale(self, consumer: str, min_idle_ms: int, count: int) -> None:
+        """Забирает себе записи, которые потребители, завершившиеся аварийно, так и не подтвердили."""
+        stale = [
+            item['message_id'] for item in
+            redis_client.xpending_range(self.stream, self.group, min='-', max='+', count=count)
+            if item['consumer'] != consumer and item['time_since_delivered'] >= min_idle_ms
+        ]
+        if stale:
+            redis_client.xclaim(self.stream, self.group, consumer, min_idle_ms, stale)
+
+    @staticmethod
+    def insert(entries: List[Entry]) -> None:
+        rows = [{**record, 'created': datetime.fromisoformat(record['created'])} for _, record in entries]
+        db.session.execute(insert(History.__table__).on_conflict_do_nothing(), rows)
+        db.session.commit()
+
+    def flush(self, entries: List[Entry]) -> int:
+        """
+        Вставляет записи одним многострочным INSERT и подтверждает их в stream.
+        Если INSERT падает, вставляет записи по одной; не вставившиеся записи вместе с ошибкой
+        переносятся в dead_stream, чтобы одна плохая запись не останавливала writer.
+        Возвращает число вставленных записей.
+        """
+        if not entries:
+            return 0
+        dead: List[Tuple[Entry, Exception]] = []
+        try:
+            self.insert(entries)
+        except (SQLAlchemyError, ValueError):
+            db.session.rollback()
+            logger.warning('Пачка истории логинов не вставилась, записи вставляются по одной.', exc_info=True)
+            for entry in entries:
+                try:
+                    self.insert([entry])
+                except (SQLAlchemyError, ValueError) as e:
+                    db.session.rollback()
+                    dead.append((entry, e))
+        ids = [entry_id for entry_id, _ in entries]
+        pipe = redis_client.pipeline()
+        for (entry_id, record), error in dead:
+            logger.error('Запись истории %s перенесена в %s: %s', entry_id, self.dead_stream, error)
+            pipe.xadd(self.dead_stream, {**record, 'entry_id': entry_id, 'error': str(error)[:1000]})
+        pipe.xack(self.stream, self.group, *ids)
+        pipe.xdel(self.stream, *ids)
+        pipe.execute()
+        return len(entries) - len(dead)
+
+    def run(self, consumer: str, batch_size: int, flush_interval: float,
+            should_stop: Callable[[], bool]) -> int:
+        """
+        Переносит записи из stream в таблицу, пока should_stop() не вернёт True.
+        Перед выходом дописывает накопленную пачку. Возвращает число записанных записей.
+        """
+        self.create_group()
+        self.claim_stale(consumer, min_idle_ms=int(flush_interval * 1000) * 10, count=batch_size)
+        written = 0
+        while pending := self.read(consumer, batch_size, 0, pending=True):
+            written += self.flush(pending)
+
+        batch: List[Entry] = []
+        deadline = monotonic() + flush_interval
+        while not should_stop():
+            timeout_ms = int(max(deadline - monotonic(), 0) * 1000)
+            batch.extend(self.read(consumer, batch_size - len(batch), timeout_ms))
+            if len(batch) >= batch_size or monotonic() >= deadline:
+                written += self.flush(batch)
+                batch = []
+                deadline = monotonic() + flush_interval
+        return written + self.flush(batch)
+
+
+history_writer = HistoryWriter()
@@ -1,10 +1,129 @@
-from app.models import Role
+import json
+from typing import Iterable, List
+
+from flask import current_app
+from redis.exceptions import RedisError
+from sqlalchemy import event
+from sqlalchemy.orm import Session, selectinload
+
+from app.db import db
+from app.metrics import role_claims_cache_requests
+from app.models import Role, User, users_roles_association
+from app.redis import redis_client
 from app.services.base import AbstractService
+from app.services.revocation import revocation_service
+
+CHANGED = 'role_claims_changed'
+
+
+class RoleClaimsCache:
+    """
+    Имена ролей пользователя для claims токена, закешированные в redis.
+    Кеш общий для всех воркеров; его сбрасывают изменения ролей в RoleService после коммита
+    их транзакции, а TTL ограничивает срок жизни записи, если изменение прошло мимо сервиса.
+    """
+    prefix = 'role_claims'
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not event.contains(Session, 'after_commit', self.after_commit):
+            event.listen(Session, 'after_commit', self.after_commit)
+            event.listen(Session, 'after_rollback', self.after_rollback)
+
+    def key(self, user_id) -> str:
+        return f'{self.prefix}:{user_id}'
+
+    def get(self, user: User) -> List[str]:
+        key = self.key(user.id)
+        cached = redis_client.get(key)
+        if cached is not None:
+            role_claims_cache_requests.labels(result='hit').inc()
+            return json.loads(cached)
+        role_claims_cache_requests.labels(result='miss').inc()
+        roles = [
+            name for name, in
+            db.session.query(Role.name)
+            .join(users_roles_association, users_roles_association.c.role_id == Role.id)
+            .filter(users_roles_association.c.user_id == user.id)
+            .order_by(Role.name)
+        ]
+        redis_client.set(key, json.dumps(roles), ex=current_app.config['ROLE_CLAIMS_CACHE_TTL'])
+        return roles
+
+    def invalidate(self, user_ids: Iterable) -> None:
+        keys = [self.key(user_id) for user_id in user_ids]
+        if keys:
+            redis_client.delete(*keys)
+
+    @staticmethod
+    def mark_changed(user_ids: Iterable) -> None:
+        """Запоминает пользователей, чьи роли меняет текущая транзакция; кеш сбрасывается после её коммита."""
+        db.session.info.setdefault(CHANGED, set()).update(user_ids)
+
+    def after_commit(self, session):
+        user_ids = session.info.pop(CHANGED, None)
+        if user_ids:
+            try:
+                self.invalidate(user_ids)
+            except RedisError:
+                current_app.logger.warning('Не удалось сбросить кеш ролей, роли в токенах обновятся по TTL.')
+
+    @staticmethod
+    def after_rollback(session):
+        session.info.pop(CHANGED, None)
+
+
+role_claims_cache = RoleClaimsCache()
 
 
 class RoleService(AbstractService):
     model = Role
+    load_profiles = {
+        'with_users': (selectinload(Role.users),),
+    }
+
+    def get_rows_with_users(self, columns: list, user_columns: list) -> List[dict]:
+        """
+        Все роли с пользователями двумя запросами по колонкам, без объектов ORM:
+        роли — словари с колонками columns и списком users из строк с колонками user_columns.
+        """
+        members = {}
+        query = (
+            db.session.query(users_roles_association.c.role_id, *user_columns)
+            .join(User, User.id == users_roles_association.c.user_id)
+            .order_by(User.created, User.id)
+        )
+        for row in query:
+            members.setdefault(row.role_id, []).append(row)
+        return [
+            {**row._asdict(), 'users': members.get(row.id, [])}
+            for row in db.session.query(*columns).order_by(Role.created, Role.id)
+        ]
 
     def get_role_by_name(self, name: str):
         """Возвращает пользователя с юзернеймом username."""
         return self.model.query.filter_by(name=name).first()
+
+    def update(self, role, commit: bool = True, **kwargs):
+        """
+        Обновляет роль и сбрасывает кеш ролей у её прежних и новых пользователей.
+        Токены пользователей, лишившихся роли, отзываются.
+        """
+        user_ids = {user.id for user in role.users}
+        current_ids = {user.id for user in kwargs.get('users', role.users)}
+        role_claims_cache.mark_changed(user_ids | current_ids)
+        role = super().update(role, commit=commit, **kwargs)
+        for user_id in user_ids - current_ids:
+            revocation_service.revoke_user(user_id)
+        return role
+
+    def delete(self, role, commit: bool = True):
+        user_ids = [user.id for user in role.users]
+        role_claims_cache.mark_changed(user_ids)
+        role = super().delete(role, commit=commit)
+        for user_id in user_ids:
+            revocation_service.revoke_user(user_id)
+        return role
@@ -0,0 +1,131 @@
+from threading import Lock
+from time import time
+from typing import Dict, List, Optional
+
+from flask import current_app
+
+from app.bloom import BloomFilter
+from app.metrics import token_revocation_checks
+from app.redis import redis_client
+
+
+class TokenRevocationService:
+    """
+    Отзыв выданных токенов.
+    Отозванные jti хранятся в redis до истечения токена, перед redis стоит фильтр Блума
+    в памяти процесса: для неотозванного токена проверка обходится без сетевого запроса.
+    Отзыв всех токенов пользователя — отметка not-before: токены, выпущенные не позже неё, недействительны.
+    Фильтр и отметки синхронизируются с redis не чаще раза в TOKEN_REVOCATION_SYNC_INTERVAL секунд,
+    так что отзыв, сделанный другим воркером, вступает в силу с этой задержкой.
+    """
+    prefix = 'revoked'
+
+    def __init__(self):
+        self._bloom = BloomFilter(1)
+        self._not_before: Dict[str, int] = {}
+        self._version: Optional[str] = None
+        self._synced = 0.0
+        self._lock = Lock()
+
+    def jti_key(self, jti: str) -> str:
+        return f'{self.prefix}:jti:{jti}'
+
+    @property
+    def jtis_key(self) -> str:
+        return f'{self.prefix}:jtis'
+
+    @property
+    def not_before_key(self) -> str:
+        return f'{self.prefix}:not_before'
+
+    @property
+    def version_key(self) -> str:
+        return f'{self.prefix}:version'
+
+    def revoke(self, claims: dict) -> None:
+        """Отзывает один токен до истечения его срока действия."""
+        jti, exp = claims.get('jti'), claims.get('exp', 0)
+        ttl = int(exp - time()) + 1
+        if not jti or ttl <= 0:
+            return
+        pipe = redis_client.pipeline()
+        pipe.set(self.jti_key(jti), 1, ex=ttl)
+        pipe.zadd(self.jtis_key, {jti: exp})
+        pipe.incr(self.version_key)
+        pipe.execute()
+        with self._lock:
+            self._bloom.add(jti)
+
+    def revoke_user(self, user_id) -> None:
+        """
+        Отзывает все токены пользователя, выпущенные не позже текущей секунды.
+        iat в токене целый, поэтому токены, выпущенные в ту же секунду после отзыва, тоже недействительны.
+        """
+        not_before = int(time())
+        pipe = redis_client.pipeline()
+        pipe.hset(self.not_before_key, str(user_id), not_before)
+        pipe.incr(self.version_key)
+        pipe.execute()
+        with self._lock:
+            self._not_before[str(user_id)] = not_before
+
+    def is_revoked(self, claims: dict) -> bool:
+        return self.are_revoked([claims])[0]
+
+    def are_revoked(self, claims_list: List[dict]) -> List[bool]:
+        """Проверяет пачку токенов; jti, прошедшие фильтр Блума, проверяются в redis одним запросом."""
+        self.sync()
+        revoked = [False] * len(claims_list)
+        suspects = []
+        for i, claims in enumerate(claims_list):
+            if claims.get('iat', 0) <= self._not_before.get(claims.get('user_id'), -1):
+                token_revocation_checks.labels(result='not_before').inc()
+                revoked[i] = True
+                continue
+            jti = claims.get('jti')
+            if not jti or jti not in self._bloom:
+                token_revocation_checks.labels(result='bloom_negative').inc()
+                continue
+            suspects.append((i, jti))
+        if suspects:
+            pipe = redis_client.pipeline(transaction=False)
+            for _, jti in suspects:
+                pipe.exists(self.jti_key(jti))
+            for (i, _), exists in zip(suspects, pipe.execute()):
+                revoked[i] = bool(exists)
+                token_revocation_checks.labels(result='revoked' if exists else 'false_positive').inc()
+        return revoked
+
+    def sync(self, force: bool = False) -> None:
+        """Перестраивает фильтр и отметки not-before по redis, если с прошлой синхронизации что-то отозвано."""
+        interval = current_app.config['TOKEN_REVOCATION_SYNC_INTERVAL']
+        if not force and time() - self._synced < interval:
+            return
+        with self._lock:
+            if not force and time() - self._synced < interval:
+                return
+            self._synced = time()
+            version = redis_client.get(self.version_key)
+            if not force and version == self._version:
+                return
+            now = time()
+            pipe = redis_client.pipeline()
+            pipe.zremrangebyscore(self.jtis_key, '-inf', now)
+            pipe.zrange(self.jtis_key, 0, -1)
+            pipe.hgetall(self.not_before_key)
+            _, jtis, not_before = pipe.execute()
+
+            # Отметки старше срока жизни refresh-токена уже ничего не отзывают.
+            horizon = now - current_app.config['REFRESH_TOKEN_EXPIRATION']
+            stale = [user_id for user_id, value in not_before.items() if int(value) < horizon]
+            if stale:
+                redis_client.hdel(self.not_before_key, *stale)
+
+            capacity = max(current_app.config['TOKEN_REVOCATION_BLOOM_CAPACITY'], 2 * len(jtis))
+            self._bloom = BloomFilter.from_items(jtis, capacity)
+            self._not_before = {user_id: int(value) for user_id, value in not_before.items()
+                                if int(value) >= horizon}
+            self._version = version
+
+
+revocation_service = TokenRevocationService()
@@ -1,7 +1,17 @@
-from datetime import datetime
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from hashlib import sha256
+from time import time
+from typing import List, NamedTuple, Optional
+from uuid import uuid4
 
+from flask import current_app
+
+from app.db import db
 from app.models import History, Session, User
-from app.services.base import AbstractService
+from app.redis import redis_client
+from app.services.base import AbstractService, save_changes
+from app.services.history import history_writer
 
 
 class HistoryService(AbstractService):
@@ -15,14 +25,321 @@ class HistoryService(AbstractService):
 history_service = HistoryService()
 
 
+def hash_token(value: str) -> str:
+    return sha256(value.encode()).hexdigest()
+
+
+class SessionData(NamedTuple):
+    refresh_token: str
+    user_id: str
+    fingerprint: str
+    user_agent: str
+    # Все сессии, полученные ротацией из одного логина, образуют семейство.
+    family: str
+
+
+class AbstractSessionStore(ABC):
+    """Хранилище refresh-сессий."""
+
+    @abstractmethod
+    def save(self, session: SessionData, expires: int, limit: Optional[int] = None) -> None:
+        """Сохраняет сессию; если у устройства больше limit сессий, удаляет самые старые."""
+
+    @abstractmethod
+    def get(self, refresh_token: str) -> Optional[SessionData]:
+        pass
+
+    @abstractmethod
+    def delete(self, refresh_token: str) -> None:
+        pass
+
+    @abstractmethod
+    def rotate(self, previous: SessionData, session: SessionData, expires: int) -> bool:
+        """Атомарно заменяет previous на session. False, если previous уже использована."""
+
+    @abstractmethod
+    def get_rotated(self, refresh_token: str) -> Optional[SessionData]:
+        """Возвращает сессию, если её refresh-токен уже был обменян на новый."""
+
+    @abstractmethod
+    def revoke_family(self, session: SessionData) -> None:
+        """Удаляет все сессии семейства session."""
+
+    @abstractmethod
+    def purge_expired(self) -> int:
+        """Удаляет истёкшие сессии и возвращает их число."""
+
+
+class RedisSessionStore(AbstractSessionStore):
+    """
+    Сессии в redis: одна хеш-таблица на refresh-токен, TTL равен сроку жизни токена.
+    Рядом хранятся множество токенов семейства, сессии устройства по времени создания
+    и отметки об уже обменянных токенах для обнаружения повторного использования.
+    """
+    prefix = 'session'
+
+    def key(self, refresh_token: str) -> str:
+        return f'{self.prefix}:{hash_token(refresh_token)}'
+
+    def rotated_key(self, refresh_token: str) -> str:
+        return f'{self.prefix}:rotated:{hash_token(refresh_token)}'
+
+    def family_key(self, family: str) -> str:
+        return f'{self.prefix}:family:{family}'
+
+    def device_key(self, session: SessionData) -> str:
+        return f'{self.prefix}:device:{session.user_id}:{hash_token(session.fingerprint)}'
+
+    def save(self, session: SessionData, expires: int, limit: Optional[int] = None) -> None:
+        key = self.key(session.refresh_token)
+        family_key = self.family_key(session.family)
+        device_key = self.device_key(session)
+        now = time()
+        pipe = redis_client.pipeline()
+        pipe.hset(key, mapping=session._asdict())
+        pipe.expire(key, expires)
+        pipe.sadd(family_key, key)
+        pipe.expire(family_key, expires)
+        pipe.zremrangebyscore(device_key, '-inf', now - expires)
+        pipe.zadd(device_key, {key: now})
+        pipe.expire(device_key, expires)
+        pipe.zcard(device_key)
+        count = pipe.execute()[-1]
+        if limit and count > limit:
+            self.evict(device_key, count - limit)
+
+    def evict(self, device_key: str, count: int) -> None:
+        """Удаляет count самых старых сессий устройства вместе с их записями в множествах семейств."""
+        evicted = [member for member, _ in redis_client.zpopmin(device_key, count)]
+        if not evicted:
+            return
+        pipe = redis_client.pipeline(transaction=False)
+        for key in evicted:
+            pipe.hget(key, 'family')
+        families = pipe.execute()
+        pipe = redis_client.pipeline()
+        for key, family in zip(evicted, families):
+            if family:
+                pipe.srem(self.family_key(family), key)
+        pipe.delete(*evicted)
+        pipe.execute()
+
+    def get(self, refresh_token: str) -> Optional[SessionData]:
+        data = redis_client.hgetall(self.key(refresh_token))
+        return SessionData(**data) if data else None
+
+    def delete(self, refresh_token: str) -> None:
+        redis_client.delete(self.key(refresh_token))
+
+    def rotate(self, previous: SessionData, session: SessionData, expires: int) -> bool:
+        previous_key = self.key(previous.refresh_token)
+        # Удалить ключ может только один запрос — он и выигрывает ротацию.
+        if not redis_client.delete(previous_key):
+            return False
+        rotated_key = self.rotated_key(previous.refresh_token)
+        pipe = redis_client.pipeline()
+        pipe.hset(rotated_key, mapping=previous._asdict())
+        pipe.expire(rotated_key, expires)
+        pipe.srem(self.family_key(previous.family), previous_key)
+        pipe.zrem(self.device_key(previous), previous_key)
+        pipe.execute()
+        self.save(session, expires)
+        return True
+
+    def get_rotated(self, refresh_token: str) -> Optional[SessionData]:
+        data = redis_client.hgetall(self.rotated_key(refresh_token))
+        return SessionData(**data) if data else None
+
+    def revoke_family(self, session: SessionData) -> None:
+        family_key = self.family_key(session.family)
+        keys = redis_client.smembers(family_key)
+        pipe = redis_client.pipeline()
+        pipe.delete(family_key, *keys)
+        if keys:
+            pipe.zrem(self.device_key(session), *keys)
+        pipe.execute()
+
+    def purge_expired(self) -> int:
+        # Истёкшие сессии redis удаляет сам по TTL.
+        return 0
+
+
+class DatabaseSessionStore(AbstractSessionStore):
+    """
+    Сессии в таблице sessions. Вместо refresh-токена хранится его sha256.
+    Ротация обновляет строку на месте, поэтому повторное использование обменянного токена не распознаётся.
+    В режиме аудита (копия сессий из redis) таблица хранит историю всех сессий: строки не вытесняются
+    лимитом устройства и не удаляются ни по истечении, ни при отзыве: отозванная сессия помечается истёкшей,
+    а ротация помечает истёкшей предыдущую строку и добавляет новую.
+    """
+    model = Session
+
+    def __init__(self, audit: bool = False):
+        self.audit = audit
+
+    def save(self, session: SessionData, expires: int, limit: Optional[int] = None) -> None:
+        now = datetime.utcnow()
+        data = session._asdict()
+        data['refresh_token_hash'] = hash_token(data.pop('refresh_token'))
+        db.session.add(self.model(**data, expired=now + timedelta(seconds=expires)))
+        if limit and not self.audit:
+            evicted = (
+                db.session.query(self.model.id)
+                .filter(self.model.user_id == session.user_id,
+                        self.model.fingerprint == session.fingerprint,
+                        self.model.expired > now)
+                .order_by(self.model.created.desc())
+                .offset(limit)
+            )
+            self.model.query.filter(self.model.id.in_(evicted)).delete(synchronize_session=False)
+        save_changes()
+
+    def get(self, refresh_token: str) -> Optional[SessionData]:
+        session = self.model.query.filter(
+            self.model.refresh_token_hash == hash_token(refresh_token),
+            self.model.expired > datetime.utcnow(),
+        ).first()
+        if not session:
+            return None
+        return SessionData(
+            refresh_token=refresh_token,
+            user_id=str(session.user_id),
+            fingerprint=session.fingerprint,
+            user_agent=session.user_agent,
+            family=str(session.family),
+        )
+
+    def expire(self, *criterion) -> int:
+        """Помечает истёкшими действующие сессии, подходящие под criterion, и возвращает их число."""
+        now = datetime.utcnow()
+        return self.model.query.filter(*criterion, self.model.expired > now).update(
+            {'expired': now, 'updated': now},
+            synchronize_session=False,
+        )
+
+    def delete(self, refresh_token: str) -> None:
+        if self.audit:
+            self.expire(self.model.refresh_token_hash == hash_token(refresh_token))
+        else:
+            self.model.query.filter_by(refresh_token_hash=hash_token(refresh_token)).delete()
+        save_changes()
+
+    def rotate(self, previous: SessionData, session: SessionData, expires: int) -> bool:
+        if self.audit:
+            if not self.expire(self.model.refresh_token_hash == hash_token(previous.refresh_token)):
+                return False
+            self.save(session, expires)
+            return True
+        now = datetime.utcnow()
+        updated = self.model.query.filter_by(refresh_token_hash=hash_token(previous.refresh_token)).update(
+            {
+                'refresh_token_hash': hash_token(session.refresh_token),
+                'user_agent': session.user_agent,
+                'expired': now + timedelta(seconds=expires),
+                'updated': now,
+            },
+            synchronize_session=False,
+        )
+        save_changes()
+        return updated == 1
+
+    def get_rotated(self, refresh_token: str) -> Optional[SessionData]:
+        return None
+
+    def revoke_family(self, session: SessionData) -> None:
+        if self.audit:
+            self.expire(self.model.family == session.family)
+        else:
+            self.model.query.filter_by(family=session.family).delete()
+        save_changes()
+
+    def purge_expired(self) -> int:
+        if self.audit:
+            return 0
+        deleted = self.model.query.filter(self.model.expired < datetime.utcnow()).delete()
+        save_changes()
+        return deleted
+
+
+session_stores = {
+    'redis': RedisSessionStore,
+    'database': DatabaseSessionStore,
+}
+
+
 class SessionService(AbstractService):
     model = Session
 
+    @property
+    def store(self) -> AbstractSessionStore:
+        """Основное хранилище сессий, выбирается настройкой SESSION_STORE."""
+        return session_stores[current_app.config['SESSION_STORE']]()
+
+    @property
+    def audit_store(self) -> Optional[AbstractSessionStore]:
+        """Копия сессий в postgres, если основное хранилище — не база."""
+        if current_app.config['SESSION_STORE'] == 'database' or not current_app.config['SESSION_AUDIT']:
+            return None
+        return DatabaseSessionStore(audit=True)
+
+    @property
+    def stores(self) -> List[AbstractSessionStore]:
+        return [store for store in (self.store, self.audit_store) if store]
+
+    @staticmethod
+    def make_session(family: str, **kwargs) -> SessionData:
+        return SessionData(
+            refresh_token=kwargs['refresh_token'],
+            user_id=str(kwargs['user'].id),
+            fingerprint=kwargs['fingerprint'],
+            user_agent=kwargs['user_agent'],
+            family=family,
+        )
+
     def create(self, **kwargs):
-        session = super().create(**kwargs)
-        history_service.create(**kwargs)
+        """Создаёт сессию нового логина с новым семейством токенов."""
+        session = self.make_session(family=str(uuid4()), **kwargs)
+        expires = current_app.config['REFRESH_TOKEN_EXPIRATION']
+        for store in self.stores:
+            store.save(session, expires, limit=current_app.config['SESSIONS_PER_DEVICE'])
+        history_writer.write(**kwargs)
         return session
 
+    def rotate(self, previous: SessionData, **kwargs) -> Optional[SessionData]:
+        """
+        Заменяет сессию previous новой в том же семействе.
+        Если previous уже обменяна параллельным запросом, отзывает всё семейство и возвращает None.
+        """
+        session = self.make_session(family=previous.family, **kwargs)
+        expires = current_app.config['REFRESH_TOKEN_EXPIRATION']
+        store, audit_store = self.store, self.audit_store
+        if not store.rotate(previous, session, expires):
+            self.revoke_family(previous)
+            return None
+        if audit_store:
+            audit_store.rotate(previous, session, expires)
+        history_writer.write(**kwargs)
+        return session
+
+    def revoke(self, refresh_token: str) -> None:
+        """Удаляет сессию refresh-токена из всех хранилищ."""
+        for store in self.stores:
+            store.delete(refresh_token)
+
+    def revoke_family(self, session: SessionData) -> None:
+        for store in self.stores:
+            store.revoke_family(session)
+
+    def revoke_if_reused(self, refresh_token: str) -> bool:
+        """Если refresh-токен уже был обменян, отзывает все сессии его семейства."""
+        rotated = self.store.get_rotated(refresh_token) if refresh_token else None
+        if rotated:
+            self.revoke_family(rotated)
+        return rotated is not None
+
+    def purge_expired(self) -> int:
+        return sum(store.purge_expired() for store in self.stores)
+
     def get_by_user(self, user: User, fingerprint: str, user_agent: str) -> Session:
         """Возвращает сессию указанного пользователя."""
         return self.model.query.filter(
@@ -36,10 +353,11 @@ class SessionService(AbstractService):
             refresh_token: str,
             fingerprint: str,
             user_agent: str,
-    ):
+    ) -> Optional[SessionData]:
         """Возвращает сессию по рефреш токену."""
-        return self.model.query.filter(
-            self.model.refresh_token == refresh_token,
-            self.model.user_agent == user_agent,
-            self.model.fingerprint == fingerprint
-        ).first()
+        if not refresh_token:
+            return None
+        session = self.store.get(refresh_token)
+        if not session or (session.fingerprint, session.user_agent) != (fingerprint, user_agent):
+            return None
+        return session
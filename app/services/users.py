@@ -1,8 +1,24 @@
-from typing import Iterable
-from app.bcrypt import bcrypt
+import logging
+from threading import Lock, Thread
+from time import sleep, time
+from typing import Iterable, Optional
+
+from flask import current_app
+from redis.exceptions import RedisError
+from sqlalchemy import event, inspect
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.bcrypt import HashingPoolSaturated, bcrypt
+from app.bloom import BloomFilter
+from app.cache import response_cache
+from app.db import db
+from app.metrics import username_filter_bytes, username_filter_checks, username_filter_false_positive_rate
 from app.models import Profile, User, Role
+from app.redis import redis_client
 from app.services.base import AbstractService
 
+logger = logging.getLogger(__name__)
+
 
 class ProfileService(AbstractService):
     model = Profile
@@ -23,13 +39,158 @@ class UserService(AbstractService):
         """Возвращает пользователей с совпадающими username с usernames."""
         return self.model.query.filter(self.model.username.in_(usernames))
 
-    def create(self, **kwargs):
-        user = super().create(**kwargs)
+    def create(self, commit: bool = True, **kwargs):
+        """Создаёт пользователя вместе с профилем одним коммитом."""
+        user = super().create(commit=False, **kwargs)
         profile_service = ProfileService()
-        profile_service.create(user=user, **kwargs)
+        profile_service.create(user=user, commit=commit, **kwargs)
         return user
 
-    def update(self, user, **kwargs):
+    def update(self, user, commit: bool = True, **kwargs):
         if kwargs.get('password'):
             kwargs['password'] = user.hash_password(kwargs['password'])
-        return super().update(user, **kwargs)
+        return super().update(user, commit=commit, **kwargs)
+
+    def rehash_password(self, user: User, password: str) -> Thread:
+        """
+        Пересчитывает хеш пароля с текущей стоимостью в фоне (под gevent — в гринлете),
+        чтобы ответ на логин не ждал второго bcrypt.
+        """
+        thread = Thread(
+            target=self._rehash_password,
+            args=(current_app._get_current_object(), user.id, user.password, password),
+            daemon=True,
+        )
+        thread.start()
+        return thread
+
+    def _rehash_password(self, app, user_id, pw_hash: str, password: str) -> None:
+        with app.app_context():
+            try:
+                new_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+                # Хеш заменяется, только если пароль не сменили, пока считался новый.
+                updated = self.model.query.filter_by(id=user_id, password=pw_hash).update(
+                    {'password': new_hash}, synchronize_session=False,
+                )
+                if updated:
+                    response_cache.mark_changed(self.model, user_id)
+                db.session.commit()
+            except (HashingPoolSaturated, SQLAlchemyError):
+                db.session.rollback()
+                logger.warning('Не удалось пересчитать хеш пароля, повторим при следующем входе.', exc_info=True)
+            finally:
+                db.session.remove()
+
+
+class UsernameFilter:
+    """
+    Фильтр Блума по username всех пользователей: вход под заведомо несуществующим именем
+    отклоняется без запроса к базе.
+    Фильтр строится из users.username в фоне при старте приложения и перестраивается там же раз в
+    USERNAME_FILTER_REBUILD_INTERVAL секунд, так что запрос никогда не ждёт построения. Пока фильтр
+    не построен, любое имя считается существующим. Новые имена сразу попадают в фильтр своего воркера
+    и в redis; если фильтр отвечает «нет», имя ищется среди недавно добавленных в redis, поэтому
+    пользователь, созданный через другой воркер, может войти сразу. Без redis имя считается существующим.
+    """
+    key = 'usernames:recent'
+
+    def __init__(self, app=None):
+        self._bloom: Optional[BloomFilter] = None
+        self._lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # В тестах фильтр строят явно через rebuild(), чтобы фоновые запросы не мешали проверкам.
+        if not app.testing:
+            Thread(target=self._refresh, args=(app,), daemon=True).start()
+
+    def _refresh(self, app) -> None:
+        while True:
+            with app.app_context():
+                try:
+                    self.rebuild()
+                except SQLAlchemyError:
+                    logger.warning('Не удалось построить фильтр username, повторим через %s с.',
+                                   app.config['USERNAME_FILTER_REBUILD_INTERVAL'], exc_info=True)
+                finally:
+                    db.session.remove()
+            sleep(app.config['USERNAME_FILTER_REBUILD_INTERVAL'])
+
+    @property
+    def bloom(self) -> Optional[BloomFilter]:
+        return self._bloom
+
+    def rebuild(self) -> None:
+        """
+        Строит фильтр заново и подменяет им текущий. Блокировка берётся только на подмену:
+        имена, добавленные во время построения, есть в redis и попадут в фильтр при проверке.
+        """
+        usernames = [username for username, in db.session.query(User.username).yield_per(10000)]
+        capacity = max(current_app.config['USERNAME_FILTER_CAPACITY'], 2 * len(usernames))
+        bloom = BloomFilter.from_items(usernames, capacity, current_app.config['USERNAME_FILTER_ERROR_RATE'])
+        with self._lock:
+            self._bloom = bloom
+        username_filter_bytes.set(bloom.memory)
+        username_filter_false_positive_rate.set(bloom.false_positive_rate)
+
+    def add(self, *usernames: str) -> None:
+        """Добавляет имена в фильтр воркера и в redis, откуда их увидят остальные воркеры."""
+        if not usernames:
+            return
+        with self._lock:
+            if self._bloom is not None:
+                for username in usernames:
+                    self._bloom.add(username)
+                username_filter_false_positive_rate.set(self._bloom.false_positive_rate)
+        now = time()
+        # Имена нужны в redis, пока каждый воркер не перестроит фильтр из базы.
+        horizon = now - 2 * current_app.config['USERNAME_FILTER_REBUILD_INTERVAL']
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.zadd(self.key, {username: now for username in usernames})
+            pipe.zremrangebyscore(self.key, '-inf', horizon)
+            pipe.execute()
+        except RedisError:
+            logger.warning('Не удалось передать новые username в redis, другие воркеры увидят их после перестроения фильтра.')
+
+    def might_exist(self, username: str) -> bool:
+        """False означает, что пользователя точно нет; True — что его нужно искать в базе."""
+        if not username:
+            return False
+        bloom = self._bloom
+        if bloom is None:
+            return True
+        if username in bloom:
+            username_filter_checks.labels(result='positive').inc()
+            return True
+        try:
+            recent = redis_client.zscore(self.key, username) is not None
+        except RedisError:
+            recent = True
+        if recent:
+            username_filter_checks.labels(result='recent').inc()
+            with self._lock:
+                self._bloom.add(username)
+            return True
+        username_filter_checks.labels(result='negative').inc()
+        return False
+
+    @staticmethod
+    def false_positive() -> None:
+        """Фильтр ответил «возможно есть», а пользователя в базе не нашлось."""
+        username_filter_checks.labels(result='false_positive').inc()
+
+
+username_filter = UsernameFilter()
+
+
+@event.listens_for(User, 'after_insert')
+def add_inserted_username(mapper, connection, user):
+    username_filter.add(user.username)
+
+
+@event.listens_for(User, 'after_update')
+def add_renamed_username(mapper, connection, user):
+    if inspect(user).attrs.username.history.has_changes():
+        username_filter.add(user.username)
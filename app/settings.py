@@ -1,18 +1,107 @@
 from pathlib import Path
 
 from decouple import AutoConfig
+from sqlalchemy.pool import NullPool
+
+from app.db import InstrumentedQueuePool
 
 BASE_DIR = Path(__file__).parent
 
 config = AutoConfig(search_path=BASE_DIR.joinpath('config'))
 
 
+def get_engine_options() -> dict:
+    """
+    Параметры пула соединений. Под uwsgi пул у каждого воркера свой, так что к базе открывается
+    до workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) соединений.
+    С DB_PGBOUNCER пул держит PgBouncer, а приложение открывает соединение на каждую транзакцию.
+    """
+    if config('DB_PGBOUNCER', default=False, cast=bool):
+        return {'poolclass': NullPool}
+    return {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': config('DB_POOL_SIZE', default=15, cast=int),
+        'max_overflow': config('DB_MAX_OVERFLOW', default=5, cast=int),
+        'pool_timeout': config('DB_POOL_TIMEOUT', default=10, cast=int),
+        'pool_recycle': config('DB_POOL_RECYCLE', default=1800, cast=int),
+        'pool_pre_ping': config('DB_POOL_PRE_PING', default=True, cast=bool),
+    }
+
+
 class BasicConfig:
     SECRET_KEY = config('SECRET_KEY')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_DATABASE_URI = (f'postgresql://{config("POSTGRES_USER")}:'
                                f'{config("POSTGRES_PASSWORD")}'
                                f'@db/{config("POSTGRES_DB")}')
+    SQLALCHEMY_ENGINE_OPTIONS = get_engine_options()
+    REDIS_URL = config('REDIS_URL', default='redis://redis:6379/0')
+    # Каталог с ключами подписи <kid>.pem и kid ключа, которым подписываются новые токены.
+    JWT_KEYS_DIR = config('JWT_KEYS_DIR', default='')
+    JWT_SIGNING_KEY_ID = config('JWT_SIGNING_KEY_ID', default='')
+    # Сколько секунд клиенты могут кешировать /.well-known/jwks.json.
+    JWKS_MAX_AGE = config('JWKS_MAX_AGE', default=300, cast=int)
+    ACCESS_TOKEN_EXPIRATION = config('ACCESS_TOKEN_EXPIRATION', cast=int)
+    REFRESH_TOKEN_EXPIRATION = config('REFRESH_TOKEN_EXPIRATION', cast=int)
+    # Хранилище refresh-сессий: redis или database.
+    SESSION_STORE = config('SESSION_STORE', default='redis')
+    # Дублировать ли сессии из redis в таблицу sessions для аудита.
+    SESSION_AUDIT = config('SESSION_AUDIT', default=True, cast=bool)
+    # Сколько живых сессий может быть у пользователя на одном устройстве.
+    SESSIONS_PER_DEVICE = config('SESSIONS_PER_DEVICE', default=5, cast=int)
+    # Как часто воркер сверяет список отозванных токенов с redis и на сколько jti рассчитан фильтр Блума.
+    TOKEN_REVOCATION_SYNC_INTERVAL = config('TOKEN_REVOCATION_SYNC_INTERVAL', default=5, cast=int)
+    TOKEN_REVOCATION_BLOOM_CAPACITY = config('TOKEN_REVOCATION_BLOOM_CAPACITY', default=100000, cast=int)
+    # Фильтр Блума по username: на сколько имён рассчитан, допустимая доля ложноположительных ответов
+    # и как часто перестраивается из базы.
+    USERNAME_FILTER_CAPACITY = config('USERNAME_FILTER_CAPACITY', default=1000000, cast=int)
+    USERNAME_FILTER_ERROR_RATE = config('USERNAME_FILTER_ERROR_RATE', default=0.01, cast=float)
+    USERNAME_FILTER_REBUILD_INTERVAL = config('USERNAME_FILTER_REBUILD_INTERVAL', default=3600, cast=int)
+    # Наибольший размер тела запроса к API в байтах; больше — 413 до разбора JSON.
+    MAX_PAYLOAD_SIZE = config('MAX_PAYLOAD_SIZE', default=16384, cast=int)
+    # Сколько токенов можно проверить одним запросом к /auth/introspect и сколько байт отводится на токен:
+    # токен RS256 с kid занимает около 600 байт, остальное — на список ролей.
+    INTROSPECTION_MAX_BATCH = config('INTROSPECTION_MAX_BATCH', default=100, cast=int)
+    INTROSPECTION_MAX_TOKEN_SIZE = config('INTROSPECTION_MAX_TOKEN_SIZE', default=2048, cast=int)
+    # Сколько секунд хранится тело закешированного ответа и сколько запрос ждёт ответа,
+    # который строит другой запрос.
+    RESPONSE_CACHE_TTL = config('RESPONSE_CACHE_TTL', default=3600, cast=int)
+    RESPONSE_CACHE_LOCK_TIMEOUT = config('RESPONSE_CACHE_LOCK_TIMEOUT', default=5, cast=int)
+    # Сколько секунд роли пользователя для claims токена живут в кеше.
+    ROLE_CLAIMS_CACHE_TTL = config('ROLE_CLAIMS_CACHE_TTL', default=300, cast=int)
+    # Лимиты попыток по эндпоинтам auth: '<ip|username|fingerprint>:<попыток>/<секунд>,...'.
+    RATE_LIMITS = {
+        'login': config('RATE_LIMIT_LOGIN', default='ip:30/60,username:5/60,fingerprint:10/60'),
+        'register': config('RATE_LIMIT_REGISTER', default='ip:10/600,fingerprint:5/600'),
+        'refresh': config('RATE_LIMIT_REFRESH', default='ip:60/60,fingerprint:20/60'),
+    }
+    # Первая блокировка после превышения лимита, каждая следующая вдвое дольше, но не дольше максимума.
+    RATE_LIMIT_LOCKOUT = config('RATE_LIMIT_LOCKOUT', default=60, cast=int)
+    RATE_LIMIT_MAX_LOCKOUT = config('RATE_LIMIT_MAX_LOCKOUT', default=3600, cast=int)
+    # Сколько прокси перед приложением добавляют X-Forwarded-For (caddy в production).
+    PROXY_COUNT = config('PROXY_COUNT', default=0, cast=int)
+    # Стоимость bcrypt; подбирается командой `flask bcrypt calibrate`.
+    BCRYPT_LOG_ROUNDS = config('BCRYPT_LOG_ROUNDS', default=12, cast=int)
+    # Пул потоков bcrypt в каждом воркере и допустимая очередь к нему.
+    PASSWORD_HASHING_POOL_SIZE = config('PASSWORD_HASHING_POOL_SIZE', default=2, cast=int)
+    PASSWORD_HASHING_MAX_QUEUE = config('PASSWORD_HASHING_MAX_QUEUE', default=32, cast=int)
+    PASSWORD_HASHING_RETRY_AFTER = config('PASSWORD_HASHING_RETRY_AFTER', default=1, cast=int)
+    # Отдельный пул bcrypt для массового импорта пользователей.
+    PASSWORD_IMPORT_HASHING_POOL_SIZE = config('PASSWORD_IMPORT_HASHING_POOL_SIZE', default=1, cast=int)
+    USERS_IMPORT_CHUNK_SIZE = config('USERS_IMPORT_CHUNK_SIZE', default=1000, cast=int)
+    # Партиции history: сколько месяцев создавать наперёд, сколько хранить и куда выгружать.
+    HISTORY_PARTITIONS_AHEAD = config('HISTORY_PARTITIONS_AHEAD', default=3, cast=int)
+    HISTORY_RETENTION_MONTHS = config('HISTORY_RETENTION_MONTHS', default=12, cast=int)
+    HISTORY_ARCHIVE_DIR = config('HISTORY_ARCHIVE_DIR', default=str(BASE_DIR.parent.joinpath('archive')))
+    # Запись истории логинов: stream — через redis stream и `flask history writer`, sync — в запросе.
+    HISTORY_WRITER = config('HISTORY_WRITER', default='stream')
+    HISTORY_WRITER_BATCH_SIZE = config('HISTORY_WRITER_BATCH_SIZE', default=500, cast=int)
+    HISTORY_WRITER_FLUSH_INTERVAL = config('HISTORY_WRITER_FLUSH_INTERVAL', default=1.0, cast=float)
+    # SQL-запросы дольше SQL_SLOW_QUERY_MS пишутся в лог с вероятностью SQL_SLOW_QUERY_SAMPLE_RATE.
+    SQL_SLOW_QUERY_MS = config('SQL_SLOW_QUERY_MS', default=100, cast=int)
+    SQL_SLOW_QUERY_SAMPLE_RATE = config('SQL_SLOW_QUERY_SAMPLE_RATE', default=1.0, cast=float)
+    # Сколько самых медленных запросов показывать в заголовке X-DB-Slowest в режиме отладки.
+    SQL_SLOWEST_STATEMENTS = config('SQL_SLOWEST_STATEMENTS', default=3, cast=int)
     TESTING = False
 
 
@@ -22,10 +111,12 @@ class DevelopmentConfig(BasicConfig):
 
 class TestingConfig(BasicConfig):
     TESTING = True
+    BCRYPT_LOG_ROUNDS = 4
+    HISTORY_WRITER = 'sync'
     SQLALCHEMY_DATABASE_URI = (f'postgresql://{config("POSTGRES_USER")}:'
                                f'{config("POSTGRES_PASSWORD")}'
                                f'@db/{config("POSTGRES_DB")}_test')
 
 
 class ProductionConfig(BasicConfig):
-    pass
+    PROXY_COUNT = config('PROXY_COUNT', default=1, cast=int)
@@ -1,6 +1,13 @@
+from contextlib import contextmanager
+from typing import Iterator, List, Tuple
+
 import pytest
+from fakeredis import FakeStrictRedis
+from sqlalchemy import event
 
 from app import create_app, db
+from app.bcrypt import bcrypt
+from app.redis import redis_client
 from app.services import JWTService
 
 from app.factories import HeaderFactory, UserFactory, RoleFactory
@@ -10,12 +17,21 @@ from app.factories import HeaderFactory, UserFactory, RoleFactory
 def test_app():
     app = create_app()
     app.config.from_object("app.settings.TestingConfig")
+    bcrypt.init_app(app)
+    redis_client.provider_class = FakeStrictRedis
+    redis_client.init_app(app)
     with app.app_context():
         yield app
 
 
 @pytest.fixture
-def test_db():
+def test_redis():
+    yield redis_client
+    redis_client.flushdb()
+
+
+@pytest.fixture
+def test_db(test_redis):
     db.create_all()
     yield db
     db.session.remove()
@@ -45,3 +61,41 @@ def user_admin_headers(auth_headers):
 
 def get_user_id_from_token(token: str) -> dict:
     return JWTService.decode_token(token)['user_id']
+
+
+@contextmanager
+def capture_queries() -> Iterator[List[Tuple[str, dict]]]:
+    """Собирает SQL-запросы с параметрами, выполненные внутри блока."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
+@contextmanager
+def assert_num_queries(expected: int) -> Iterator[List[Tuple[str, dict]]]:
+    """Проверяет, что внутри блока выполнено ровно expected SQL-запросов."""
+    with capture_queries() as statements:
+        yield statements
+    assert len(statements) == expected, '\n'.join(statement for statement, _ in statements)
+
+
+@contextmanager
+def capture_commits() -> Iterator[List[bool]]:
+    """Собирает коммиты транзакций, выполненные внутри блока."""
+    commits = []
+
+    def on_commit(conn):
+        commits.append(True)
+
+    event.listen(db.engine, 'commit', on_commit)
+    try:
+        yield commits
+    finally:
+        event.remove(db.engine, 'commit', on_commit)
@@ -1,11 +1,19 @@
 import json
 from datetime import datetime, timedelta
+from time import time
+from unittest import mock
+from uuid import uuid4
 
 import pytest
 
 from app import config
-from app.factories import SessionFactory, UserFactory
-from app.services import HistoryService, ProfileService, SessionService, JWTService
+from app.bcrypt import bcrypt
+from app.factories import RoleFactory, SessionFactory, UserFactory
+from app.services import HistoryService, ProfileService, SessionService, JWTService, UserService
+from app.services.auth import TokenClaimsCache
+from app.services.base import unit_of_work
+from app.services.revocation import revocation_service
+from app.tests.conftest import capture_commits, capture_queries
 
 profile_service = ProfileService()
 session_service = SessionService()
@@ -135,6 +143,33 @@ def test_auth_user(test_app, test_db, auth_headers):
     assert 'refresh_token' in data.keys()
 
 
+def test_auth_user_rehashes_password(test_app, test_db, auth_headers):
+    client = test_app.test_client()
+    user = UserFactory(password='password')
+    user.password = bcrypt.generate_password_hash('password', rounds=5).decode('utf-8')
+    test_db.session.commit()
+    user_auth_data = {
+        'username': user.username,
+        'password': 'password',
+    }
+    rehash, threads = UserService.rehash_password, []
+    with mock.patch.object(UserService, 'rehash_password', autospec=True,
+                           side_effect=lambda *args: threads.append(rehash(*args))):
+        resp = client.post(
+            '/auth/login',
+            content_type='application/json',
+            data=json.dumps(user_auth_data),
+            headers=auth_headers
+        )
+    assert resp.status_code == 200
+
+    [thread] = threads
+    thread.join(timeout=10)
+    test_db.session.refresh(user)
+    assert bcrypt.get_rounds(user.password) == test_app.config['BCRYPT_LOG_ROUNDS']
+    assert user.check_password('password')
+
+
 def test_auth_incorrect_user(test_app, test_db, auth_headers):
     client = test_app.test_client()
     user_auth_data = {
@@ -170,10 +205,26 @@ def test_auth_user_with_incorrect_password(test_app, test_db, auth_headers):
     assert 'Неверный пароль.' in data['message']
 
 
+def test_login_reads_roles_from_cache(test_app, test_db, auth_headers):
+    client = test_app.test_client()
+    user = UserFactory(password='password', roles=[RoleFactory(name='subscriber')])
+    JWTService.encode_token(user=user)
+    with capture_queries() as statements:
+        resp = client.post(
+            '/auth/login',
+            data=json.dumps({'username': user.username, 'password': 'password'}),
+            content_type='application/json',
+            headers=auth_headers
+        )
+    assert resp.status_code == 200
+    assert JWTService.decode_token(json.loads(resp.data.decode())['access_token'])['roles'] == ['subscriber']
+    assert not [statement for statement, _ in statements if 'roles' in statement]
+
+
 def test_update_refresh_token(test_app, test_db, auth_headers):
     client = test_app.test_client()
     user = UserFactory(password='password')
-    session = SessionFactory(
+    session = session_service.create(
         user=user,
         user_agent=auth_headers['User-Agent'],
         fingerprint=auth_headers['Fingerprint'],
@@ -194,22 +245,50 @@ def test_update_refresh_token(test_app, test_db, auth_headers):
     data = json.loads(resp.data.decode())
 
     assert resp.status_code == 201
-    assert session_service.get_by_user(session.user, auth_headers['Fingerprint'], auth_headers['User-Agent']) is not None
+    assert session_service.get_by_user(user, auth_headers['Fingerprint'], auth_headers['User-Agent']) is not None
     assert 'access_token' in data.keys()
     assert 'refresh_token' in data.keys()
 
 
+def test_reused_refresh_token_revokes_family(test_app, test_db, auth_headers):
+    client = test_app.test_client()
+    user = UserFactory(password='password')
+    session = session_service.create(
+        user=user,
+        user_agent=auth_headers['User-Agent'],
+        fingerprint=auth_headers['Fingerprint'],
+        refresh_token=JWTService.encode_token(user=user, expires=config('REFRESH_TOKEN_EXPIRATION', cast=int))
+    )
+
+    def refresh(token):
+        return client.post(
+            '/auth/refresh',
+            data=json.dumps({'refresh_token': token}),
+            content_type='application/json',
+            headers=auth_headers
+        )
+
+    resp = refresh(session.refresh_token)
+    assert resp.status_code == 201
+    rotated = json.loads(resp.data.decode())['refresh_token']
+
+    assert refresh(session.refresh_token).status_code == 400
+    assert refresh(rotated).status_code == 400
+
+
 def test_update_expired_refresh_token(test_app, test_db, auth_headers):
     client = test_app.test_client()
     user = UserFactory(password='password')
-    session = SessionFactory(
+    refresh_token = 'expired_refresh_token'
+    SessionFactory(
         user=user,
         user_agent=auth_headers['User-Agent'],
         fingerprint=auth_headers['Fingerprint'],
+        refresh_token=refresh_token,
     )
 
     user_data = {
-        'refresh_token': session.refresh_token,
+        'refresh_token': refresh_token,
     }
 
     resp = client.post(
@@ -237,3 +316,183 @@ def test_update_non_existent_refresh_token(test_app, test_db, auth_headers):
     )
 
     assert resp.status_code == 400
+
+
+def test_logout(test_app, test_db, user_headers):
+    client = test_app.test_client()
+    resp = client.post('/auth/logout', data=json.dumps({}), content_type='application/json', headers=user_headers)
+    assert resp.status_code == 200
+
+    resp = client.post('/auth/logout', data=json.dumps({}), content_type='application/json', headers=user_headers)
+    data = json.loads(resp.data.decode())
+    assert resp.status_code == 401
+    assert 'Токен отозван.' in data['message']
+
+
+def test_logout_all_devices(test_app, test_db, auth_headers):
+    client = test_app.test_client()
+    user = UserFactory(password='password')
+    other_token = JWTService.encode_token(user=user)
+    session = session_service.create(
+        user=user,
+        user_agent=auth_headers['User-Agent'],
+        fingerprint=auth_headers['Fingerprint'],
+        refresh_token=JWTService.encode_token(user=user, expires=config('REFRESH_TOKEN_EXPIRATION', cast=int))
+    )
+    resp = client.post(
+        '/auth/logout',
+        data=json.dumps({'refresh_token': session.refresh_token, 'all_devices': True}),
+        content_type='application/json',
+        headers={**auth_headers, 'Authorization': JWTService.encode_token(user=user)},
+    )
+    assert resp.status_code == 200
+    assert not JWTService.is_token_valid(session.refresh_token)
+
+    resp = client.post(
+        '/auth/logout',
+        data=json.dumps({}),
+        content_type='application/json',
+        headers={**auth_headers, 'Authorization': other_token},
+    )
+    assert resp.status_code == 401
+
+
+def test_logout_foreign_refresh_token(test_app, test_db, auth_headers):
+    client = test_app.test_client()
+    owner, other = UserFactory(password='password'), UserFactory(password='password')
+    session = session_service.create(
+        user=owner,
+        user_agent=auth_headers['User-Agent'],
+        fingerprint=auth_headers['Fingerprint'],
+        refresh_token=JWTService.encode_token(user=owner, expires=config('REFRESH_TOKEN_EXPIRATION', cast=int))
+    )
+    other_token = JWTService.encode_token(user=other)
+    resp = client.post(
+        '/auth/logout',
+        data=json.dumps({'refresh_token': session.refresh_token}),
+        content_type='application/json',
+        headers={**auth_headers, 'Authorization': other_token},
+    )
+    assert resp.status_code == 403
+    assert JWTService.is_token_valid(session.refresh_token)
+    assert JWTService.is_token_valid(other_token)
+    assert session_service.store.get(session.refresh_token) == session
+
+
+def test_expired_access_token(test_app, auth_headers):
+    client = test_app.test_client()
+    auth_headers['Authorization'] = JWTService.encode_token(expires=-1, user_id='user_id', roles=['admin'])
+    resp = client.get('/permissions/roles', headers=auth_headers)
+    data = json.loads(resp.data.decode())
+    assert resp.status_code == 401
+    assert 'Срок действия токен истек.' == data['message']
+
+
+def test_invalid_access_token(test_app, auth_headers):
+    client = test_app.test_client()
+    auth_headers['Authorization'] = 'abracadabra'
+    resp = client.get('/permissions/roles', headers=auth_headers)
+    assert resp.status_code == 401
+
+
+def test_token_claims_cache():
+    cache = TokenClaimsCache(maxsize=2)
+    exp = time() + 60
+    cache.set('first', {'exp': exp})
+    cache.set('second', {'exp': exp})
+    assert cache.get('first') is not None
+    cache.set('third', {'exp': exp})
+    assert cache.get('second') is None
+    assert cache.get('first') is not None
+    assert cache.get('third') is not None
+
+
+def test_token_claims_cache_respects_exp():
+    cache = TokenClaimsCache(maxsize=2)
+    cache.set('token', {'exp': time() - 1})
+    assert cache.get('token') is None
+
+
+def test_auth_flows_commit_once(test_app, test_db, auth_headers):
+    client = test_app.test_client()
+    user_data = {'username': 'username', 'password': 'password', 'email': 'username@example.com'}
+
+    with capture_commits() as commits:
+        resp = client.post('/auth/register', data=json.dumps(user_data), content_type='application/json',
+                           headers=auth_headers)
+    assert resp.status_code == 201
+    assert len(commits) == 1
+
+    with capture_commits() as commits:
+        resp = client.post('/auth/login', data=json.dumps(user_data), content_type='application/json',
+                           headers=auth_headers)
+    assert resp.status_code == 200
+    assert len(commits) == 1
+
+    refresh_token = json.loads(resp.data.decode())['refresh_token']
+    with capture_commits() as commits:
+        resp = client.post('/auth/refresh', data=json.dumps({'refresh_token': refresh_token}),
+                           content_type='application/json', headers=auth_headers)
+    assert resp.status_code == 201
+    assert len(commits) == 1
+
+
+def test_unit_of_work_rolls_back(test_app, test_db):
+    with pytest.raises(RuntimeError):
+        with unit_of_work():
+            user = UserFactory(password='password')
+            profile_service.create(user=user, email='user@example.com')
+            raise RuntimeError
+    assert profile_service.get_by_email('user@example.com') is None
+
+
+def introspect(client, auth_headers, tokens):
+    return client.post(
+        '/auth/introspect',
+        data=json.dumps({'tokens': tokens}),
+        content_type='application/json',
+        headers=auth_headers,
+    )
+
+
+def test_introspect_tokens(test_app, test_redis, auth_headers):
+    client = test_app.test_client()
+    auth_headers['Authorization'] = JWTService.encode_token(user_id=str(uuid4()), roles=['service'])
+    active = JWTService.encode_token(expires=60, user_id=str(uuid4()), roles=[])
+    revoked = JWTService.encode_token(expires=60, user_id=str(uuid4()), roles=[])
+    revocation_service.revoke(JWTService.decode_token(revoked))
+    expired = JWTService.encode_token(expires=-1, user_id=str(uuid4()), roles=[])
+
+    resp = introspect(client, auth_headers, [active, revoked, expired, 'abracadabra', active])
+    data = json.loads(resp.data.decode())['tokens']
+    assert resp.status_code == 200
+    assert [item['active'] for item in data] == [True, False, False, False, True]
+    assert [item['error'] for item in data] == [None, 'revoked', 'expired', 'invalid', None]
+    assert data[0]['claims']['user_id'] == JWTService.decode_token(active)['user_id']
+    assert data[1]['revoked']
+    assert 55 <= data[0]['expires_in'] <= 60
+    assert resp.headers['Cache-Control'] == f'private, max-age={data[0]["expires_in"]}'
+
+
+def test_introspect_checks_revocation_in_one_round_trip(test_app, test_redis):
+    tokens = [JWTService.encode_token(expires=60, user_id=str(uuid4()), roles=[]) for _ in range(3)]
+    for token in tokens:
+        revocation_service.revoke(JWTService.decode_token(token))
+    with mock.patch.object(test_redis, 'pipeline', wraps=test_redis.pipeline) as pipeline:
+        results = JWTService.introspect(tokens)
+    assert [result['revoked'] for result in results] == [True, True, True]
+    assert pipeline.call_count == 1
+
+
+def test_introspect_requires_service_role(test_app, test_redis, auth_headers):
+    client = test_app.test_client()
+    auth_headers['Authorization'] = JWTService.encode_token(user_id=str(uuid4()), roles=[])
+    resp = introspect(client, auth_headers, ['token'])
+    assert resp.status_code == 403
+
+
+def test_introspect_batch_limit(test_app, test_redis, auth_headers):
+    client = test_app.test_client()
+    auth_headers['Authorization'] = JWTService.encode_token(user_id=str(uuid4()), roles=['service'])
+    resp = introspect(client, auth_headers, ['token'] * (test_app.config['INTROSPECTION_MAX_BATCH'] + 1))
+    assert resp.status_code == 400
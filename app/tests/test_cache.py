@@ -0,0 +1,84 @@
+from threading import Timer
+from unittest import mock
+
+from flask_restx import abort
+from redis.exceptions import ConnectionError
+
+from app.cache import CHANGED, ResponseCache
+from app.db import db
+from app.models import Role, User
+
+
+def make_view(cache, **kwargs):
+    view = mock.Mock(return_value=({'name': 'admin'}, 200))
+    return cache.cached(Role, **kwargs)(view), view
+
+
+def test_cached_response_and_not_modified(test_app, test_redis):
+    cache = ResponseCache(test_app)
+    cached, view = make_view(cache, depends_on=[User])
+    with test_app.test_request_context('/permissions/roles'):
+        first = cached()
+        second = cached()
+    assert view.call_count == 1
+    assert first.get_json() == second.get_json() == {'name': 'admin'}
+    etag, _ = first.get_etag()
+    assert second.get_etag() == (etag, False)
+
+    with test_app.test_request_context('/permissions/roles', headers={'If-None-Match': f'"{etag}"'}):
+        response = cached()
+    assert response.status_code == 304
+    assert view.call_count == 1
+
+
+def test_version_bumped_after_commit(test_app, test_redis):
+    cache = ResponseCache(test_app)
+    cached, view = make_view(cache, entity='role_id')
+    session = mock.Mock(info={})
+    with test_app.test_request_context('/permissions/roles/1'):
+        etag, _ = cached(role_id='1').get_etag()
+
+        with mock.patch.object(db, 'session', session):
+            cache.mark_changed(Role, '1')
+        cache.after_rollback(session)
+        assert cached(role_id='1').get_etag() == (etag, False)
+
+        session.info[CHANGED] = {(Role, '1')}
+        cache.after_commit(session)
+        assert cached(role_id='1').get_etag() != (etag, False)
+    assert view.call_count == 2
+
+
+def test_waits_for_response_built_by_another_request(test_app, test_redis):
+    cache = ResponseCache(test_app)
+    cached, view = make_view(cache)
+    with test_app.test_request_context('/permissions/roles'):
+        etag = cache.get_etag(Role)
+        key = f'{cache.prefix}:response:{etag}'
+        test_redis.set(f'{key}:lock', 1)
+        Timer(0.1, test_redis.set, (key, '{"name": "cached"}')).start()
+        response = cached()
+    assert response.get_json() == {'name': 'cached'}
+    view.assert_not_called()
+
+
+def test_errors_are_not_cached(test_app, test_redis):
+    cache = ResponseCache(test_app)
+    view = mock.Mock(side_effect=lambda: abort(404))
+    cached = cache.cached(Role)(view)
+    with test_app.test_request_context('/permissions/roles'):
+        for _ in range(2):
+            try:
+                cached()
+            except Exception as e:
+                assert e.code == 404
+        assert not test_redis.exists(f'{cache.prefix}:response:{cache.get_etag(Role)}:lock')
+    assert view.call_count == 2
+
+
+def test_works_without_redis(test_app, test_redis):
+    cache = ResponseCache(test_app)
+    cached, view = make_view(cache)
+    with test_app.test_request_context('/permissions/roles'), \
+            mock.patch('app.cache.redis_client.mget', side_effect=ConnectionError):
+        assert cached() == ({'name': 'admin'}, 200)
@@ -0,0 +1,30 @@
+from prometheus_client import REGISTRY
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+
+from app.db import InstrumentedQueuePool
+from app.settings import get_engine_options
+
+
+def test_engine_options(monkeypatch):
+    monkeypatch.setenv('DB_POOL_SIZE', '7')
+    options = get_engine_options()
+    assert options['poolclass'] is InstrumentedQueuePool
+    assert options['pool_size'] == 7
+    assert options['pool_pre_ping']
+
+
+def test_engine_options_pgbouncer(monkeypatch):
+    monkeypatch.setenv('DB_PGBOUNCER', 'True')
+    assert get_engine_options() == {'poolclass': NullPool}
+
+
+def test_pool_metrics(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path.joinpath("db.sqlite")}', poolclass=InstrumentedQueuePool)
+    checkouts = REGISTRY.get_sample_value('db_pool_checkout_seconds_count') or 0
+    in_use = REGISTRY.get_sample_value('db_pool_connections_in_use') or 0
+    with engine.connect() as connection:
+        connection.execute(text('SELECT 1'))
+        assert REGISTRY.get_sample_value('db_pool_connections_in_use') == in_use + 1
+    assert REGISTRY.get_sample_value('db_pool_checkout_seconds_count') == checkouts + 1
+    assert REGISTRY.get_sample_value('db_pool_connections_in_use') == in_use
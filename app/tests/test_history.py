@@ -0,0 +1,178 @@
+import gzip
+from contextlib import contextmanager
+from datetime import date, datetime
+from uuid import uuid4
+
+import pytest
+from sqlalchemy import text
+
+from app.factories import UserFactory
+from app.models import History
+from app.services import HistoryPartitionService, HistoryService
+from app.redis import redis_client
+from app.services.history import HistoryWriter, Partition, add_months
+
+history_service = HistoryService()
+
+
+def is_drained(writer: HistoryWriter) -> bool:
+    return redis_client.xlen(writer.stream) == 0 and not redis_client.xpending(writer.stream, writer.group)['pending']
+
+
+@contextmanager
+def stream_mode(app):
+    app.config['HISTORY_WRITER'] = 'stream'
+    try:
+        yield
+    finally:
+        app.config['HISTORY_WRITER'] = 'sync'
+
+
+@pytest.mark.parametrize(
+    'month, months, expected',
+    [(date(2021, 9, 1), 1, date(2021, 10, 1)),
+     (date(2021, 12, 1), 1, date(2022, 1, 1)),
+     (date(2021, 1, 1), -1, date(2020, 12, 1)),
+     (date(2021, 9, 1), -12, date(2020, 9, 1)),
+     ],
+)
+def test_add_months(month, months, expected):
+    assert add_months(month, months) == expected
+
+
+def test_partition_for_month():
+    partition = Partition.for_month(date(2021, 12, 15))
+    assert partition.name == 'history_2021_12'
+    assert partition.start == date(2021, 12, 1)
+    assert partition.end == date(2022, 1, 1)
+
+
+@pytest.fixture
+def partitioned_history(test_app, test_db):
+    """Таблица history, разбитая на партиции, как после миграции, но пока только с партицией по умолчанию."""
+    test_db.session.execute(text('DROP TABLE history'))
+    test_db.session.execute(text(
+        'CREATE TABLE history ('
+        ' id UUID NOT NULL, created TIMESTAMP WITHOUT TIME ZONE NOT NULL, updated TIMESTAMP WITHOUT TIME ZONE,'
+        ' fingerprint VARCHAR(255) NOT NULL, user_agent VARCHAR(255) NOT NULL, user_id UUID REFERENCES users (id),'
+        ' PRIMARY KEY (id, created)'
+        ') PARTITION BY RANGE (created)'
+    ))
+    test_db.session.execute(text('CREATE TABLE history_default PARTITION OF history DEFAULT'))
+    test_db.session.commit()
+    return HistoryPartitionService()
+
+
+def add_history(*months: date) -> None:
+    History.query.session.execute(History.__table__.insert(), [
+        {'id': uuid4(), 'created': datetime(month.year, month.month, 15), 'fingerprint': 'fingerprint',
+         'user_agent': 'user_agent'}
+        for month in months
+    ])
+    History.query.session.commit()
+
+
+def count(table: str) -> int:
+    return History.query.session.execute(text(f'SELECT count(*) FROM {table}')).scalar()
+
+
+def test_create_partitions_moves_rows_from_default(partitioned_history):
+    current = date.today().replace(day=1)
+    add_history(add_months(current, 1), add_months(current, 1), add_months(current, 12))
+
+    created = partitioned_history.create_partitions(months_ahead=2)
+
+    assert [partition.start for partition in created] == [add_months(current, months) for months in range(3)]
+    assert partitioned_history.get_default_partition() == 'history_default'
+    assert count(Partition.for_month(add_months(current, 1)).name) == 2
+    assert count('history_default') == 1
+    assert count('history') == 3
+    assert partitioned_history.create_partitions(months_ahead=2) == []
+
+
+def test_drop_expired_partition(partitioned_history):
+    current = date.today().replace(day=1)
+    expired = Partition.for_month(add_months(current, -13))
+    partitioned_history.create_partition(expired)
+    partitioned_history.create_partitions(months_ahead=0)
+    add_history(expired.start, current)
+
+    assert partitioned_history.get_expired_partitions(retention_months=12) == [expired]
+    partitioned_history.drop_partition(expired)
+    assert expired not in partitioned_history.get_partitions()
+    assert count('history') == 1
+
+
+def test_prune_default(partitioned_history, tmp_path):
+    current = date.today().replace(day=1)
+    add_history(add_months(current, -13), add_months(current, -14), add_months(current, 12))
+
+    assert partitioned_history.count_expired_default('history_default', retention_months=12) == 2
+    path = partitioned_history.export_expired_default('history_default', 12, tmp_path)
+    with gzip.open(path, 'rt') as file:
+        assert len(file.read().splitlines()) == 3
+    assert partitioned_history.prune_default('history_default', retention_months=12) == 2
+    assert count('history_default') == 1
+
+
+def test_history_writer_enqueues(test_app, test_redis):
+    writer = HistoryWriter()
+    user = UserFactory.build(password='password')
+    with stream_mode(test_app):
+        writer.write(user=user, fingerprint='fingerprint', user_agent='user_agent')
+    [(_, record)] = test_redis.xrange(writer.stream)
+    assert record['user_id'] == str(user.id)
+    assert record['fingerprint'] == 'fingerprint'
+
+
+def test_history_writer_run(test_app, test_db):
+    writer = HistoryWriter()
+    user = UserFactory(password='password')
+    test_db.session.commit()
+    with stream_mode(test_app):
+        for _ in range(3):
+            writer.write(user=user, fingerprint='fingerprint', user_agent='user_agent')
+    should_stop = iter([False, False, True]).__next__
+    written = writer.run('consumer', batch_size=2, flush_interval=0.01, should_stop=should_stop)
+    assert written == 3
+    assert history_service.get_by_user(user).count() == 3
+    assert is_drained(writer)
+
+
+def test_history_writer_claims_unacknowledged(test_app, test_db):
+    writer = HistoryWriter()
+    user = UserFactory(password='password')
+    test_db.session.commit()
+    with stream_mode(test_app):
+        writer.write(user=user, fingerprint='fingerprint', user_agent='user_agent')
+    writer.create_group()
+    assert len(writer.read('crashed', count=10, block_ms=1)) == 1
+
+    assert writer.run('consumer', batch_size=10, flush_interval=0, should_stop=lambda: True) == 1
+    assert history_service.get_by_user(user).count() == 1
+    assert is_drained(writer)
+
+
+def test_history_writer_truncates_fields(test_app, test_redis):
+    writer = HistoryWriter()
+    with stream_mode(test_app):
+        writer.write(user=UserFactory.build(password='password'), fingerprint='fingerprint', user_agent='a' * 1000)
+    [(_, record)] = test_redis.xrange(writer.stream)
+    assert len(record['user_agent']) == History.__table__.c.user_agent.type.length
+
+
+def test_history_writer_dead_letters_failed_rows(test_app, test_db):
+    writer = HistoryWriter()
+    user = UserFactory(password='password')
+    test_db.session.commit()
+    with stream_mode(test_app):
+        writer.write(user=user, fingerprint='fingerprint', user_agent='user_agent')
+        writer.write(user=UserFactory.build(password='password'), fingerprint='fingerprint', user_agent='user_agent')
+
+    should_stop = iter([False, True]).__next__
+    assert writer.run('consumer', batch_size=10, flush_interval=0, should_stop=should_stop) == 1
+    assert history_service.get_by_user(user).count() == 1
+    assert is_drained(writer)
+    [(_, record)] = redis_client.xrange(writer.dead_stream)
+    assert record['user_id'] != str(user.id)
+    assert 'ForeignKeyViolation' in record['error']
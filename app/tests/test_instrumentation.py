@@ -0,0 +1,56 @@
+import logging
+
+from flask import g
+from sqlalchemy import create_engine, text
+
+from app.instrumentation import QueryStats, normalize_sql, query_instrumentation
+
+
+def test_normalize_sql():
+    statement = """SELECT users.id FROM users
+        WHERE users.username = %(username_1)s AND users.id IN (%(id_1)s, %(id_2)s) AND age > 18 AND name = 'o''k'
+        LIMIT %(param_1)s"""
+    assert normalize_sql(statement) == (
+        'SELECT users.id FROM users WHERE users.username = ? AND users.id IN (...) AND age > ? AND name = ? LIMIT ?'
+    )
+
+
+def test_query_stats_keeps_slowest():
+    stats = QueryStats(keep=2)
+    for duration, statement in ((0.1, 'SELECT 1'), (0.3, 'SELECT 3'), (0.2, 'SELECT 2')):
+        stats.add(statement, duration)
+    assert stats.count == 3
+    assert round(stats.duration, 3) == 0.6
+    assert stats.slowest == [(0.3, 'SELECT ?'), (0.2, 'SELECT ?')]
+
+
+def test_debug_headers(test_app):
+    test_app.debug = True
+    try:
+        resp = test_app.test_client().get('/ping')
+    finally:
+        test_app.debug = False
+    assert resp.headers['X-DB-Query-Count'] == '0'
+    assert 'X-DB-Time-Ms' in resp.headers
+
+
+def test_no_debug_headers(test_app):
+    resp = test_app.test_client().get('/ping')
+    assert 'X-DB-Query-Count' not in resp.headers
+
+
+def test_request_stats_and_slow_query_log(test_app, caplog):
+    engine = create_engine('sqlite://')
+    slow_query_ms = query_instrumentation.slow_query_ms
+    query_instrumentation.slow_query_ms = 0
+    try:
+        with test_app.test_request_context('/ping'), caplog.at_level(logging.WARNING, 'app.instrumentation'):
+            query_instrumentation.before_request()
+            with engine.connect() as connection:
+                connection.execute(text('SELECT 1'))
+                connection.execute(text('SELECT 2'))
+            assert g.query_stats.count == 2
+    finally:
+        query_instrumentation.slow_query_ms = slow_query_ms
+    assert 'Медленный SQL-запрос' in caplog.text
+    assert 'SELECT ?' in caplog.text
@@ -0,0 +1,117 @@
+import json
+
+from uuid import uuid4
+
+import jwt
+import pytest
+
+from app.factories import UserFactory
+from app.keys import KeyRing, key_ring
+from app.services import JWTService
+from app.services.sessions import DatabaseSessionStore, SessionData
+
+
+@pytest.fixture
+def keys_dir(test_app, tmp_path):
+    runner = test_app.test_cli_runner()
+    for kid, algorithm in (('old', 'RS256'), ('new', 'EdDSA')):
+        result = runner.invoke(args=['keys', 'generate', kid, '--algorithm', algorithm, '--directory', str(tmp_path)])
+        assert result.exit_code == 0, result.output
+    yield tmp_path
+    key_ring.init_app(test_app)
+
+
+def make_key_ring(test_app, keys_dir, kid) -> KeyRing:
+    test_app.config.update(JWT_KEYS_DIR=str(keys_dir), JWT_SIGNING_KEY_ID=kid)
+    try:
+        return KeyRing(test_app)
+    finally:
+        test_app.config.update(JWT_KEYS_DIR='', JWT_SIGNING_KEY_ID='')
+
+
+def test_sign_with_kid(test_app, keys_dir):
+    ring = make_key_ring(test_app, keys_dir, 'old')
+    token = ring.encode({'user_id': 'user'})
+    assert jwt.get_unverified_header(token) == {'alg': 'RS256', 'kid': 'old', 'typ': 'JWT'}
+    assert ring.decode(token) == {'user_id': 'user'}
+
+
+def test_rotation_keeps_old_tokens_valid(test_app, keys_dir):
+    token = make_key_ring(test_app, keys_dir, 'old').encode({'user_id': 'user'})
+    ring = make_key_ring(test_app, keys_dir, 'new')
+    assert jwt.get_unverified_header(ring.encode({}))['alg'] == 'EdDSA'
+    assert ring.decode(token) == {'user_id': 'user'}
+
+
+def test_unknown_kid(test_app, keys_dir):
+    ring = make_key_ring(test_app, keys_dir, 'old')
+    token = jwt.encode({'user_id': 'user'}, 'secret', algorithm='HS256', headers={'kid': 'other'})
+    with pytest.raises(jwt.InvalidTokenError):
+        ring.decode(token)
+
+
+def test_missing_signing_key(test_app, keys_dir):
+    with pytest.raises(RuntimeError):
+        make_key_ring(test_app, keys_dir, 'absent')
+
+
+def test_jwks(test_app, keys_dir):
+    test_app.config.update(JWT_KEYS_DIR=str(keys_dir), JWT_SIGNING_KEY_ID='new')
+    key_ring.init_app(test_app)
+    test_app.config.update(JWT_KEYS_DIR='', JWT_SIGNING_KEY_ID='')
+    token = JWTService.encode_token(user_id='user')
+
+    resp = test_app.test_client().get('/.well-known/jwks.json')
+    data = json.loads(resp.data.decode())
+    assert resp.status_code == 200
+    assert 'max-age' in resp.headers['Cache-Control']
+    assert sorted(key['kid'] for key in data['keys']) == ['new', 'old']
+    assert all('d' not in key for key in data['keys'])
+
+    jwk = next(key for key in data['keys'] if key['kid'] == jwt.get_unverified_header(token)['kid'])
+    public_key = jwt.PyJWK(jwk).key
+    assert jwt.decode(token, public_key, algorithms=[jwk['alg']])['user_id'] == 'user'
+
+
+def test_database_store_keeps_rs256_refresh_token(test_app, test_db, keys_dir):
+    test_app.config.update(JWT_KEYS_DIR=str(keys_dir), JWT_SIGNING_KEY_ID='old')
+    key_ring.init_app(test_app)
+    test_app.config.update(JWT_KEYS_DIR='', JWT_SIGNING_KEY_ID='')
+    user = UserFactory(password='password')
+    test_db.session.commit()
+    tokens = [JWTService.encode_token(user=user, expires=60) for _ in range(2)]
+    assert all(len(token) > 255 for token in tokens)
+
+    store = DatabaseSessionStore()
+    session, rotated = (
+        SessionData(refresh_token=token, user_id=str(user.id), fingerprint='fingerprint',
+                    user_agent='user_agent', family=str(uuid4()))
+        for token in tokens
+    )
+    store.save(session, expires=60)
+    assert store.get(tokens[0]) == session
+    assert store.rotate(session, rotated._replace(family=session.family), expires=60)
+    assert store.get(tokens[0]) is None
+    assert store.get(tokens[1]).refresh_token == tokens[1]
+
+
+def test_introspect_full_batch_of_rs256_tokens(test_app, test_redis, keys_dir):
+    test_app.config.update(JWT_KEYS_DIR=str(keys_dir), JWT_SIGNING_KEY_ID='old')
+    key_ring.init_app(test_app)
+    test_app.config.update(JWT_KEYS_DIR='', JWT_SIGNING_KEY_ID='')
+    roles = ['admin', 'subscriber', 'moderator']
+    tokens = [
+        JWTService.encode_token(expires=60, user_id=str(uuid4()), roles=roles)
+        for _ in range(test_app.config['INTROSPECTION_MAX_BATCH'])
+    ]
+    data = json.dumps({'tokens': tokens})
+    assert len(data) > test_app.config['MAX_PAYLOAD_SIZE']
+
+    resp = test_app.test_client().post(
+        '/auth/introspect',
+        data=data,
+        content_type='application/json',
+        headers={'Authorization': JWTService.encode_token(user_id=str(uuid4()), roles=['service'])},
+    )
+    assert resp.status_code == 200
+    assert all(item['active'] for item in json.loads(resp.data.decode())['tokens'])
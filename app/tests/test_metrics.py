@@ -0,0 +1,21 @@
+from app.metrics import split_endpoint
+
+
+def test_split_endpoint():
+    assert split_endpoint('auth_refresh') == ('auth', 'refresh')
+    assert split_endpoint('users_user_list') == ('users', 'user_list')
+    assert split_endpoint('metrics') == ('metrics', '')
+
+
+def test_metrics_endpoint(test_app):
+    client = test_app.test_client()
+    assert client.get('/ping').status_code == 200
+    resp = client.get('/metrics')
+    body = resp.data.decode()
+    assert resp.status_code == 200
+    assert resp.content_type.startswith('text/plain')
+    assert 'http_request_duration_seconds_count{method="GET",namespace="ping",resource="ping",status="200"}' in body
+    assert 'password_hashing_seconds' in body
+    assert 'jwt_operation_seconds' in body
+    assert 'db_pool_checkout_seconds' in body
+    assert 'auth_logins_total' in body
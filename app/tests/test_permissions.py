@@ -1,9 +1,14 @@
 import json
+from unittest import mock
 from uuid import uuid4
 
 import pytest
 
 from app.factories import RoleFactory, UserFactory
+from app.services import JWTService, RoleService
+from app.services.base import unit_of_work
+from app.services.permissions import role_claims_cache
+from app.tests.conftest import assert_num_queries, capture_queries
 
 
 def test_create_role(test_app, test_db, user_admin_headers):
@@ -138,6 +143,58 @@ def test_patch_role_add_and_remove_users(test_app, test_db, user_admin_headers):
     assert resp.status_code == 201
 
 
+def test_patch_role_users_invalidates_role_claims(test_app, test_db, user_admin_headers):
+    role = RoleFactory()
+    user = UserFactory(password='password')
+    assert JWTService.decode_token(JWTService.encode_token(user=user))['roles'] == []
+    client = test_app.test_client()
+    resp = client.patch(
+        f'/permissions/roles/{role.id}/users',
+        data=json.dumps({'added_users': [user.username]}),
+        content_type='application/json',
+        headers=user_admin_headers)
+    assert resp.status_code == 201
+    assert JWTService.decode_token(JWTService.encode_token(user=user))['roles'] == [role.name]
+
+
+def test_patch_role_name_invalidates_role_claims(test_app, test_db, user_admin_headers):
+    user = UserFactory(password='password')
+    role = RoleFactory(users=[user])
+    JWTService.encode_token(user=user)
+    client = test_app.test_client()
+    resp = client.patch(
+        f'/permissions/roles/{role.id}',
+        data=json.dumps({'name': 'renamed'}),
+        content_type='application/json',
+        headers=user_admin_headers)
+    assert resp.status_code == 200
+    assert JWTService.decode_token(JWTService.encode_token(user=user))['roles'] == ['renamed']
+
+
+def test_role_claims_invalidated_after_commit(test_app, test_db):
+    user = UserFactory(username='member', password='password')
+    role = RoleFactory(name='subscriber', users=[user])
+    role_claims_cache.get(user)
+    with unit_of_work():
+        RoleService().update(role, commit=False, name='renamed')
+        assert role_claims_cache.get(user) == ['subscriber']
+    assert role_claims_cache.get(user) == ['renamed']
+
+
+def test_role_claims_kept_after_rollback(test_app, test_db):
+    user = UserFactory(username='member', password='password')
+    role = RoleFactory(name='subscriber', users=[user])
+    test_db.session.commit()
+    role_claims_cache.get(user)
+    with pytest.raises(RuntimeError), unit_of_work():
+        RoleService().update(role, commit=False, name='renamed')
+        raise RuntimeError
+    with mock.patch.object(role_claims_cache, 'invalidate') as invalidate:
+        test_db.session.commit()
+    invalidate.assert_not_called()
+    assert role_claims_cache.get(user) == ['subscriber']
+
+
 @pytest.mark.parametrize('count', [1, 10, 0])
 def test_get_list_roles(test_app, test_db, count, user_admin_headers):
     RoleFactory.create_batch(count)
@@ -146,3 +203,70 @@ def test_get_list_roles(test_app, test_db, count, user_admin_headers):
     data = json.loads(resp.data.decode())
     assert resp.status_code == 200
     assert count + 1== len(data)   # + 1    - Добавляем роль из фикстурного admin пользователя
+
+
+@pytest.mark.parametrize('count', [1, 10])
+def test_get_list_roles_query_count(test_app, test_db, count, user_admin_headers):
+    RoleFactory.create_batch(count, users=UserFactory.create_batch(3, password='password'))
+    test_db.session.commit()
+    client = test_app.test_client()
+    with assert_num_queries(2):
+        resp = client.get('permissions/roles', content_type='application/json', headers=user_admin_headers)
+    assert resp.status_code == 200
+
+
+def test_get_role_query_count(test_app, test_db, user_admin_headers):
+    role_id = RoleFactory(users=UserFactory.create_batch(5, password='password')).id
+    test_db.session.commit()
+    client = test_app.test_client()
+    with assert_num_queries(2):
+        resp = client.get(f'/permissions/roles/{role_id}', content_type='application/json',
+                          headers=user_admin_headers)
+    assert resp.status_code == 200
+
+
+def test_patch_role_users_query_count_does_not_depend_on_users(test_app, test_db, user_admin_headers):
+    client = test_app.test_client()
+    counts = []
+    for size in (2, 20):
+        role_users = UserFactory.create_batch(size, password='password')
+        role_id = RoleFactory(users=role_users).id
+        new_users = UserFactory.create_batch(size, password='password')
+        data = {
+            'added_users': [user.username for user in new_users],
+            'deleted_users': [user.username for user in role_users[:size // 2]],
+        }
+        test_db.session.commit()
+        with capture_queries() as statements:
+            resp = client.patch(
+                f'/permissions/roles/{role_id}/users',
+                data=json.dumps(data),
+                content_type='application/json',
+                headers=user_admin_headers)
+        assert resp.status_code == 201
+        counts.append(len(statements))
+    assert counts[0] == counts[1]
+
+
+def test_get_roles_not_modified(test_app, test_db, user_admin_headers):
+    client = test_app.test_client()
+    role = RoleFactory(name='subscriber')
+    role_id = str(role.id)
+    test_db.session.commit()
+    resp = client.get('/permissions/roles', headers=user_admin_headers)
+    etag = resp.headers['ETag']
+
+    with assert_num_queries(0):
+        resp = client.get('/permissions/roles', headers={**user_admin_headers, 'If-None-Match': etag})
+    assert resp.status_code == 304
+
+    client.patch(
+        f'/permissions/roles/{role_id}',
+        data=json.dumps({'name': 'reader'}),
+        content_type='application/json',
+        headers=user_admin_headers,
+    )
+    resp = client.get('/permissions/roles', headers={**user_admin_headers, 'If-None-Match': etag})
+    assert resp.status_code == 200
+    assert resp.headers['ETag'] != etag
+    assert 'reader' in {role['name'] for role in json.loads(resp.data.decode())}
@@ -0,0 +1,72 @@
+from typing import NamedTuple
+
+import pytest
+
+from app import db
+from app.factories import HistoryFactory, ProfileFactory, RoleFactory, SessionFactory, UserFactory
+from app.models import Profile, Role, Session, User
+from app.services import HistoryService, ProfileService, RoleService, SessionService, UserService
+from app.services.sessions import DatabaseSessionStore
+from app.tests.conftest import capture_queries
+
+history_service = HistoryService()
+profile_service = ProfileService()
+role_service = RoleService()
+session_service = SessionService()
+user_service = UserService()
+
+
+class Dataset(NamedTuple):
+    user: User
+    profile: Profile
+    role: Role
+    session: Session
+    refresh_token: str
+
+
+@pytest.fixture
+def dataset(test_db):
+    roles = [RoleFactory(name=f'role_{i}') for i in range(5)]
+    profiles = ProfileFactory.create_batch(50, user__password='password', user__roles=roles[:2])
+    users = [profile.user for profile in profiles]
+    sessions = [SessionFactory(user=user, refresh_token=f'refresh_token_{i}') for i, user in enumerate(users)]
+    for user in users:
+        HistoryFactory.create_batch(3, user=user)
+    db.session.commit()
+    return Dataset(user=users[0], profile=profiles[0], role=roles[0], session=sessions[0],
+                   refresh_token='refresh_token_0')
+
+
+def explain(statement: str, parameters: dict) -> str:
+    """План запроса при запрещённом seq scan: Seq Scan в нём останется, только если нет подходящего индекса."""
+    with db.engine.begin() as connection:
+        connection.exec_driver_sql('SET LOCAL enable_seqscan = off')
+        rows = connection.exec_driver_sql(f'EXPLAIN {statement}', parameters)
+        return '\n'.join(row[0] for row in rows)
+
+
+queries = {
+    'SessionService.get_by_user': lambda data: session_service.get_by_user(
+        data.user, data.session.fingerprint, data.session.user_agent),
+    'DatabaseSessionStore.get': lambda data: DatabaseSessionStore().get(data.refresh_token),
+    'HistoryService.get_by_user': lambda data: history_service.get_by_user(data.user).all(),
+    'HistoryService.get_page': lambda data: history_service.get_page(
+        history_service.get_by_user(data.user), limit=2, descending=True),
+    'ProfileService.get_by_email': lambda data: profile_service.get_by_email(data.profile.email),
+    'UserService.get_user_by_username': lambda data: user_service.get_user_by_username(data.user.username),
+    'UserService.get_page': lambda data: user_service.get_page(limit=2),
+    'RoleService.get_role_by_name': lambda data: role_service.get_role_by_name(data.role.name),
+    'User.roles': lambda data: data.user.roles,
+    'Role.users': lambda data: data.role.users,
+}
+
+
+@pytest.mark.parametrize('query', queries.values(), ids=queries.keys())
+def test_query_uses_index(test_app, dataset, query):
+    db.session.expire_all()
+    with capture_queries() as statements:
+        query(dataset)
+    assert statements
+    for statement, parameters in statements:
+        plan = explain(statement, parameters)
+        assert 'Seq Scan' not in plan, f'{statement}\n{plan}'
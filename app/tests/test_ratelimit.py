@@ -0,0 +1,115 @@
+import json
+from unittest import mock
+
+import pytest
+from flask import request
+from redis.exceptions import ConnectionError
+
+from app import create_app
+from app.bcrypt import bcrypt
+from app.cache import response_cache
+from app.keys import key_ring
+from app.ratelimit import Limit, TooManyAttempts, limiter, parse_limits
+from app.redis import redis_client
+
+
+@pytest.fixture
+def strict_limits(test_app, test_redis):
+    limits = test_app.config['RATE_LIMITS']
+    test_app.config['RATE_LIMITS'] = {'login': 'username:2/60', 'register': 'ip:100/60', 'refresh': 'ip:100/60'}
+    test_app.config['RATE_LIMIT_LOCKOUT'] = 10
+    test_app.config['RATE_LIMIT_MAX_LOCKOUT'] = 30
+    limiter.init_app(test_app)
+    yield limiter
+    test_app.config['RATE_LIMITS'] = limits
+    limiter.init_app(test_app)
+    limiter.memory.__init__()
+
+
+def login(client, auth_headers, username='unknown'):
+    return client.post(
+        '/auth/login',
+        data=json.dumps({'username': username, 'password': 'password'}),
+        headers=auth_headers,
+        content_type='application/json',
+    )
+
+
+def test_parse_limits():
+    assert parse_limits('ip:20/60, username:5/300,') == [
+        Limit(scope='ip', count=20, window=60),
+        Limit(scope='username', count=5, window=300),
+    ]
+
+
+def test_rejected_before_user_lookup(test_app, strict_limits, auth_headers):
+    client = test_app.test_client()
+    with test_app.test_request_context(json={'username': 'Unknown'}):
+        strict_limits.hit('login')
+        strict_limits.hit('login')
+    with mock.patch('app.services.auth.user_service.get_user_by_username') as get_user:
+        response = login(client, auth_headers)
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '10'
+    get_user.assert_not_called()
+
+
+def test_escalating_lockout(test_app, test_redis, strict_limits):
+    with test_app.test_request_context(json={'username': 'user'}):
+        strict_limits.hit('login')
+        strict_limits.hit('login')
+        with pytest.raises(TooManyAttempts) as first:
+            strict_limits.hit('login')
+        assert first.value.retry_after == 10
+
+        lock = strict_limits.get_keys('login', strict_limits.limits['login'][0], 'user', 0).lock
+        test_redis.delete(lock)
+        with pytest.raises(TooManyAttempts) as second:
+            strict_limits.hit('login')
+        assert second.value.retry_after == 20
+
+        test_redis.delete(lock)
+        with pytest.raises(TooManyAttempts):
+            strict_limits.hit('login')
+        test_redis.delete(lock)
+        with pytest.raises(TooManyAttempts) as capped:
+            strict_limits.hit('login')
+        assert capped.value.retry_after == 30
+
+
+def test_reset_after_success(test_app, strict_limits):
+    with test_app.test_request_context(json={'username': 'user'}):
+        strict_limits.hit('login')
+        strict_limits.hit('login')
+        strict_limits.reset('login')
+        strict_limits.hit('login')
+        strict_limits.hit('login')
+
+
+def test_memory_fallback(test_app, strict_limits):
+    with test_app.test_request_context(json={'username': 'user'}), \
+            mock.patch('app.ratelimit.redis_client.pipeline', side_effect=ConnectionError):
+        strict_limits.hit('login')
+        strict_limits.hit('login')
+        with pytest.raises(TooManyAttempts) as rejected:
+            strict_limits.hit('login')
+        assert rejected.value.retry_after == 10
+        with pytest.raises(TooManyAttempts):
+            strict_limits.hit('login')
+
+
+def test_production_keys_on_forwarded_address(test_app, auth_headers, monkeypatch):
+    monkeypatch.setenv('APP_SETTINGS', 'app.settings.ProductionConfig')
+    production_app = create_app()
+    for extension in (bcrypt, key_ring, redis_client, response_cache, limiter):
+        extension.init_app(test_app)
+    addresses = []
+
+    def hit(name):
+        addresses.append(request.remote_addr)
+        raise TooManyAttempts(retry_after=1)
+
+    with mock.patch.object(limiter, 'hit', side_effect=hit):
+        response = login(production_app.test_client(), {**auth_headers, 'X-Forwarded-For': '203.0.113.7'})
+    assert response.status_code == 429
+    assert addresses == ['203.0.113.7']
@@ -0,0 +1,55 @@
+from time import time
+from uuid import uuid4
+
+from app.bloom import BloomFilter
+from app.services.revocation import TokenRevocationService
+
+
+def make_claims(**kwargs) -> dict:
+    return {'user_id': str(uuid4()), 'jti': uuid4().hex, 'iat': int(time()) - 10, 'exp': int(time()) + 60, **kwargs}
+
+
+def test_bloom_filter_has_no_false_negatives():
+    items = [uuid4().hex for _ in range(1000)]
+    bloom = BloomFilter.from_items(items, capacity=1000, error_rate=0.01)
+    assert all(item in bloom for item in items)
+    false_positives = sum(uuid4().hex in bloom for _ in range(10000))
+    assert false_positives < 300
+
+
+def test_revoke_token(test_app, test_redis):
+    service = TokenRevocationService()
+    claims = make_claims()
+    service.revoke(claims)
+    assert service.is_revoked(claims)
+    assert not service.is_revoked(make_claims())
+    assert 0 < test_redis.ttl(service.jti_key(claims['jti'])) <= 61
+
+
+def test_revoke_expired_token(test_app, test_redis):
+    service = TokenRevocationService()
+    claims = make_claims(exp=int(time()) - 1)
+    service.revoke(claims)
+    assert not test_redis.exists(service.jti_key(claims['jti']))
+
+
+def test_revoke_user(test_app, test_redis):
+    service = TokenRevocationService()
+    claims = make_claims()
+    service.revoke_user(claims['user_id'])
+    assert service.is_revoked(claims)
+    assert service.is_revoked(make_claims(user_id=claims['user_id'], jti=uuid4().hex))
+    assert not service.is_revoked(make_claims(user_id=claims['user_id'], iat=int(time()) + 1))
+    assert not service.is_revoked(make_claims())
+
+
+def test_sync_picks_up_other_worker_revocations(test_app, test_redis):
+    worker, other_worker = TokenRevocationService(), TokenRevocationService()
+    worker.sync(force=True)
+    token, user_claims = make_claims(), make_claims()
+    other_worker.revoke(token)
+    other_worker.revoke_user(user_claims['user_id'])
+    assert not worker.is_revoked(token)
+    worker.sync(force=True)
+    assert worker.is_revoked(token)
+    assert worker.is_revoked(user_claims)
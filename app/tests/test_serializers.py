@@ -0,0 +1,78 @@
+from collections import namedtuple
+from datetime import date, datetime
+from types import SimpleNamespace
+from uuid import uuid4
+
+from flask_restx import Model, fields, marshal
+
+from app.api.serializers import compile_model, model_columns, serialize
+from app.api.v1.auth import introspection
+from app.api.v1.permissions import role
+from app.api.v1.users import history, user
+from app.models import History, Role, User
+
+UserRow = namedtuple('UserRow', ['id', 'username', 'created', 'updated', 'active', 'is_super'])
+
+
+def make_user(**kwargs):
+    return SimpleNamespace(**{
+        'id': uuid4(), 'username': 'user', 'created': datetime(2021, 9, 1, 12, 30, 15, 123),
+        'updated': None, 'active': True, 'is_super': False, **kwargs,
+    })
+
+
+def test_serializer_matches_marshal():
+    users = [make_user(), make_user(updated=datetime(2021, 10, 1), active=None), make_user(username=42)]
+    roles = [
+        SimpleNamespace(id=uuid4(), name='admin', users=users, created=datetime(2021, 9, 1), updated=None),
+        SimpleNamespace(id=uuid4(), name='empty', users=[], created=datetime(2021, 9, 1), updated=None),
+        {'id': str(uuid4()), 'name': 'dict', 'users': users[:1], 'created': date(2021, 9, 1)},
+    ]
+    assert serialize(roles, role) == marshal(roles, role)
+    assert serialize(roles[0], role) == marshal(roles[0], role)
+    assert serialize(None, user) == marshal(None, user)
+
+
+def test_serializer_accepts_rows():
+    users = [make_user(), make_user(is_super=True)]
+    assert serialize([UserRow(**vars(item)) for item in users], user) == marshal(users, user)
+
+
+def test_serializer_matches_marshal_for_raw_and_nested_fields():
+    claims = {'user_id': 'user_id', 'roles': ['admin'], 'exp': 1}
+    data = {'tokens': [
+        {'active': True, 'revoked': False, 'claims': claims, 'expires_in': 10, 'error': None},
+        {'active': False, 'revoked': False, 'claims': None, 'expires_in': 0, 'error': 'expired'},
+    ]}
+    assert serialize(data, introspection) == marshal(data, introspection)
+
+
+def test_serializer_falls_back_to_restx_fields():
+    model = Model('Fallback', {
+        'name': fields.String(attribute='profile.name'),
+        'url': fields.FormattedString('/users/{id}'),
+        'count': fields.Integer(default=0),
+        'date': fields.DateTime(dt_format='rfc822'),
+    })
+    obj = {'id': 1, 'profile': {'name': 'name'}, 'count': None, 'date': datetime(2021, 9, 1)}
+    assert compile_model(model)(obj) == marshal(obj, model)
+
+
+def test_model_columns():
+    assert [column.key for column in model_columns(User, user)] == [
+        'id', 'username', 'created', 'updated', 'active', 'is_super',
+    ]
+    assert [column.key for column in model_columns(History, history)] == [
+        'fingerprint', 'user_agent', 'created', 'id',
+    ]
+    assert model_columns(Role, role) is None
+    assert [column.key for column in model_columns(Role, role, exclude=('users',))] == [
+        'id', 'name', 'created', 'updated',
+    ]
+
+
+def test_orjson_representation(test_app):
+    client = test_app.test_client()
+    resp = client.get('/ping')
+    assert resp.content_type == 'application/json'
+    assert resp.data.endswith(b'\n')
@@ -0,0 +1,153 @@
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from app.factories import SessionFactory, UserFactory
+from app.models import Session
+from app.services import SessionService
+from app.services.sessions import DatabaseSessionStore, RedisSessionStore, SessionData
+
+session_service = SessionService()
+
+
+def make_session(**kwargs) -> SessionData:
+    data = {
+        'refresh_token': 'refresh_token',
+        'user_id': str(uuid4()),
+        'fingerprint': 'fingerprint',
+        'user_agent': 'user_agent',
+        'family': str(uuid4()),
+        **kwargs,
+    }
+    return SessionData(**data)
+
+
+def test_redis_store_save_and_get(test_app, test_redis):
+    store = RedisSessionStore()
+    session = make_session()
+    store.save(session, expires=60)
+    assert store.get(session.refresh_token) == session
+    assert 0 < test_redis.ttl(store.key(session.refresh_token)) <= 60
+
+
+def test_redis_store_delete(test_app, test_redis):
+    store = RedisSessionStore()
+    session = make_session()
+    store.save(session, expires=60)
+    store.delete(session.refresh_token)
+    assert store.get(session.refresh_token) is None
+
+
+def test_redis_store_get_non_existent(test_app, test_redis):
+    assert RedisSessionStore().get('abracadabra') is None
+
+
+def test_get_by_refresh_token(test_app, test_redis):
+    session = make_session()
+    RedisSessionStore().save(session, expires=60)
+    assert session_service.get_by_refresh_token(
+        refresh_token=session.refresh_token,
+        fingerprint=session.fingerprint,
+        user_agent=session.user_agent,
+    ) == session
+
+
+def test_get_by_refresh_token_with_other_fingerprint(test_app, test_redis):
+    session = make_session()
+    RedisSessionStore().save(session, expires=60)
+    assert session_service.get_by_refresh_token(
+        refresh_token=session.refresh_token,
+        fingerprint='other_fingerprint',
+        user_agent=session.user_agent,
+    ) is None
+
+
+def test_redis_store_rotate(test_app, test_redis):
+    store = RedisSessionStore()
+    previous = make_session()
+    session = previous._replace(refresh_token='rotated_token')
+    store.save(previous, expires=60)
+    assert store.rotate(previous, session, expires=60)
+    assert store.get(previous.refresh_token) is None
+    assert store.get(session.refresh_token) == session
+    assert store.get_rotated(previous.refresh_token) == previous
+
+
+def test_redis_store_rotate_twice(test_app, test_redis):
+    store = RedisSessionStore()
+    previous = make_session()
+    store.save(previous, expires=60)
+    assert store.rotate(previous, previous._replace(refresh_token='first'), expires=60)
+    assert not store.rotate(previous, previous._replace(refresh_token='second'), expires=60)
+    assert store.get('second') is None
+
+
+def test_redis_store_revoke_family(test_app, test_redis):
+    store = RedisSessionStore()
+    previous = make_session()
+    session = previous._replace(refresh_token='rotated_token')
+    other = make_session(refresh_token='other_token', user_id=previous.user_id)
+    store.save(previous, expires=60)
+    store.save(other, expires=60)
+    store.rotate(previous, session, expires=60)
+    store.revoke_family(store.get_rotated(previous.refresh_token))
+    assert store.get(session.refresh_token) is None
+    assert store.get(other.refresh_token) == other
+    assert test_redis.zcard(store.device_key(other)) == 1
+
+
+def test_redis_store_limits_sessions_per_device(test_app, test_redis):
+    store = RedisSessionStore()
+    user_id = str(uuid4())
+    sessions = [make_session(refresh_token=f'token_{i}', user_id=user_id) for i in range(5)]
+    for session in sessions:
+        store.save(session, expires=60, limit=3)
+    assert [store.get(session.refresh_token) for session in sessions[:2]] == [None, None]
+    assert all(store.get(session.refresh_token) for session in sessions[2:])
+    assert test_redis.zcard(store.device_key(sessions[0])) == 3
+
+
+def test_redis_store_eviction_cleans_family(test_app, test_redis):
+    store = RedisSessionStore()
+    user_id = str(uuid4())
+    sessions = [make_session(refresh_token=f'token_{i}', user_id=user_id) for i in range(3)]
+    for session in sessions:
+        store.save(session, expires=60, limit=2)
+    assert not test_redis.exists(store.family_key(sessions[0].family))
+    assert test_redis.smembers(store.family_key(sessions[1].family)) == {store.key(sessions[1].refresh_token)}
+
+
+def test_audit_store_keeps_sessions(test_app, test_db):
+    user = UserFactory(password='password')
+    fingerprint = SessionFactory(user=user, expired=datetime.utcnow() - timedelta(seconds=1)).fingerprint
+    test_db.session.commit()
+    store = DatabaseSessionStore(audit=True)
+    for i in range(3):
+        store.save(make_session(refresh_token=f'token_{i}', user_id=str(user.id), fingerprint=fingerprint),
+                   expires=60, limit=1)
+    assert store.purge_expired() == 0
+    assert Session.query.filter_by(user_id=user.id).count() == 4
+
+    assert DatabaseSessionStore().purge_expired() == 1
+    DatabaseSessionStore().save(make_session(user_id=str(user.id), fingerprint=fingerprint),
+                                expires=60, limit=1)
+    assert Session.query.filter_by(user_id=user.id).count() == 1
+
+
+def test_audit_store_keeps_revoked_and_rotated_sessions(test_app, test_db):
+    user = UserFactory(password='password')
+    test_db.session.commit()
+    store = DatabaseSessionStore(audit=True)
+    first = make_session(refresh_token='first', user_id=str(user.id))
+    second = first._replace(refresh_token='second')
+    store.save(first, expires=60)
+    assert store.rotate(first, second, expires=60)
+    assert not store.rotate(first, second._replace(refresh_token='third'), expires=60)
+    assert store.get('first') is None
+    assert store.get('second') == second
+
+    store.save(make_session(refresh_token='other', user_id=str(user.id)), expires=60)
+    store.delete('other')
+    store.revoke_family(second)
+    assert store.get('second') is None
+    assert store.get('other') is None
+    assert Session.query.filter_by(user_id=user.id).count() == 3
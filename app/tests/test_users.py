@@ -1,10 +1,18 @@
 import json
+from threading import Event, Thread
+from time import sleep
+from unittest import mock
 from uuid import uuid4
 
 import pytest
+from redis.exceptions import ConnectionError
 
+from app.bcrypt import HashingExecutor, HashingPoolSaturated, bcrypt
+from app.bloom import BloomFilter
 from app.factories import HistoryFactory, UserFactory
-from app.tests.conftest import get_user_id_from_token
+from app.services import UserImportService, UserService
+from app.services.users import UsernameFilter, username_filter as users_filter
+from app.tests.conftest import assert_num_queries, get_user_id_from_token
 
 
 def test_create_user(test_app, test_db):
@@ -71,6 +79,36 @@ def test_random_password(test_app, test_db):
     assert first_user.password != second_user.password
 
 
+def test_password_needs_rehash(test_app):
+    rounds = test_app.config['BCRYPT_LOG_ROUNDS']
+    assert not bcrypt.needs_rehash(bcrypt.generate_password_hash('password').decode('utf-8'))
+    assert bcrypt.needs_rehash(bcrypt.generate_password_hash('password', rounds=rounds + 1).decode('utf-8'))
+
+
+def test_hashing_pool_saturated(test_app):
+    executor = HashingExecutor()
+    executor.size, executor.max_queue, executor.retry_after = 1, 0, 3
+    event = Event()
+    thread = Thread(target=executor.run, args=(event.wait,))
+    thread.start()
+    while not executor.pending:
+        sleep(0.01)
+    with pytest.raises(HashingPoolSaturated) as exc:
+        executor.run(bcrypt.generate_password_hash, 'password')
+    event.set()
+    thread.join()
+    assert ('Retry-After', '3') in exc.value.get_headers()
+    assert executor.pending == 0
+
+
+def test_import_hashing_uses_own_pool(test_app):
+    with mock.patch.object(bcrypt.executor, 'map', side_effect=AssertionError), \
+            mock.patch.object(bcrypt.executor, 'run', side_effect=AssertionError):
+        hashes = bcrypt.generate_password_hashes(['first', 'second'])
+    assert bcrypt.import_executor.size == test_app.config['PASSWORD_IMPORT_HASHING_POOL_SIZE']
+    assert bcrypt.check_password_hash(hashes[0], 'first') and bcrypt.check_password_hash(hashes[1], 'second')
+
+
 def test_get_correct_user(test_app, test_db):
     user = UserFactory(password='password')
     client = test_app.test_client()
@@ -106,6 +144,38 @@ def test_get_list_users(test_app, test_db, count):
     assert count == len(data)
 
 
+def test_get_list_users_by_pages(test_app, test_db):
+    users = UserFactory.create_batch(5, password='password')
+    client = test_app.test_client()
+    resp = client.get('/users?limit=3')
+    first_page = json.loads(resp.data.decode())
+    assert resp.status_code == 200
+    assert len(first_page) == 3
+
+    resp = client.get(f'/users?limit=3&cursor={resp.headers["X-Next-Cursor"]}')
+    second_page = json.loads(resp.data.decode())
+    assert resp.status_code == 200
+    assert 'X-Next-Cursor' not in resp.headers
+    assert sorted(user['id'] for user in first_page + second_page) == sorted(str(user.id) for user in users)
+
+
+def test_get_list_users_ndjson(test_app, test_db):
+    UserFactory.create_batch(3, password='password')
+    client = test_app.test_client()
+    resp = client.get('/users', headers={'Accept': 'application/x-ndjson'})
+    lines = resp.data.decode().splitlines()
+    assert resp.status_code == 200
+    assert resp.mimetype == 'application/x-ndjson'
+    assert len(lines) == 3
+    assert 'username' in json.loads(lines[0])
+
+
+def test_get_list_users_incorrect_cursor(test_app):
+    client = test_app.test_client()
+    resp = client.get('/users?cursor=abracadabra')
+    assert resp.status_code == 400
+
+
 def test_correct_change_password(test_app, test_db, user_headers):
     client = test_app.test_client()
     user_data = {
@@ -155,6 +225,18 @@ def test_history_correct_user(test_app, test_db):
     assert len(user.history) == 1
 
 
+def test_history_by_pages(test_app, test_db):
+    client = test_app.test_client()
+    user = UserFactory(password='password')
+    history = HistoryFactory.create_batch(3, user=user)
+    resp = client.get(f'/users/{user.id}/history?limit=2')
+    data = json.loads(resp.data.decode())
+    assert resp.status_code == 200
+    assert len(data) == 2
+    assert data[0]['created'] == max(item.created for item in history).isoformat()
+    assert 'X-Next-Cursor' in resp.headers
+
+
 def test_history_inorrect_user(test_app, test_db):
     client = test_app.test_client()
     user_id = uuid4()
@@ -165,3 +247,164 @@ def test_history_inorrect_user(test_app, test_db):
     data = json.loads(resp.data.decode())
     assert resp.status_code == 404
     assert f'Пользователя {user_id} не существует.' == data['message']
+
+
+def test_bulk_import_users(test_app, test_db, user_admin_headers):
+    client = test_app.test_client()
+    user = UserFactory(password='password')
+    pw_hash = bcrypt.generate_password_hash('hashed').decode('utf-8')
+    records = [
+        {'username': 'first', 'email': 'first@prg.re', 'password': 'qwerty'},
+        {'username': 'second', 'email': 'second@prg.re', 'password_hash': pw_hash},
+        {'username': user.username, 'email': 'sa@prg.re', 'password': 'qwerty'},
+        {'username': 'third', 'password': 'qwerty'},
+    ]
+    resp = client.post(
+        '/users/bulk',
+        data='\n'.join(json.dumps(record) for record in records),
+        content_type='application/x-ndjson',
+        headers=user_admin_headers,
+    )
+    data = json.loads(resp.data.decode())
+    assert resp.status_code == 200
+    assert data['created'] == 2
+    assert [failure['line'] for failure in data['failed']] == [4, 3]
+    assert UserService().get_user_by_username('first').check_password('qwerty')
+    assert UserService().get_user_by_username('second').check_password('hashed')
+
+
+def test_bulk_import_users_from_csv(test_app, test_db, user_admin_headers):
+    client = test_app.test_client()
+    resp = client.post(
+        '/users/bulk',
+        data='username,email,password\nfirst,first@prg.re,qwerty\n',
+        content_type='text/csv',
+        headers=user_admin_headers,
+    )
+    data = json.loads(resp.data.decode())
+    assert resp.status_code == 200
+    assert data == {'created': 1, 'failed': []}
+
+
+def test_bulk_import_unsupported_format(test_app, test_db, user_admin_headers):
+    client = test_app.test_client()
+    resp = client.post('/users/bulk', data='{}', content_type='application/json', headers=user_admin_headers)
+    assert resp.status_code == 415
+
+
+@pytest.mark.parametrize(
+    'record',
+    [{'email': 'sa@prg.re', 'password': 'qwerty'},
+     {'username': 'qwerty', 'email': 'sa@prg.re'},
+     {'username': 'qwerty', 'email': 'sa@prg.re', 'password_hash': 'qwerty'},
+     {'username': 1, 'email': 'sa@prg.re', 'password': 'qwerty'},
+     ],
+)
+def test_import_invalid_record(record):
+    assert UserImportService.validate(record)
+
+
+@pytest.fixture
+def username_filter(test_app, test_redis):
+    service = UsernameFilter()
+    service._bloom = BloomFilter(100)
+    return service
+
+
+def test_username_filter_rejects_unknown_username(username_filter):
+    username_filter.add('known')
+    assert username_filter.might_exist('known')
+    assert not username_filter.might_exist('unknown')
+    assert not username_filter.might_exist('')
+
+
+def test_username_filter_sees_usernames_added_by_other_workers(username_filter):
+    UsernameFilter().add('registered_elsewhere')
+    assert username_filter.might_exist('registered_elsewhere')
+    assert 'registered_elsewhere' in username_filter.bloom
+
+
+def test_username_filter_without_redis(username_filter):
+    with mock.patch('app.services.users.redis_client.zscore', side_effect=ConnectionError):
+        assert username_filter.might_exist('unknown')
+
+
+def test_username_filter_is_not_built_in_request(test_app, test_db):
+    service = UsernameFilter()
+    with assert_num_queries(0):
+        assert service.might_exist('unknown')
+    assert service.bloom is None
+
+
+def test_username_filter_is_built_in_background(test_app, test_db, test_redis):
+    UserFactory(username='known', password='password')
+    test_db.session.commit()
+    service = UsernameFilter()
+    with mock.patch('app.services.users.sleep', side_effect=SystemExit), \
+            mock.patch.dict(test_app.config, {'TESTING': False}), \
+            mock.patch('app.services.users.Thread') as thread:
+        service.init_app(test_app)
+        thread.assert_called_once_with(target=service._refresh, args=(test_app,), daemon=True)
+        with pytest.raises(SystemExit):
+            service._refresh(test_app)
+    assert service.might_exist('known')
+    assert not service.might_exist('unknown')
+
+
+def test_bloom_filter_reports_memory_and_false_positive_rate():
+    bloom = BloomFilter.from_items((str(i) for i in range(1000)), capacity=1000, error_rate=0.01)
+    assert bloom.memory == len(bloom.bits) < 1300
+    assert 0.005 < bloom.false_positive_rate < 0.02
+
+
+def test_auth_unknown_user_skips_database(test_app, test_db, auth_headers):
+    UserFactory(username='known', password='password')
+    users_filter.rebuild()
+    client = test_app.test_client()
+    with mock.patch.object(bcrypt, 'check_dummy_password', return_value=False) as check_dummy, \
+            assert_num_queries(0):
+        resp = client.post(
+            '/auth/login',
+            data=json.dumps({'username': 'unknown', 'password': 'password'}),
+            content_type='application/json',
+            headers=auth_headers,
+        )
+    assert resp.status_code == 404
+    check_dummy.assert_called_once_with('password')
+
+
+def test_bulk_import_updates_username_filter(test_app, test_db):
+    UserImportService().import_users([(1, {'username': 'imported', 'email': 'i@i.ru', 'password': 'password'})])
+    assert users_filter.might_exist('imported')
+
+
+def test_bulk_import_reports_only_failed_rows(test_app, test_db):
+    hash_passwords = bcrypt.generate_password_hashes
+
+    def register_concurrently(passwords):
+        # Пока хешируются пароли, «second» успевает зарегистрироваться через API.
+        UserFactory(username='second', password='password')
+        test_db.session.commit()
+        return hash_passwords(passwords)
+
+    records = [(line, {'username': username, 'email': f'{username}@prg.re', 'password': 'qwerty'})
+               for line, username in enumerate(('first', 'second', 'third'), start=1)]
+    with mock.patch.object(bcrypt, 'generate_password_hashes', side_effect=register_concurrently):
+        report = UserImportService().import_users(records)
+    assert report['created'] == 2
+    assert [(failure['line'], failure['username']) for failure in report['failed']] == [(2, 'second')]
+    assert UserService().get_user_by_username('third').check_password('qwerty')
+
+
+def test_import_command_sizes_import_pool(test_app, test_db, tmp_path):
+    path = tmp_path / 'users.ndjson'
+    path.write_text(json.dumps({'username': 'imported', 'email': 'i@i.ru', 'password': 'password'}))
+    size = bcrypt.import_executor.size
+    try:
+        result = test_app.test_cli_runner().invoke(args=['users', 'import', str(path), '--workers', '3'])
+        assert bcrypt.import_executor.size == 3
+    finally:
+        bcrypt.import_executor.init_app(test_app)
+    assert result.exit_code == 0, result.output
+    assert 'Создано: 1, ошибок: 0.' in result.output
+    assert bcrypt.import_executor.size == size
@@ -0,0 +1,59 @@
+import json
+from unittest import mock
+
+import pytest
+from jsonschema import Draft4Validator
+
+from app.api import api
+from app.api.validation import _validators
+
+
+def post(client, url, payload, headers):
+    return client.post(url, data=json.dumps(payload), content_type='application/json', headers=headers)
+
+
+def test_validators_compiled_at_startup():
+    assert {'Login User', 'Refresh token', 'User post', 'Updated Users', 'Introspect'} <= set(_validators)
+    assert set(_validators) == set(api.models)
+
+
+@pytest.mark.parametrize(
+    'url, payload',
+    [
+        ('/auth/login', {}),
+        ('/auth/login', {'username': 1, 'password': None}),
+        ('/auth/refresh', []),
+        ('/auth/register', {'username': 'user', 'password': 'password'}),
+        ('/users', {'username': 'user', 'password': 'password', 'email': 1, 'active': 'yes'}),
+    ]
+)
+def test_validation_errors_match_restx(test_app, auth_headers, url, payload):
+    client = test_app.test_client()
+    resp = post(client, url, payload, auth_headers)
+    data = json.loads(resp.data.decode())
+    model = {
+        '/auth/login': 'Login User', '/auth/refresh': 'Refresh token',
+        '/auth/register': 'User', '/users': 'User post',
+    }[url]
+    validator = Draft4Validator(api.models[model].__schema__, resolver=api.refresolver)
+    assert resp.status_code == 400
+    assert data['message'] == 'Input payload validation failed'
+    assert data['errors'] == dict(api.models[model].format_error(e) for e in validator.iter_errors(payload))
+
+
+def test_valid_payload_skips_jsonschema(test_app, auth_headers):
+    client = test_app.test_client()
+    with mock.patch('jsonschema.Draft4Validator.iter_errors') as iter_errors, \
+            mock.patch('app.services.auth.AuthService.auth', return_value=({}, 200)):
+        resp = post(client, '/auth/login', {'username': 'user', 'password': 'password'}, auth_headers)
+    assert resp.status_code == 200
+    iter_errors.assert_not_called()
+
+
+def test_oversized_payload_rejected_before_parsing(test_app, auth_headers):
+    client = test_app.test_client()
+    payload = {'username': 'user', 'password': 'x' * test_app.config['MAX_PAYLOAD_SIZE']}
+    with mock.patch('flask.Request.get_json') as get_json:
+        resp = post(client, '/auth/login', payload, auth_headers)
+    assert resp.status_code == 413
+    get_json.assert_not_called()
@@ -0,0 +1,17 @@
+import pytest
+from fakeredis import FakeStrictRedis
+
+from app import create_app
+from app.bcrypt import bcrypt
+from app.redis import redis_client
+
+
+@pytest.fixture(scope='session')
+def test_app():
+    app = create_app()
+    app.config.from_object('app.settings.TestingConfig')
+    bcrypt.init_app(app)
+    redis_client.provider_class = FakeStrictRedis
+    redis_client.init_app(app)
+    with app.app_context():
+        yield app
@@ -0,0 +1,32 @@
+"""Выпуск и проверка access-токенов."""
+from uuid import uuid4
+
+import pytest
+
+from app.services import JWTService
+
+
+def encode_token():
+    return JWTService.encode_token(user_id=str(uuid4()), roles=['admin', 'service'], is_super=False)
+
+
+@pytest.fixture
+def token(test_app):
+    return encode_token()
+
+
+@pytest.mark.benchmark(group='jwt')
+def test_encode_token(benchmark, test_app):
+    benchmark(encode_token)
+
+
+@pytest.mark.benchmark(group='jwt')
+def test_decode_token(benchmark, token):
+    claims = benchmark(JWTService.decode_token, token)
+    assert claims['roles'] == ['admin', 'service']
+
+
+@pytest.mark.benchmark(group='jwt')
+def test_decode_token_cached(benchmark, token):
+    claims = benchmark(JWTService.decode_token_cached, token)
+    assert claims['roles'] == ['admin', 'service']
@@ -0,0 +1,40 @@
+"""Хеширование паролей при разной стоимости bcrypt и фильтрация полей моделей."""
+import pytest
+
+from app.bcrypt import bcrypt
+from app.models import Profile, User
+
+ROUNDS = (4, 8, 10, 12)
+
+
+@pytest.fixture
+def log_rounds(request, test_app):
+    previous = bcrypt._log_rounds
+    bcrypt._log_rounds = request.param
+    yield request.param
+    bcrypt._log_rounds = previous
+
+
+@pytest.mark.benchmark(group='bcrypt hash')
+@pytest.mark.parametrize('log_rounds', ROUNDS, indirect=True)
+def test_hash_password(benchmark, log_rounds):
+    password_hash = benchmark(User.hash_password, 'password')
+    assert bcrypt.get_rounds(password_hash) == log_rounds
+
+
+@pytest.mark.benchmark(group='bcrypt check')
+@pytest.mark.parametrize('log_rounds', ROUNDS, indirect=True)
+def test_check_password(benchmark, log_rounds):
+    user = User(password='password', username='user')
+    assert benchmark(user.check_password, 'password')
+
+
+@pytest.mark.benchmark(group='filter_kwargs')
+@pytest.mark.parametrize('model', [User, Profile], ids=['user', 'profile'])
+def test_filter_kwargs(benchmark, test_app, model):
+    data = {
+        'id': None, 'created': None, 'updated': None, 'username': 'user', 'password': 'password',
+        'email': 'user@example.com', 'active': True, 'is_super': False, 'fingerprint': 'fingerprint',
+    }
+    filtered = benchmark(model.filter_kwargs, data, exclude=['id', 'created', 'updated'])
+    assert set(filtered) <= model.fields_name() - {'id', 'created', 'updated'}
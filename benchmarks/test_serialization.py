@@ -0,0 +1,103 @@
+"""
+Сериализация списка ролей с пользователями: marshal flask-restx + json против
+скомпилированного сериализатора по строкам выборки + orjson.
+Сериализация страниц моделей user, role и history, как их отдаёт API.
+Запуск: pytest benchmarks --benchmark-group-by=group
+"""
+import json
+from collections import namedtuple
+from datetime import datetime, timedelta
+from timeit import repeat
+from types import SimpleNamespace
+from uuid import uuid4
+
+import orjson
+import pytest
+from flask_restx import marshal
+
+from app.api.serializers import get_serializer, serialize
+from app.api.v1.permissions import role
+from app.api.v1.users import history, user
+
+ROLES = 20
+USERS_PER_ROLE = 100
+ROWS = ROLES * (USERS_PER_ROLE + 1)
+
+UserRow = namedtuple('UserRow', ['role_id', 'id', 'username', 'created', 'updated', 'active', 'is_super'])
+
+
+def make_users(role_id):
+    created = datetime(2021, 9, 1)
+    return [
+        UserRow(role_id, uuid4(), f'user{i}', created + timedelta(seconds=i), None, True, False)
+        for i in range(USERS_PER_ROLE)
+    ]
+
+
+@pytest.fixture(scope='module')
+def role_rows():
+    """Роли в том виде, в каком их отдаёт RoleService.get_rows_with_users."""
+    rows = []
+    for i in range(ROLES):
+        role_id = uuid4()
+        rows.append({'id': role_id, 'name': f'role{i}', 'created': datetime(2021, 9, 1),
+                     'updated': None, 'users': make_users(role_id)})
+    return rows
+
+
+@pytest.fixture(scope='module')
+def role_objects(role_rows):
+    """Те же роли объектами с атрибутами, как ORM-модели для marshal."""
+    return [
+        SimpleNamespace(**{**item, 'users': [SimpleNamespace(**user._asdict()) for user in item['users']]})
+        for item in role_rows
+    ]
+
+
+def marshal_json(objects):
+    return json.dumps(marshal(objects, role))
+
+
+def compiled_orjson(rows):
+    serializer = get_serializer(role)
+    return orjson.dumps([serializer(item) for item in rows])
+
+
+@pytest.mark.benchmark(group='role list')
+def test_marshal_json(benchmark, role_objects):
+    benchmark(marshal_json, role_objects)
+
+
+@pytest.mark.benchmark(group='role list')
+def test_compiled_orjson(benchmark, role_rows):
+    benchmark(compiled_orjson, role_rows)
+
+
+def test_compiled_is_five_times_faster(role_objects, role_rows):
+    assert json.loads(compiled_orjson(role_rows)) == json.loads(marshal_json(role_objects))
+    marshal_time = min(repeat(lambda: marshal_json(role_objects), number=3, repeat=5)) / 3
+    compiled_time = min(repeat(lambda: compiled_orjson(role_rows), number=3, repeat=5)) / 3
+    print(f'\nmarshal + json: {marshal_time / ROWS * 1e6:.2f} мкс на строку, '
+          f'compiled + orjson: {compiled_time / ROWS * 1e6:.2f} мкс на строку, '
+          f'в {marshal_time / compiled_time:.1f} раза быстрее')
+    assert marshal_time / compiled_time >= 5
+
+
+def make_history(count):
+    created = datetime(2021, 9, 1)
+    return [
+        SimpleNamespace(id=uuid4(), fingerprint=f'fingerprint{i}', user_agent='Mozilla/5.0',
+                        created=created + timedelta(seconds=i))
+        for i in range(count)
+    ]
+
+
+@pytest.mark.benchmark(group='models')
+@pytest.mark.parametrize('model, objects', [
+    (user, lambda rows: [SimpleNamespace(**user._asdict()) for user in make_users(uuid4())]),
+    (role, lambda rows: rows),
+    (history, lambda rows: make_history(USERS_PER_ROLE)),
+], ids=['user', 'role', 'history'])
+def test_serialize_model(benchmark, role_objects, model, objects):
+    data = objects(role_objects)
+    assert benchmark(serialize, data, model) == marshal(data, model)
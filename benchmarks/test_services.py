@@ -0,0 +1,145 @@
+"""
+Запросы сервисов к базе с данными: USERS пользователей с профилями, ROLES ролей
+и HISTORY_PER_USER записей истории логинов у каждого пользователя.
+"""
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+import pytest
+
+from app.api.serializers import model_columns
+from app.api.v1.permissions import role_columns, user_columns
+from app.api.v1.users import user as user_model
+from app.bcrypt import bcrypt
+from app.db import db
+from app.models import History, Profile, Role, Session, User, users_roles_association
+from app.services import HistoryService, ProfileService, RoleService, SessionService, UserService
+from app.services.sessions import hash_token
+
+USERS = 10000
+ROLES = 20
+USERS_PER_ROLE = 100
+HISTORY_PER_USER = 10
+HISTORY_USERS = 1000
+
+user_service = UserService()
+profile_service = ProfileService()
+role_service = RoleService()
+history_service = HistoryService()
+session_service = SessionService()
+
+
+@pytest.fixture(scope='module')
+def seeded(test_app):
+    """Заполняет базу одним INSERT на таблицу и возвращает идентификаторы для запросов."""
+    db.create_all()
+    password = bcrypt.generate_password_hash('password').decode('utf-8')
+    created = datetime(2021, 9, 1)
+    users = [
+        {'id': uuid4(), 'username': f'user{i}', 'password': password, 'active': True, 'is_super': False,
+         'created': created + timedelta(seconds=i)}
+        for i in range(USERS)
+    ]
+    roles = [{'id': uuid4(), 'name': f'role{i}', 'created': created + timedelta(seconds=i)} for i in range(ROLES)]
+    db.session.execute(User.__table__.insert(), users)
+    db.session.execute(Profile.__table__.insert(), [
+        {'id': uuid4(), 'user_id': item['id'], 'email': f'{item["username"]}@example.com', 'created': created}
+        for item in users
+    ])
+    db.session.execute(Role.__table__.insert(), roles)
+    db.session.execute(users_roles_association.insert(), [
+        {'role_id': item['id'], 'user_id': users[i * USERS_PER_ROLE + j]['id']}
+        for i, item in enumerate(roles) for j in range(USERS_PER_ROLE)
+    ])
+    db.session.execute(History.__table__.insert(), [
+        {'id': uuid4(), 'user_id': item['id'], 'fingerprint': f'fingerprint{j}', 'user_agent': 'Mozilla/5.0',
+         'created': created + timedelta(minutes=j)}
+        for item in users[:HISTORY_USERS] for j in range(HISTORY_PER_USER)
+    ])
+    db.session.execute(Session.__table__.insert(), [
+        {'id': uuid4(), 'user_id': item['id'], 'fingerprint': 'fingerprint', 'user_agent': 'Mozilla/5.0',
+         'refresh_token_hash': hash_token(uuid4().hex), 'family': uuid4(), 'expired': created + timedelta(days=30),
+         'created': created}
+        for item in users[:HISTORY_USERS]
+    ])
+    db.session.commit()
+    yield {'user': users[USERS // 2], 'users': users, 'role': roles[ROLES // 2]}
+    db.session.remove()
+    db.drop_all()
+
+
+@pytest.fixture(autouse=True)
+def clear_session():
+    """Каждый вызов идёт в базу, а не в identity map сессии."""
+    yield
+    db.session.remove()
+
+
+def call(func, *args, **kwargs):
+    result = func(*args, **kwargs)
+    db.session.expunge_all()
+    return result
+
+
+@pytest.mark.benchmark(group='UserService')
+def test_get_user_by_username(benchmark, seeded):
+    user = benchmark(call, user_service.get_user_by_username, seeded['user']['username'])
+    assert user.id == seeded['user']['id']
+
+
+@pytest.mark.benchmark(group='UserService')
+def test_get_user_by_pk(benchmark, seeded):
+    user = benchmark(call, user_service.get_by_pk, seeded['user']['id'])
+    assert user.username == seeded['user']['username']
+
+
+@pytest.mark.benchmark(group='UserService')
+def test_get_by_usernames(benchmark, seeded):
+    usernames = [item['username'] for item in seeded['users'][::USERS // 100]]
+    users = benchmark(call, lambda: user_service.get_by_usernames(usernames).all())
+    assert len(users) == len(usernames)
+
+
+@pytest.mark.benchmark(group='UserService')
+def test_get_users_page(benchmark, seeded):
+    columns = model_columns(User, user_model)
+    users, cursor = benchmark(call, user_service.get_page, limit=100, columns=columns)
+    assert len(users) == 100 and cursor
+
+
+@pytest.mark.benchmark(group='ProfileService')
+def test_get_profile_by_email(benchmark, seeded):
+    profile = benchmark(call, profile_service.get_by_email, f'{seeded["user"]["username"]}@example.com')
+    assert profile.user_id == seeded['user']['id']
+
+
+@pytest.mark.benchmark(group='RoleService')
+def test_get_role_by_name(benchmark, seeded):
+    role = benchmark(call, role_service.get_role_by_name, seeded['role']['name'])
+    assert role.id == seeded['role']['id']
+
+
+@pytest.mark.benchmark(group='RoleService')
+def test_get_rows_with_users(benchmark, seeded):
+    roles = benchmark(call, role_service.get_rows_with_users, role_columns, user_columns)
+    assert len(roles) == ROLES and all(len(item['users']) == USERS_PER_ROLE for item in roles)
+
+
+@pytest.mark.benchmark(group='RoleService')
+def test_get_roles_with_users_orm(benchmark, seeded):
+    roles = benchmark(call, role_service.get_all, 'with_users')
+    assert len(roles) == ROLES
+
+
+@pytest.mark.benchmark(group='HistoryService')
+def test_get_history_page(benchmark, seeded):
+    user = user_service.get_by_pk(seeded['users'][0]['id'])
+    items, _ = benchmark(call, history_service.get_page, history_service.get_by_user(user), 100, descending=True)
+    assert len(items) == HISTORY_PER_USER
+
+
+@pytest.mark.benchmark(group='SessionService')
+def test_get_session_by_user(benchmark, seeded):
+    user = user_service.get_by_pk(seeded['users'][0]['id'])
+    session = benchmark(call, session_service.get_by_user, user, 'fingerprint', 'Mozilla/5.0')
+    assert session.user_id == user.id
@@ -7,9 +7,15 @@ export FLASK_ENV
 
 flask db upgrade -d /app/migrations/
 
+# Метрики воркеров собираются через файлы в общем каталоге, старые значения от прошлого запуска удаляются.
+export PROMETHEUS_MULTIPROC_DIR="${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus}"
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
 
 /usr/local/bin/uwsgi --master \
   --single-interpreter \
+  --lazy-apps \
   --workers 4 \
   --gevent 100 \
   --protocol http \
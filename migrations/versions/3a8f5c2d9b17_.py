@@ -0,0 +1,32 @@
+"""refresh token families and expiry index on sessions
+
+Revision ID: 3a8f5c2d9b17
+Revises: b7d3e1f08a92
+Create Date: 2021-09-12 14:27:10.318455
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '3a8f5c2d9b17'
+down_revision = 'b7d3e1f08a92'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('sessions', sa.Column('family', postgresql.UUID(as_uuid=True), nullable=True))
+    # У существующих сессий ротаций ещё не было: каждая — отдельное семейство.
+    op.execute('UPDATE sessions SET family = id')
+    op.alter_column('sessions', 'family', nullable=False)
+    op.create_index('ix_sessions_family', 'sessions', ['family'], unique=False)
+    op.create_index('ix_sessions_expired', 'sessions', ['expired'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_sessions_expired', table_name='sessions')
+    op.drop_index('ix_sessions_family', table_name='sessions')
+    op.drop_column('sessions', 'family')
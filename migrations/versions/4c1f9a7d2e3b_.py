@@ -0,0 +1,26 @@
+"""keyset pagination indexes
+
+Revision ID: 4c1f9a7d2e3b
+Revises: 20140a07e2d7
+Create Date: 2021-09-06 12:14:37.219043
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4c1f9a7d2e3b'
+down_revision = '20140a07e2d7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_users_created_id', 'users', ['created', 'id'], unique=False)
+    op.create_index('ix_history_user_id_created_id', 'history', ['user_id', 'created', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_history_user_id_created_id', table_name='history')
+    op.drop_index('ix_users_created_id', table_name='users')
@@ -0,0 +1,49 @@
+"""indexes for hot lookup columns
+
+Revision ID: 9e2b6c4a1f05
+Revises: 4c1f9a7d2e3b
+Create Date: 2021-09-08 18:42:05.530612
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '9e2b6c4a1f05'
+down_revision = '4c1f9a7d2e3b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_sessions_refresh_token', 'sessions', ['refresh_token'], unique=True)
+    op.create_index('ix_sessions_user_id_fingerprint_user_agent', 'sessions',
+                    ['user_id', 'fingerprint', 'user_agent'], unique=False)
+    op.create_index('ix_history_created', 'history', ['created'], unique=False)
+    op.create_index('ix_profiles_email', 'profiles', ['email'], unique=False)
+
+    # Первичный ключ на users_roles: убираем дубли и пустые связи.
+    op.execute(
+        'DELETE FROM users_roles WHERE user_id IS NULL OR role_id IS NULL'
+    )
+    op.execute(
+        'DELETE FROM users_roles a USING users_roles b '
+        'WHERE a.ctid < b.ctid AND a.user_id = b.user_id AND a.role_id = b.role_id'
+    )
+    op.alter_column('users_roles', 'user_id', existing_type=postgresql.UUID(), nullable=False)
+    op.alter_column('users_roles', 'role_id', existing_type=postgresql.UUID(), nullable=False)
+    op.create_primary_key('users_roles_pkey', 'users_roles', ['user_id', 'role_id'])
+    op.create_index('ix_users_roles_role_id', 'users_roles', ['role_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_users_roles_role_id', table_name='users_roles')
+    op.drop_constraint('users_roles_pkey', 'users_roles', type_='primary')
+    op.alter_column('users_roles', 'role_id', existing_type=postgresql.UUID(), nullable=True)
+    op.alter_column('users_roles', 'user_id', existing_type=postgresql.UUID(), nullable=True)
+    op.drop_index('ix_profiles_email', table_name='profiles')
+    op.drop_index('ix_history_created', table_name='history')
+    op.drop_index('ix_sessions_user_id_fingerprint_user_agent', table_name='sessions')
+    op.drop_index('ix_sessions_refresh_token', table_name='sessions')
@@ -0,0 +1,94 @@
+"""monthly range partitioning of history
+
+Revision ID: b7d3e1f08a92
+Revises: 9e2b6c4a1f05
+Create Date: 2021-09-10 11:03:51.884102
+
+"""
+from datetime import date
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d3e1f08a92'
+down_revision = '9e2b6c4a1f05'
+branch_labels = None
+depends_on = None
+
+PARTITIONS_AHEAD = 3
+
+
+def add_months(month: date, months: int) -> date:
+    month_index = month.year * 12 + month.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def upgrade():
+    op.execute('ALTER TABLE history RENAME TO history_old')
+    op.execute('ALTER TABLE history_old RENAME CONSTRAINT history_pkey TO history_old_pkey')
+    op.execute('ALTER TABLE history_old RENAME CONSTRAINT history_user_id_fkey TO history_old_user_id_fkey')
+    op.drop_index('ix_history_user_id_created_id', table_name='history_old')
+    op.drop_index('ix_history_created', table_name='history_old')
+
+    op.execute(
+        'CREATE TABLE history ('
+        ' id UUID NOT NULL,'
+        ' created TIMESTAMP WITHOUT TIME ZONE NOT NULL,'
+        ' updated TIMESTAMP WITHOUT TIME ZONE,'
+        ' fingerprint VARCHAR(255) NOT NULL,'
+        ' user_agent VARCHAR(255) NOT NULL,'
+        ' user_id UUID,'
+        ' CONSTRAINT history_pkey PRIMARY KEY (id, created),'
+        ' CONSTRAINT history_user_id_fkey FOREIGN KEY (user_id) REFERENCES users (id)'
+        ') PARTITION BY RANGE (created)'
+    )
+    op.create_index('ix_history_user_id_created_id', 'history', ['user_id', 'created', 'id'], unique=False)
+    op.create_index('ix_history_created', 'history', ['created'], unique=False)
+
+    first = op.get_bind().execute(sa.text("SELECT date_trunc('month', min(created)) FROM history_old")).scalar()
+    month = date(first.year, first.month, 1) if first else date.today().replace(day=1)
+    last = add_months(date.today().replace(day=1), PARTITIONS_AHEAD)
+    while month <= last:
+        op.execute(
+            f'CREATE TABLE history_{month:%Y_%m} PARTITION OF history '
+            f"FOR VALUES FROM ('{month}') TO ('{add_months(month, 1)}')"
+        )
+        month = add_months(month, 1)
+    op.execute('CREATE TABLE history_default PARTITION OF history DEFAULT')
+
+    op.execute(
+        'INSERT INTO history (id, created, updated, fingerprint, user_agent, user_id) '
+        'SELECT id, created, updated, fingerprint, user_agent, user_id FROM history_old'
+    )
+    op.drop_table('history_old')
+
+
+def downgrade():
+    op.execute('ALTER TABLE history RENAME TO history_partitioned')
+    op.execute('ALTER TABLE history_partitioned RENAME CONSTRAINT history_pkey TO history_partitioned_pkey')
+    op.execute('ALTER TABLE history_partitioned '
+               'RENAME CONSTRAINT history_user_id_fkey TO history_partitioned_user_id_fkey')
+    op.drop_index('ix_history_user_id_created_id', table_name='history_partitioned')
+    op.drop_index('ix_history_created', table_name='history_partitioned')
+
+    op.execute(
+        'CREATE TABLE history ('
+        ' id UUID NOT NULL,'
+        ' created TIMESTAMP WITHOUT TIME ZONE NOT NULL,'
+        ' updated TIMESTAMP WITHOUT TIME ZONE,'
+        ' fingerprint VARCHAR(255) NOT NULL,'
+        ' user_agent VARCHAR(255) NOT NULL,'
+        ' user_id UUID,'
+        ' CONSTRAINT history_pkey PRIMARY KEY (id),'
+        ' CONSTRAINT history_user_id_fkey FOREIGN KEY (user_id) REFERENCES users (id)'
+        ')'
+    )
+    op.execute(
+        'INSERT INTO history (id, created, updated, fingerprint, user_agent, user_id) '
+        'SELECT id, created, updated, fingerprint, user_agent, user_id FROM history_partitioned'
+    )
+    op.create_index('ix_history_user_id_created_id', 'history', ['user_id', 'created', 'id'], unique=False)
+    op.create_index('ix_history_created', 'history', ['created'], unique=False)
+    op.execute('DROP TABLE history_partitioned')
@@ -0,0 +1,35 @@
+"""store sha256 of refresh tokens in sessions
+
+Revision ID: c5e8a2d4f716
+Revises: 3a8f5c2d9b17
+Create Date: 2021-09-16 10:42:37.210894
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5e8a2d4f716'
+down_revision = '3a8f5c2d9b17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('sessions', sa.Column('refresh_token_hash', sa.String(length=64), nullable=True))
+    op.execute("UPDATE sessions SET refresh_token_hash = encode(sha256(convert_to(refresh_token, 'UTF8')), 'hex')")
+    op.alter_column('sessions', 'refresh_token_hash', nullable=False)
+    op.create_index('ix_sessions_refresh_token_hash', 'sessions', ['refresh_token_hash'], unique=True)
+    op.drop_index('ix_sessions_refresh_token', table_name='sessions')
+    op.drop_column('sessions', 'refresh_token')
+
+
+def downgrade():
+    # Токены по хешу не восстановить: после отката сессии из таблицы недействительны.
+    op.add_column('sessions', sa.Column('refresh_token', sa.String(length=255), nullable=True))
+    op.execute('UPDATE sessions SET refresh_token = refresh_token_hash')
+    op.alter_column('sessions', 'refresh_token', nullable=False)
+    op.create_index('ix_sessions_refresh_token', 'sessions', ['refresh_token'], unique=True)
+    op.drop_index('ix_sessions_refresh_token_hash', table_name='sessions')
+    op.drop_column('sessions', 'refresh_token_hash')